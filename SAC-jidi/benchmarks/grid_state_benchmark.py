@@ -0,0 +1,84 @@
+"""
+Benchmark of the grid games (SnakeEatBeans, GoBang, Reversi, Sokoban) with the nested list current_state and with
+the ndarray one (conf['array_state']).
+
+Plays the same random joint actions from the same seeds in both modes, checks that the states are identical and
+reports env steps/sec, the time of get_render_data on the final state and of is_not_valid_grid_observation.
+
+Example:
+    python benchmarks/grid_state_benchmark.py --envs snakes_3v3 gobang_1v1 --steps 2000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import timeit
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from env.gobang import GoBang  # noqa: E402
+from env.reversi import Reversi  # noqa: E402
+from env.snakes import SnakeEatBeans  # noqa: E402
+from env.sokoban import Sokoban  # noqa: E402
+
+CLASSES = {'SnakeEatBeans': SnakeEatBeans, 'GoBang': GoBang, 'Reversi': Reversi, 'Sokoban': Sokoban}
+
+
+def make(conf, array_state, seed=0):
+    conf = dict(conf, array_state=array_state)
+    random.seed(seed)
+    np.random.seed(seed)
+    return CLASSES[conf['class_literal']](conf)
+
+
+def random_joint_actions(g, steps, seed=1):
+    rng = np.random.RandomState(seed)
+    return [[[np.eye(space.n, dtype=int)[rng.randint(space.n)].tolist() for space in g.get_single_action_space(p)]
+             for p in range(g.n_player)] for _ in range(steps)]
+
+
+def play(g, joint_actions, states=None):
+    start = time.perf_counter()
+    for joint_action in joint_actions:
+        if g.is_terminal():
+            g.reset()
+        g.step(joint_action)
+        if states is not None:
+            states.append(np.array(g.current_state))
+    return len(joint_actions) / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    with open(os.path.join(Path(__file__).resolve().parent.parent, 'env', 'config.json')) as f:
+        confs = json.load(f)
+    parser = argparse.ArgumentParser('Grid state benchmark')
+    parser.add_argument('--envs', nargs='+', default=['snakes_3v3', 'snakes_5p', 'gobang_1v1', 'reversi_1v1',
+                                                      'sokoban_2p'])
+    parser.add_argument('--steps', type=int, default=2000, help='Env steps per measurement')
+    args = parser.parse_args()
+
+    print('{:>12s} {:>14s} {:>14s} {:>8s} {:>12s} {:>12s} {:>12s} {:>12s}'.format(
+        'env', 'list steps/s', 'array steps/s', 'speedup', 'list render', 'array render', 'list valid',
+        'array valid'))
+    for name in args.envs:
+        conf = confs[name]
+        joint_actions = random_joint_actions(make(conf, False), args.steps)
+        traces = [[], []]
+        for array_state, trace in zip((False, True), traces):
+            play(make(conf, array_state), joint_actions, trace)
+        assert all((a == b).all() for a, b in zip(*traces)), name
+        rates, render, valid = [], [], []
+        for array_state in (False, True):
+            g = make(conf, array_state)
+            rates.append(play(g, joint_actions))
+            render.append(1e6 * min(timeit.repeat(lambda: g.get_render_data(g.current_state), number=200, repeat=3))
+                          / 200)
+            obs = g.empty_state()  # the states of some configurations exceed their cell_range
+            valid.append(1e6 * min(timeit.repeat(lambda: g.is_not_valid_grid_observation(obs, 0), number=200,
+                                                 repeat=3)) / 200)
+        print('{:>12s} {:>14.0f} {:>14.0f} {:>7.1f}x {:>10.1f}us {:>10.1f}us {:>10.1f}us {:>10.1f}us'.format(
+            name, rates[0], rates[1], rates[1] / rates[0], render[0], render[1], valid[0], valid[1]))
@@ -0,0 +1,79 @@
+"""
+Benchmark of the joint action selection of n agents sharing a policy: one choose_action_to_env call (batch-1 forward
+pass and one-hot list) per agent against a single batched Baseagent.choose_joint_action call.
+
+The policy is a greedy categorical MLP actor (as SAC in evaluation mode) with choose_action and choose_actions.
+
+Example:
+    python benchmarks/joint_action_benchmark.py --agents 6 20 64
+"""
+import argparse
+import sys
+import time
+import types
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'examples'))
+from agents.baseagent import Baseagent  # noqa: E402
+from agents.multiagents import MultiRLAgents  # noqa: E402
+
+
+class GreedyPolicy(object):
+    def __init__(self, obs_dim, hidden_size, action_dim):
+        self.net = nn.Sequential(nn.Linear(obs_dim, hidden_size), nn.ReLU(), nn.Linear(hidden_size, hidden_size),
+                                 nn.ReLU(), nn.Linear(hidden_size, action_dim))
+
+    def choose_action(self, state, train=True):
+        with torch.no_grad():
+            state = torch.tensor(state, dtype=torch.float).view(1, -1)
+            return torch.argmax(self.net(state)).item()
+
+    def choose_actions(self, states, train=True):
+        with torch.no_grad():
+            states = torch.as_tensor(np.asarray(states, dtype=np.float32)).view(len(states), -1)
+            return torch.argmax(self.net(states), dim=1).tolist()
+
+
+def rate(function, seconds):
+    function()
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        function()
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Joint action benchmark')
+    parser.add_argument('--agents', type=int, nargs='+', default=[6, 20, 64], help='Numbers of controlled agents')
+    parser.add_argument('--obs-dim', type=int, default=26, help='Observation size')
+    parser.add_argument('--hidden-size', type=int, default=64)
+    parser.add_argument('--action-dim', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=2., help='Measuring time per configuration')
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    policy = GreedyPolicy(args.obs_dim, args.hidden_size, args.action_dim)
+    print('{:>8s} {:>16s} {:>16s} {:>8s}'.format('agents', 'per agent [1/s]', 'batched [1/s]', 'speedup'))
+    for n in args.agents:
+        agent = MultiRLAgents.__new__(MultiRLAgents)
+        Baseagent.__init__(agent, types.SimpleNamespace(action_continuous=False, action_space=[args.action_dim] * n))
+        agent.algo = types.SimpleNamespace(agents=[policy] * n)
+        agent.set_agent()
+        rng = np.random.RandomState(0)
+        all_observes = [{"obs": rng.randn(args.obs_dim).tolist(), "controlled_player_index": i} for i in range(n)]
+
+        def per_agent():
+            return [[agent.choose_action_to_env(observation, False)] for observation in all_observes]
+
+        def batched():
+            return agent.choose_joint_action(all_observes, False)
+
+        assert per_agent() == batched()
+        slow, fast = rate(per_agent, args.seconds), rate(batched, args.seconds)
+        print('{:>8d} {:>16.0f} {:>16.0f} {:>7.1f}x'.format(n, slow, fast, fast / slow))
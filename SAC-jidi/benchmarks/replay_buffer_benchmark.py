@@ -0,0 +1,127 @@
+"""
+Benchmark of the columnar Replay_buffer of examples/common/buffer.py against the list based buffer it replaces.
+
+Fills both buffers with transitions of a discrete SAC-like agent and reports inserts/sec (of a full buffer, i.e. every
+insert evicts the oldest transition), the batch preparation (sample and conversion to torch tensors) per second and
+learn() calls per second of a critic update with two Q-MLPs, for the batch sizes --batch-sizes.
+
+Example:
+    python benchmarks/replay_buffer_benchmark.py --batch-sizes 256 1024 --obs-dim 64
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'examples'))
+from common.buffer import Replay_buffer  # noqa: E402
+
+PROPERTIES = ['states', 'states_next', 'rewards', 'dones', 'action']
+
+
+class ListBuffer(object):
+    """
+    Reference implementation of the former list based Replay_buffer (one list per property, pop(0) when full)
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.data = {p: [] for p in PROPERTIES}
+
+    def insert(self, item_name, agent_id, data):
+        column = self.data[item_name]
+        if len(column) >= self.max_size:
+            column.pop(0)
+        column.append(data)
+
+    def sample(self, batch_size):
+        ind = np.random.randint(0, len(self.data['action']), size=batch_size)
+        return {p: [self.data[p][i] for i in ind] for p in PROPERTIES}
+
+
+def batch_from_lists(data, batch_size):
+    # conversion of SAC.learn before the columnar buffer
+    obs = torch.tensor(np.array(data['states']), dtype=torch.float)
+    obs_ = torch.tensor(np.array(data['states_next']), dtype=torch.float)
+    action = torch.tensor(np.array(data['action']), dtype=torch.long).view(batch_size, -1)
+    reward = torch.tensor(np.array(data['rewards']).reshape(-1, 1), dtype=torch.float)
+    done = torch.tensor(np.array(data['dones']).reshape(-1, 1), dtype=torch.float)
+    return obs, obs_, action, reward, done
+
+
+def batch_from_columns(data, batch_size):
+    return (data['states'].float(), data['states_next'].float(), data['action'].long().view(batch_size, -1),
+            data['rewards'].float().view(-1, 1), data['dones'].float().view(-1, 1))
+
+
+def fill(buffer, steps, obs_dim, num_actions):
+    rng = np.random.RandomState(0)
+    start = time.perf_counter()
+    for _ in range(steps):
+        buffer.insert('states', 0, rng.randn(obs_dim))
+        buffer.insert('states_next', 0, rng.randn(obs_dim))
+        buffer.insert('rewards', 0, [float(rng.randn())])
+        buffer.insert('dones', 0, False)
+        buffer.insert('action', 0, int(rng.randint(num_actions)))
+    return steps / (time.perf_counter() - start)
+
+
+def rate(function, seconds=2.):
+    function()
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        function()
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Replay buffer benchmark')
+    parser.add_argument('--capacity', type=int, default=100_000, help='Buffer capacity (transitions)')
+    parser.add_argument('--obs-dim', type=int, default=64, help='Observation size')
+    parser.add_argument('--num-actions', type=int, default=5, help='Number of discrete actions')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[256, 1024])
+    parser.add_argument('--seconds', type=float, default=2., help='Measuring time per configuration')
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    buffers = {'list': ListBuffer(args.capacity), 'columnar': Replay_buffer(
+        args.capacity, ['action'],
+        dtypes={'states': np.float32, 'states_next': np.float32, 'rewards': np.float32, 'dones': np.float32})}
+    buffers['columnar'].init_item_buffers()
+    inserts = {}
+    for name, buffer in buffers.items():
+        fill(buffer, args.capacity, args.obs_dim, args.num_actions)
+        inserts[name] = fill(buffer, args.capacity // 10, args.obs_dim, args.num_actions)
+    print('inserts/s (full buffer): list {:.0f}, columnar {:.0f}'.format(inserts['list'], inserts['columnar']))
+
+    q1, q2 = [nn.Sequential(nn.Linear(args.obs_dim, 256), nn.ReLU(), nn.Linear(256, args.num_actions))
+              for _ in range(2)]
+    optimizer = torch.optim.Adam(list(q1.parameters()) + list(q2.parameters()), lr=1e-4)
+
+    def sample(name, batch_size):
+        if name == 'list':
+            return batch_from_lists(buffers[name].sample(batch_size), batch_size)
+        return batch_from_columns(buffers[name].sample(batch_size, as_tensor=True), batch_size)
+
+    def learn(name, batch_size):
+        obs, obs_, action, reward, done = sample(name, batch_size)
+        with torch.no_grad():
+            target = reward + (1 - done) * 0.99 * torch.min(q1(obs_), q2(obs_)).max(1, keepdim=True)[0]
+        loss = ((q1(obs).gather(1, action) - target) ** 2).mean() + ((q2(obs).gather(1, action) - target) ** 2).mean()
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+    print('{:>10s} {:>14s} {:>14s} {:>8s} {:>14s} {:>14s} {:>8s}'.format(
+        'batch', 'list batch/s', 'column batch/s', 'speedup', 'list learn/s', 'column learn/s', 'speedup'))
+    for batch_size in args.batch_sizes:
+        batches = [rate(lambda: sample(name, batch_size), args.seconds) for name in buffers]
+        learns = [rate(lambda: learn(name, batch_size), args.seconds) for name in buffers]
+        print('{:>10d} {:>14.0f} {:>14.0f} {:>7.1f}x {:>14.0f} {:>14.0f} {:>7.1f}x'.format(
+            batch_size, batches[0], batches[1], batches[1] / batches[0], learns[0], learns[1], learns[1] / learns[0]))
@@ -0,0 +1,67 @@
+"""
+Benchmark of SnakeEatBeans env steps/sec for different board sizes and numbers of beans (many beans make the snakes
+grow long).
+
+Plays random joint actions (never reversing the direction) and reports env steps/sec together with the mean total
+length of the snakes.
+
+Example:
+    python benchmarks/snakes_benchmark.py --boards 10x20 40x40 --beans 5 100 --players 6
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from env.snakes import SnakeEatBeans  # noqa: E402
+
+
+def play(g, steps, seed=1):
+    rng = np.random.RandomState(seed)
+    one_hot = np.eye(4, dtype=int).tolist()
+    # action index of the opposite direction, see SnakeEatBeans.actions
+    opposite = {-2: 1, 2: 0, -1: 3, 1: 2}
+    total_length = 0
+    start = time.perf_counter()
+    for _ in range(steps):
+        if g.is_terminal():
+            g.reset()
+        joint_action = []
+        for snake in g.players:
+            action = rng.randint(3)
+            if action >= opposite[snake.direction]:
+                action += 1
+            joint_action.append([one_hot[action]])
+        g.step(joint_action)
+        total_length += sum(len(snake.segments) for snake in g.players)
+    return steps / (time.perf_counter() - start), total_length / steps
+
+
+if __name__ == '__main__':
+    with open(os.path.join(Path(__file__).resolve().parent.parent, 'env', 'config.json')) as f:
+        conf = json.load(f)['snakes_3v3']
+    parser = argparse.ArgumentParser('SnakeEatBeans benchmark')
+    parser.add_argument('--boards', nargs='+', default=['10x20', '40x40', '80x80'], help='Board sizes (HxW)')
+    parser.add_argument('--beans', type=int, nargs='+', default=[5, 100])
+    parser.add_argument('--players', type=int, default=6)
+    parser.add_argument('--steps', type=int, default=2000, help='Env steps per configuration')
+    parser.add_argument('--array-state', action='store_true', help='Use the ndarray current_state')
+    args = parser.parse_args()
+
+    print('{:>8s} {:>6s} {:>10s} {:>14s}'.format('board', 'beans', 'steps/s', 'snake length'))
+    for board in args.boards:
+        height, width = map(int, board.split('x'))
+        for n_beans in args.beans:
+            random.seed(0)
+            np.random.seed(0)
+            g = SnakeEatBeans(dict(conf, board_height=height, board_width=width, n_beans=n_beans,
+                                   n_player=args.players, agent_nums=[args.players], obs_type=['dict'],
+                                   cell_range=args.players + 2, max_step=1000, array_state=args.array_state))
+            rate, length = play(g, args.steps)
+            print('{:>8s} {:>6d} {:>10.0f} {:>14.1f}'.format(board, n_beans, rate, length))
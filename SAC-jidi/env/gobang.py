@@ -3,6 +3,7 @@
 # 创建时间： 2020/7/10 10:24 上午   
 # 描述：
 from random import randrange
+import numpy as np
 from env.simulators.gridgame import GridGame
 from env.obs_interfaces.observation import *
 from utils.discrete import Discrete
@@ -15,7 +16,7 @@ class GoBang(GridGame, GridObservation):
         super().__init__(conf, colors)
         if self.board_width != 15 or self.board_height != 15:
             raise Exception("棋盘大小应设置为15,15,当前棋盘大小为：%d,%d" % (self.board_width, self.board_height))
-        self.current_state = [[[0] * self.cell_dim for _ in range(self.board_width)] for _ in range(self.board_height)]
+        self.current_state = self.empty_state()
         self.all_observes = self.get_all_observes()
         # 1：黑子 2：白子 默认黑子先下
         self.chess_player = 1
@@ -33,7 +34,7 @@ class GoBang(GridGame, GridObservation):
         self.action_dim = self.get_action_dim()
 
     def reset(self):
-        self.current_state = [[[0] * self.cell_dim for _ in range(self.board_width)] for _ in range(self.board_height)]
+        self.current_state = self.empty_state()
         self.chess_player = 1
         self.won = {}
         self.step_cnt = 1
@@ -131,6 +132,8 @@ class GoBang(GridGame, GridObservation):
 
     def check_win(self):
         dirs = ((1, -1), (1, 0), (1, 1), (0, 1))
+        if self.array_state:
+            return self.check_win_array(dirs)
         for i in range(self.board_width):
             for j in range(self.board_height):
                 if self.current_state[i][j][0] == 0: continue
@@ -153,6 +156,26 @@ class GoBang(GridGame, GridObservation):
                         return id
         return 0
 
+    def check_win_array(self, dirs):
+        # 对每个方向判断以 (i, j) 为起点的 5 个格点是否同色，与 check_win 的扫描顺序一致
+        board = self.current_state[:, :, 0]
+        h, w = board.shape
+        padded = np.zeros((h + 8, w + 8), dtype=board.dtype)
+        padded[4:4 + h, 4:4 + w] = board
+        five = np.zeros((len(dirs), h, w), dtype=bool)
+        for d, (dx, dy) in enumerate(dirs):
+            same = board != 0
+            for k in range(1, 5):
+                same &= padded[4 + k * dx:4 + k * dx + h, 4 + k * dy:4 + k * dy + w] == board
+            five[d] = same
+        starts = np.flatnonzero(five.any(axis=0))
+        if not len(starts):
+            return 0
+        i, j = divmod(int(starts[0]), w)
+        dx, dy = dirs[int(np.argmax(five[:, i, j]))]
+        self.won = [[i + z * dx, j + z * dy] for z in range(5)]
+        return int(board[i, j])
+
     def is_terminal(self):
         flg = self.check_win()
         if self.step_cnt > self.max_step:
@@ -15,7 +15,7 @@ class Reversi(GridGame, GridObservation):
         colors = conf.get('colors', [(255, 255, 255), (0, 0, 0), (245, 245, 245)])
         super().__init__(conf, colors)
         # 1：黑子 2：白子 默认黑子先下
-        self.current_state = [[[0] * self.cell_dim for _ in range(self.board_width)] for _ in range(self.board_height)]
+        self.current_state = self.empty_state()
         self.chess_player = 1
         self.n = self.board_width
         if self.n % 2:
@@ -47,7 +47,7 @@ class Reversi(GridGame, GridObservation):
         self.action_dim = self.get_action_dim()
 
     def reset(self):
-        self.current_state = [[[0] * self.cell_dim for _ in range(self.board_width)] for _ in range(self.board_height)]
+        self.current_state = self.empty_state()
         # 四个初始棋子的摆放
         self.current_state[int(self.n / 2 - 1)][int(self.n / 2 - 1)][0] = 2
         self.current_state[int(self.n / 2 - 1)][int(self.n / 2)][0] = 1
@@ -129,10 +129,17 @@ class Reversi(GridGame, GridObservation):
                     self.white = self.white | {p} | set(reverse)
                     self.black = self.black - set(reverse)
 
-                for p in self.black:
-                    next_state[p[0]][p[1]][0] = 1
-                for p in self.white:
-                    next_state[p[0]][p[1]][0] = 2
+                if self.array_state:
+                    # 只有落子位置和反转的棋子发生变化
+                    color = 1 if p in self.black else 2
+                    next_state[p[0], p[1], 0] = color
+                    for x, y in reverse:
+                        next_state[x, y, 0] = color
+                else:
+                    for p in self.black:
+                        next_state[p[0]][p[1]][0] = 1
+                    for p in self.white:
+                        next_state[p[0]][p[1]][0] = 2
 
                 self.step_cnt += 1
 
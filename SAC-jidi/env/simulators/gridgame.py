@@ -39,6 +39,10 @@ class GridGame(Game):
 
         # global state，每个step需维护此项，并根据此项定义render data 及 observation
         self.current_state = None
+        # opt-in: current_state as an int8/int16 ndarray [h, w, cell_dim] instead of nested lists
+        # (converted to lists only when logging, see NpEncoder of run_log.py)
+        self.array_state = bool(conf.get('array_state', False))
+        self.state_dtype = np.int8 if max(self.cell_range) <= np.iinfo(np.int8).max + 1 else np.int16
 
         # 记录对局结果信息
         self.n_return = [0] * self.n_player
@@ -82,14 +86,18 @@ class GridGame(Game):
     def check_win(self):
         raise NotImplementedError
     
+    def empty_state(self):
+        if self.array_state:
+            return np.zeros((self.board_height, self.board_width, self.cell_dim), dtype=self.state_dtype)
+        return [[[0] * self.cell_dim for _ in range(self.board_width)] for _ in range(self.board_height)]
+
     def get_render_data(self, current_state):
-        grid_map = [[0] * self.board_width for _ in range(self.board_height)]
-        for i in range(self.board_height):
-            for j in range(self.board_width):
-                grid_map[i][j] = 0
-                for k in range(self.cell_dim):
-                    grid_map[i][j] = grid_map[i][j] * self.cell_range[k] + current_state[i][j][k]
-        return grid_map
+        # 各格点的 cell 编码: sum_k state[k] * prod(cell_range[k+1:])
+        state = np.asarray(current_state)
+        grid_map = state[:, :, 0].astype(np.int64)
+        for k in range(1, self.cell_dim):
+            grid_map = grid_map * self.cell_range[k] + state[:, :, k]
+        return grid_map if self.array_state else grid_map.tolist()
 
     def set_current_state(self, current_state):
         if not current_state:
@@ -103,26 +111,26 @@ class GridGame(Game):
     def is_not_valid_grid_observation(self, obs, player_id):
         not_valid = 0
         w, h, cell_range = self.get_grid_obs_config(player_id)
-        if len(obs) != h or len(obs[0]) != w or len(obs[0][0]) != len(cell_range):
+        obs_array = _as_array(obs)
+        if obs_array is None or obs_array.shape != (h, w, len(cell_range)):
             raise Exception("obs 维度不正确！", obs)
 
-        for i in range(h):
-            for j in range(w):
-                for k in range(len(cell_range)):
-                    if obs[i][j][k] not in range(cell_range[k]):
-                        raise Exception("obs 单元值不正确！", obs[i][j][k])
+        invalid = _out_of_range(obs_array, cell_range)
+        if invalid is not None:
+            raise Exception("obs 单元值不正确！", obs_array[invalid])
 
         return not_valid
 
     def is_not_valid_vector_observation(self, obs, player_id):
         not_valid = 0
         shape, vector_range = self.get_vector_obs_config(player_id)
-        if len(obs) != shape or len(vector_range) != shape:
+        obs_array = _as_array(obs)
+        if obs_array is None or obs_array.shape != (shape,) or len(vector_range) != shape:
             raise Exception("obs 维度不正确！", obs)
 
-        for i in range(shape):
-            if obs[i] not in range(vector_range[i]):
-                raise Exception("obs 单元值不正确！", obs[i])
+        invalid = _out_of_range(obs_array, vector_range)
+        if invalid is not None:
+            raise Exception("obs 单元值不正确！", obs_array[invalid])
 
         return not_valid
 
@@ -189,6 +197,27 @@ class GridGame(Game):
         return None
 
 
+def _as_array(obs):
+    try:
+        return np.asarray(obs)
+    except ValueError:  # ragged nested lists
+        return None
+
+
+def _out_of_range(obs, value_range):
+    """
+    index of the first value of obs not in range(value_range[k]) along the last axis, or None
+    """
+    if obs.dtype.kind not in 'biuf':  # e.g. None or strings
+        return (0,) * obs.ndim if obs.size else None
+    invalid = (obs < 0) | (obs >= np.asarray(value_range))
+    if obs.dtype.kind == 'f':
+        invalid |= obs != np.floor(obs)
+    if not invalid.any():
+        return None
+    return tuple(np.argwhere(invalid)[0])
+
+
 def build_rectangle(x, y, unit_size=UNIT, fix=FIX):
     return x * unit_size + unit_size // fix, y * unit_size + unit_size // fix, (x + 1) * unit_size - unit_size // fix, (
                 y + 1) * unit_size - unit_size // fix
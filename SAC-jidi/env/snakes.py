@@ -9,7 +9,7 @@ import numpy as np
 from PIL import ImageDraw, ImageFont
 from env.obs_interfaces.observation import *
 from utils.discrete import Discrete
-import itertools
+from collections import deque
 
 
 class SnakeEatBeans(GridGame, GridObservation, DictObservation):
@@ -75,16 +75,17 @@ class SnakeEatBeans(GridGame, GridObservation, DictObservation):
         return self.all_observes
 
     def init_state(self):
+        self.init_occupancy()
         for i in range(self.n_player):
             s = Snake(i + 2, self.board_width, self.board_height, self.init_len)
             s_len = 1
             while s_len < self.init_len:
                 if s_len == 1 and i > 0:
-                    origin_hit = self.is_hit(s.headPos, self.snakes_position)
+                    origin_hit = self.is_occupied(s.headPos)
                 else:
                     origin_hit = 0
                 cur_head = s.move_and_add(self.snakes_position)
-                cur_hit = self.is_hit(cur_head, self.snakes_position) or self.is_hit(cur_head, {i:s.segments[1:]})
+                cur_hit = self.is_occupied(cur_head) or cur_head in s.segments[1:]
                 if origin_hit or cur_hit:
                     x = random.randrange(0, self.board_height)
                     y = random.randrange(0, self.board_width)
@@ -96,6 +97,8 @@ class SnakeEatBeans(GridGame, GridObservation, DictObservation):
                     s_len += 1
             self.snakes_position[s.player_id] = s.segments
             self.players.append(s)
+            for pos in s.segments:
+                self.occupy(pos)
 
         self.generate_beans()
         self.init_info = {
@@ -110,6 +113,8 @@ class SnakeEatBeans(GridGame, GridObservation, DictObservation):
         return self.update_state()
 
     def update_state(self):
+        if self.array_state:
+            return self.update_array_state()
         next_state = [[[0] * self.cell_dim for _ in range(self.board_width)] for _ in range(self.board_height)]
         for i in range(self.n_player):
             snake = self.players[i]
@@ -121,6 +126,18 @@ class SnakeEatBeans(GridGame, GridObservation, DictObservation):
 
         return next_state
 
+    def update_array_state(self):
+        next_state = self.empty_state()
+        for i in range(self.n_player):
+            value = i + 2
+            for x, y in self.players[i].segments:
+                next_state[x, y, 0] = value
+
+        for x, y in self.beans_position:
+            next_state[x, y, 0] = 1
+
+        return next_state
+
     def step_before_info(self, info=''):
         directs = []
         for i in range(len(self.players)):
@@ -130,6 +147,35 @@ class SnakeEatBeans(GridGame, GridObservation, DictObservation):
 
         return info
 
+    # 占用计数（蛇身及食物，蛇身可能暂时重叠）及空格点索引，随蛇的移动、生长、死亡及食物的生成、被吃增量更新
+    def init_occupancy(self):
+        n_cells = self.board_height * self.board_width
+        self.cell_count = [0] * n_cells
+        self.free_cells = list(range(n_cells))
+        self.free_index = list(range(n_cells))  # free_cells 中的位置, -1: 被占用
+
+    def occupy(self, pos):
+        cell = pos[0] * self.board_width + pos[1]
+        self.cell_count[cell] += 1
+        if self.cell_count[cell] == 1:
+            # 与最后一个空格点交换后删除
+            index = self.free_index[cell]
+            last = self.free_cells.pop()
+            if last != cell:
+                self.free_cells[index] = last
+                self.free_index[last] = index
+            self.free_index[cell] = -1
+
+    def vacate(self, pos):
+        cell = pos[0] * self.board_width + pos[1]
+        self.cell_count[cell] -= 1
+        if self.cell_count[cell] == 0:
+            self.free_index[cell] = len(self.free_cells)
+            self.free_cells.append(cell)
+
+    def is_occupied(self, pos):
+        return self.cell_count[pos[0] * self.board_width + pos[1]] > 0
+
     def is_hit(self, cur_head, snakes_position):
         is_hit = False
         for k, v in snakes_position.items():
@@ -144,25 +190,14 @@ class SnakeEatBeans(GridGame, GridObservation, DictObservation):
         return is_hit
 
     def generate_beans(self):
-        all_valid_positions = set(itertools.product(range(0, self.board_height), range(0, self.board_width)))
-        all_valid_positions = all_valid_positions - set(map(tuple, self.beans_position))
-        for positions in self.snakes_position.values():
-            all_valid_positions = all_valid_positions - set(map(tuple, positions))
-
+        # 从空格点中不放回地均匀抽取
         left_bean_num = self.n_beans - self.cur_bean_num
-        all_valid_positions = np.array(list(all_valid_positions))
-        left_valid_positions = len(all_valid_positions)
-
-        new_bean_num = left_bean_num if left_valid_positions > left_bean_num else left_valid_positions
-
-        if left_valid_positions > 0:
-            new_bean_positions_idx = np.random.choice(left_valid_positions, size=new_bean_num, replace=False)
-            new_bean_positions = all_valid_positions[new_bean_positions_idx]
-        else:
-            new_bean_positions = []
-
-        for new_bean_pos in new_bean_positions:
-            self.beans_position.append(list(new_bean_pos))
+        new_bean_num = min(left_bean_num, len(self.free_cells))
+        for _ in range(new_bean_num):
+            cell = self.free_cells[np.random.randint(len(self.free_cells))]
+            new_bean_pos = list(divmod(cell, self.board_width))
+            self.beans_position.append(new_bean_pos)
+            self.occupy(new_bean_pos)
             self.cur_bean_num += 1
 
     def get_all_observes(self, before_info=''):
@@ -185,15 +220,16 @@ class SnakeEatBeans(GridGame, GridObservation, DictObservation):
                 act = self.actions[all_action[i][0].index(1)]
                 # print(snake.player_id, "此轮的动作为：", self.actions_name[act])
                 snake.change_direction(act)
-                snake.move_and_add(self.snakes_position)
+                self.occupy(snake.move_and_add(self.snakes_position))
                 if self.be_eaten(snake.headPos):  # @yanxue
                     snake.snake_reward = 1
                     eat_snakes[i] = 1
                 else:
                     snake.snake_reward = 0
-                    snake.pop()
+                    self.vacate(snake.pop())
                 # print(snake.player_id, snake.segments)   # @yanxue
-            snake_position = [[-1] * self.board_width for _ in range(self.board_height)]
+            # 各格点最先占用的蛇（只记录蛇身所在的格点）
+            snake_position = {}
             re_generatelist = [0] * self.n_player
             for i in range(self.n_player):
                 snake = self.players[i]
@@ -201,14 +237,15 @@ class SnakeEatBeans(GridGame, GridObservation, DictObservation):
                 for j in range(len(segment)):
                     x = segment[j][0]
                     y = segment[j][1]
-                    if snake_position[x][y] != -1:
+                    owner = snake_position.get((x, y), -1)
+                    if owner != -1:
                         if j == 0:  # 撞头
                             re_generatelist[i] = 1
-                        compare_snake = self.players[snake_position[x][y]]
+                        compare_snake = self.players[owner]
                         if [x, y] == compare_snake.segments[0]:  # 两头相撞
-                            re_generatelist[snake_position[x][y]] = 1
+                            re_generatelist[owner] = 1
                     else:
-                        snake_position[x][y] = i
+                        snake_position[(x, y)] = i
             for i in range(self.n_player):
                 snake = self.players[i]
                 if re_generatelist[i] == 1:
@@ -216,11 +253,15 @@ class SnakeEatBeans(GridGame, GridObservation, DictObservation):
                         snake.snake_reward = self.init_len - len(snake.segments) + 1
                     else:
                         snake.snake_reward = self.init_len - len(snake.segments)
+                    for pos in snake.segments:
+                        self.vacate(pos)
                     snake.segments = []
             for i in range(self.n_player):
                 snake = self.players[i]
                 if re_generatelist[i] == 1:
                     snake = self.clear_or_regenerate(snake)
+                    for pos in snake.segments:
+                        self.occupy(pos)
                 self.snakes_position[snake.player_id] = snake.segments
                 snake.score = snake.get_score()
             # yanxue add
@@ -250,54 +291,55 @@ class SnakeEatBeans(GridGame, GridObservation, DictObservation):
         direct_y = [1, 0, 0, -1]
         snake.segments = []
         snake.score = 0
-        grid = self.get_render_data(self.update_state())
+        # 已占用或已访问的格点（按行展开）
+        visited = [count > 0 for count in self.cell_count]
 
         def can_regenerate():
-            for x in range(self.board_height):
-                for y in range(self.board_width):
-                    if grid[x][y] == 0:
-                        q = []
-                        q.append([x, y])
-                        seg = []
-                        while q:
-                            cur = q.pop(0)
-                            if cur not in seg:
-                                seg.append(cur)
-                            for i in range(4):
-                                nx = (direct_x[i] + cur[0]) % self.board_height
-                                ny = (direct_y[i] + cur[1]) % self.board_width
-                                # if nx < 0 or nx >= self.board_height or ny < 0 or ny >= self.board_width:
-                                #     continue
-                                if grid[nx][ny] == 0 and [nx, ny] not in q:
-                                    grid[nx][ny] = 1
-                                    q.append([nx, ny])
-                            if len(seg) == self.init_len:
-                                # print("regenerate")
-                                if len(seg) < 3:
-                                    snake.direction = random.choice(self.actions)
-                                elif len(seg) == 3:
-                                    mid = ([seg[1][0], seg[2][1]], [seg[2][0], seg[1][1]])
-                                    if seg[0] in mid:
-                                        seg[0], seg[1] = seg[1], seg[0]
-                                    snake.segments = seg
-                                    snake.headPos = seg[0]
-                                    if seg[0][0] == seg[1][0]:
-                                        # 右
-                                        if seg[0][1] > seg[1][1]:
-                                            snake.direction = 1
-                                        # 左
-                                        else:
-                                            snake.direction = -1
-                                    elif seg[0][1] == seg[1][1]:
-                                        # 下
-                                        if seg[0][0] > seg[1][0]:
-                                            snake.direction = 2
-                                        # 上
-                                        else:
-                                            snake.direction = -2
-                                # print("re head", snake.headPos)  # 输出重新生成的蛇
-                                # print("re snakes segments", snake.segments)
-                                return True
+            height, width = self.board_height, self.board_width
+            for start in range(height * width):
+                if not visited[start]:
+                    q = deque([start])
+                    seg = []
+                    while q:
+                        cur = q.popleft()
+                        if cur not in seg:
+                            seg.append(cur)
+                        x, y = divmod(cur, width)
+                        for i in range(4):
+                            nx = (direct_x[i] + x) % height
+                            ny = (direct_y[i] + y) % width
+                            n_cell = nx * width + ny
+                            if not visited[n_cell]:
+                                visited[n_cell] = True
+                                q.append(n_cell)
+                        if len(seg) == self.init_len:
+                            seg = [list(divmod(cell, width)) for cell in seg]
+                            # print("regenerate")
+                            if len(seg) < 3:
+                                snake.direction = random.choice(self.actions)
+                            elif len(seg) == 3:
+                                mid = ([seg[1][0], seg[2][1]], [seg[2][0], seg[1][1]])
+                                if seg[0] in mid:
+                                    seg[0], seg[1] = seg[1], seg[0]
+                                snake.segments = seg
+                                snake.headPos = seg[0]
+                                if seg[0][0] == seg[1][0]:
+                                    # 右
+                                    if seg[0][1] > seg[1][1]:
+                                        snake.direction = 1
+                                    # 左
+                                    else:
+                                        snake.direction = -1
+                                elif seg[0][1] == seg[1][1]:
+                                    # 下
+                                    if seg[0][0] > seg[1][0]:
+                                        snake.direction = 2
+                                    # 上
+                                    else:
+                                        snake.direction = -2
+                            # print("re head", snake.headPos)  # 输出重新生成的蛇
+                            # print("re snakes segments", snake.segments)
+                            return True
             # print("clear")
             return False
 
@@ -362,6 +404,7 @@ class SnakeEatBeans(GridGame, GridObservation, DictObservation):
         for bean in self.beans_position:
             if snake_pos[0] == bean[0] and snake_pos[1] == bean[1]:
                 self.beans_position.remove(bean)
+                self.vacate(bean)
                 self.cur_bean_num -= 1
                 return True
         return False
@@ -476,4 +519,4 @@ class Snake():
         return cur_head
 
     def pop(self):
-        self.segments.pop()  # 在蛇尾减去一格
+        return self.segments.pop()  # 在蛇尾减去一格
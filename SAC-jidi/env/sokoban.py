@@ -98,16 +98,26 @@ class Sokoban(GridGame, GridObservation):
                             player = GameObject(p, i, j, 0)
                             self.players.append(player)
         # self.players.sort(key=lambda pl: pl.object_id)
-        current_state = [[[0] * self.cell_dim for _ in range(self.board_width)] for _ in range(self.board_height)]
-        for i in range(len(self.map)):
-            for j in range(len(self.map[0])):
-                current_state[i][j][0] = self.map[i][j]
+        current_state = self.empty_state()
+        if self.array_state:
+            current_state[:len(self.map), :len(self.map[0]), 0] = self.map
+            self.static_state = self.empty_state()
+            for value, positions in ((1, self.walls), (2, self.targets)):
+                if positions:
+                    rows, cols = zip(*positions)
+                    self.static_state[rows, cols, 0] = value
+        else:
+            for i in range(len(self.map)):
+                for j in range(len(self.map[0])):
+                    current_state[i][j][0] = self.map[i][j]
         self.init_info = {"walls": self.walls, "targets": self.targets,
                           "players_position": [[p.row, p.col] for p in self.players],
                           "boxes_position": [[b.row, b.col] for b in self.boxes]}
         return current_state
 
     def update_state(self):
+        if self.array_state:
+            return self.update_array_state()
         next_state = [[[0] * self.cell_dim for _ in range(self.board_width)] for _ in range(self.board_height)]
 
         for pos in self.walls:
@@ -124,6 +134,16 @@ class Sokoban(GridGame, GridObservation):
 
         return next_state
 
+    def update_array_state(self):
+        # 围墙和目标点不变（见 init_state），只需复制后写入箱子和人物
+        next_state = self.static_state.copy()
+        # box 可能会覆盖 target, player 可能会覆盖 target
+        if self.boxes:
+            next_state[[box.row for box in self.boxes], [box.col for box in self.boxes], 0] = 3
+        for player in self.players:
+            next_state[player.row, player.col, 0] = player.object_id
+        return next_state
+
     def out_of_board(self, x, y):
         if x <= 0 or x >= self.board_height:
             return True
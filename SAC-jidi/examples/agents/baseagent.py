@@ -1,3 +1,5 @@
+import numpy as np
+
 
 class Baseagent(object):
     def __init__(self, args):
@@ -13,6 +15,52 @@ class Baseagent(object):
         action_to_env = self.action_from_algo_to_env(action_from_algo)
         return action_to_env
 
+    # batched inference of all controlled agents: one forward pass per policy
+    def choose_joint_action(self, all_observes, train=True):
+        '''
+        :param all_observes: observations of the controlled agents (dicts with "obs" and "controlled_player_index")
+        :return: joint action in the format of get_joint_action_eval: [action] per agent, the action one-hot for
+                 discrete action spaces
+        '''
+        # group the agents by policy, in order of their first observation
+        groups = {}
+        for i, observation in enumerate(all_observes):
+            policy = self.policy_of(observation["controlled_player_index"])
+            groups.setdefault(id(policy), (policy, []))[1].append(i)
+
+        joint_action = [None] * len(all_observes)
+        for policy, indices in groups.values():
+            obs_batch = [all_observes[i]["obs"] for i in indices]
+            if hasattr(policy, "choose_actions"):
+                actions = policy.choose_actions(obs_batch, train)
+            else:
+                actions = [self.action_of(policy.choose_action(obs, train)) for obs in obs_batch]
+
+            if self.args.action_continuous:
+                for i, action in zip(indices, actions):
+                    joint_action[i] = [action]
+                continue
+            # one-hot encoding of the agents with equal action space sizes at once
+            agent_ids = [all_observes[i]["controlled_player_index"] for i in indices]
+            dims = np.array([self.action_dim(agent_id) for agent_id in agent_ids])
+            actions = np.asarray(actions).reshape(len(indices))
+            for dim in np.unique(dims):
+                selected = np.flatnonzero(dims == dim)
+                one_hot = np.eye(dim, dtype=int)[actions[selected]].tolist()
+                for j, each in zip(selected.tolist(), one_hot):
+                    joint_action[indices[j]] = [each]
+        return joint_action
+
+    def policy_of(self, agent_id):
+        return self.agent[agent_id]
+
+    def action_of(self, output):
+        # action of the output of algo.choose_action
+        return output["action"]
+
+    def action_dim(self, agent_id):
+        return self.args.action_space
+
     # update algo
     def learn(self):
         for agent in self.agent:
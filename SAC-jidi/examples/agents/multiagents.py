@@ -48,6 +48,13 @@ class MultiRLAgents(Baseagent):
 
         return joint_action_
 
+    def action_of(self, output):
+        # the agents of multi-agent algos return the action itself
+        return output
+
+    def action_dim(self, agent_id):
+        return self.args.action_space[agent_id]
+
     def choose_action_to_env(self, observation, train=True):
         obs_copy = observation.copy()
         obs = obs_copy["obs"]
@@ -31,6 +31,10 @@ class SingleRLAgent(Baseagent):
     def set_agent(self):
         self.agent.append(self.algo)
 
+    def policy_of(self, agent_id):
+        # all controlled players share the algo
+        return self.algo
+
     def action_from_algo_to_env(self, joint_action):
         '''
         :param joint_action:
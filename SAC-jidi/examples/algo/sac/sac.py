@@ -1,4 +1,5 @@
 import sys
+from contextlib import nullcontext
 from pathlib import Path
 import os
 import torch
@@ -17,6 +18,9 @@ from examples.common.buffer import Replay_buffer as buffer
 
 
 
+_NO_PHASE = nullcontext()
+
+
 def get_trajectory_property():  #for adding terms to the memory buffer
     return ["action"]
 
@@ -127,10 +131,17 @@ class SAC(object):
         self.learn_step_counter = 0
         self.target_replace_iter = args.target_replace
 
+        # optional phase profiler of learn, an object whose phase(name) returns a context manager timing the phase
+        # (e.g. PhaseProfiler of TempoRL/utils/profiler.py)
+        self.profiler = None
+        self._ind_a = None  # constraint mask of constraint_evaluation, cached for the batch shape
+
         self.policy_optim = Adam(self.policy.parameters(), lr = self.actor_lr)
 
         trajectory_property = get_trajectory_property()
-        self.memory = buffer(self.buffer_size, trajectory_property)
+        self.memory = buffer(self.buffer_size, trajectory_property,
+                             dtypes={'states': np.float32, 'states_next': np.float32, 'rewards': np.float32,
+                                     'dones': np.float32})
         self.memory.init_item_buffers()
 
         if self.tune_entropy:
@@ -182,6 +193,31 @@ class SAC(object):
             raise NotImplementedError
 
 
+    # batched choose_action for several agents sharing the policy (see Baseagent.choose_joint_action)
+    def choose_actions(self, states, train = True):
+        states = torch.as_tensor(np.asarray(states, dtype=np.float32)).view(len(states), -1)
+
+        if self.policy_type == 'discrete':
+            if train:
+                actions, _, _, _ = self.policy.sample(states)
+            else:
+                _, _, _, actions = self.policy.sample(states)
+        elif self.policy_type == 'deterministic':
+            _, _, _, actions = self.policy.sample(states)
+        elif self.policy_type == 'gaussian':
+            if train:
+                actions, _, _ = self.policy.sample(states)
+            else:
+                _, _, actions = self.policy.sample(states)
+        else:
+            raise NotImplementedError
+
+        actions = actions.detach().view(len(states)).tolist()
+        if train:
+            for action in actions:
+                self.add_experience({"action": action})
+        return actions
+
     def add_experience(self, output):
         agent_id = 0
         for k, v in output.items():
@@ -214,17 +250,22 @@ class SAC(object):
 
         return qf1_loss, qf2_loss
 
-    # policy loss for maximizing objective
-    def policy_loss(self, current_state):
-
+    # shared forward passes of the policy update: min-Q estimate, action probabilities and log-probabilities
+    def policy_terms(self, current_state):
         with torch.no_grad():
             #qf1_pi, qf2_pi = self.critic(current_state)
             qf1_pi = self.q1(current_state)
             qf2_pi = self.q2(current_state)
             # 获得Q的估计
             min_qf_pi = torch.min(qf1_pi, qf2_pi)
-
         _, prob, log_pi, _ = self.policy.sample(current_state)
+        return min_qf_pi, prob, log_pi
+
+    # policy loss for maximizing objective
+    def policy_loss(self, current_state, terms=None):
+        # terms: policy_terms(current_state), if already computed for the batch
+        min_qf_pi, prob, log_pi = self.policy_terms(current_state) if terms is None else terms
+
         inside_term = self.alpha.detach() * log_pi - min_qf_pi  # [batch, action_dim] detach()可以将参数与网络分离开来，不会影响网络参数的变化
         policy_loss = ((prob * inside_term).sum(1)).mean()
 
@@ -236,19 +277,21 @@ class SAC(object):
     #     constraint_loss = 0
     #     return constraint_loss
 
-    def constraint_evaluation(self, current_state):
-        with torch.no_grad():
-            #qf1_pi, qf2_pi = self.critic(current_state)
-            qf1_pi = self.q1(current_state)
-            qf2_pi = self.q2(current_state)
-            # 获得Q的估计
-            min_qf_pi = torch.min(qf1_pi, qf2_pi)
-        _, prob, log_pi, _ = self.policy.sample(current_state)
+    def constraint_mask(self, min_qf_pi, a0_index=0):
+        ind_a = self._ind_a
+        if ind_a is None or ind_a.shape != min_qf_pi.shape or ind_a.device != min_qf_pi.device:
+            ind_a = torch.ones_like(min_qf_pi)
+            ind_a[:, a0_index] = 0                                  # when a_t = a_0, ind_a = 0; otherwise, ind_a = 1
+            self._ind_a = ind_a
+        return ind_a
+
+    def constraint_evaluation(self, current_state, terms=None):
+        # terms: policy_terms(current_state), if already computed for the batch
+        min_qf_pi, prob, log_pi = self.policy_terms(current_state) if terms is None else terms
 
         a0_index = 0  # 设空action 在action space中的index为0
         qf_0 = (torch.unsqueeze(min_qf_pi[:, a0_index], 1)).expand_as(min_qf_pi)         # Q(s_t, a_0)
-        ind_a = torch.ones(min_qf_pi.size())
-        ind_a[:, a0_index] = 0                                      # when a_t = a_0, ind_a = 0; otherwise, ind_a = 1
+        ind_a = self.constraint_mask(min_qf_pi, a0_index)
         inside_term = min_qf_pi - qf_0 - self.d * ind_a             # constraint evaluation
         # 没有带 \sum^T_0
         const_eval = ((prob * inside_term).sum(1)).mean()           # expectation
@@ -269,57 +312,59 @@ class SAC(object):
         return alpha_loss, alpha_logs
 
 
-    def learn(self):
+    def _phase(self, name):
+        return _NO_PHASE if self.profiler is None else self.profiler.phase(name)
 
-        data = self.memory.sample(self.batch_size)
+    def learn(self):
 
-        transitions = {
-            "o_0": np.array(data['states']),
-            "o_next_0": np.array(data['states_next']),
-            "r_0": np.array(data['rewards']).reshape(-1, 1),
-            "u_0": np.array(data['action']),
-            "d_0": np.array(data['dones']).reshape(-1, 1),
-        }
+        with self._phase('learn/sample'):
+            # contiguous batches, as tensors sharing the memory of the sampled arrays (float32 columns, see __init__)
+            data = self.memory.sample(self.batch_size, as_tensor=True)
 
-        obs = torch.tensor(transitions["o_0"], dtype=torch.float)
-        obs_ = torch.tensor(transitions["o_next_0"], dtype=torch.float)
-        action = torch.tensor(transitions["u_0"], dtype=torch.long).view(self.batch_size, -1)
-        reward = torch.tensor(transitions["r_0"], dtype=torch.float)
-        done = torch.tensor(transitions["d_0"], dtype=torch.float)
+            obs = data['states'].float()
+            obs_ = data['states_next'].float()
+            action = data['action'].long().view(self.batch_size, -1)
+            reward = data['rewards'].float().view(-1, 1)
+            done = data['dones'].float().view(-1, 1)
 
         if self.policy_type == 'discrete':
             '''
             CRPO
             '''
             # 得到Q的loss
-            qf1_loss, qf2_loss = self.critic_loss(obs, action, obs_, reward, (1-done))
-            qf_loss = qf1_loss + qf2_loss
-            update_params(self.critic_optim, qf_loss)
+            with self._phase('learn/critic_update'):
+                qf1_loss, qf2_loss = self.critic_loss(obs, action, obs_, reward, (1-done))
+                qf_loss = qf1_loss + qf2_loss
+                update_params(self.critic_optim, qf_loss)
 
-            # get constraint evaluation
-            const_evaluation, prob, log_pi = self.constraint_evaluation(obs)
+            # get constraint evaluation (the Q and policy forward passes are shared with the policy loss)
+            with self._phase('learn/constraint_evaluation'):
+                terms = self.policy_terms(obs)
+                const_evaluation, prob, log_pi = self.constraint_evaluation(obs, terms)
 
             # 得到policy loss
-            if const_evaluation >= - self.eta:
-                # maximize objective
-                # TODO: put \phi into good_phi_set 有必要吗？
-                policy_loss, prob, log_pi = self.policy_loss(obs)
-            else:
-                # maximize constraint
-                policy_loss = -const_evaluation
-
-            # SAC
-            # policy_loss, prob, log_pi = self.policy_loss(obs)
-            alpha_loss, alpha_logs = self.alpha_loss(prob, log_pi)
-            update_params(self.policy_optim, policy_loss)
-            if self.tune_entropy:
-                update_params(self.alpha_optim, alpha_loss)
-                self.alpha = self.log_alpha.exp().detach()
-
-            if self.learn_step_counter % self.target_replace_iter == 0:
-                #self.critic_target.load_state_dict(self.critic.state_dict())
-                self.q1_target.load_state_dict(self.q1.state_dict())
-                self.q2_target.load_state_dict(self.q2.state_dict())
+            with self._phase('learn/policy_update'):
+                if const_evaluation >= - self.eta:
+                    # maximize objective
+                    # TODO: put \phi into good_phi_set 有必要吗？
+                    policy_loss, prob, log_pi = self.policy_loss(obs, terms)
+                else:
+                    # maximize constraint
+                    policy_loss = -const_evaluation
+
+                # SAC
+                # policy_loss, prob, log_pi = self.policy_loss(obs)
+                alpha_loss, alpha_logs = self.alpha_loss(prob, log_pi)
+                update_params(self.policy_optim, policy_loss)
+                if self.tune_entropy:
+                    update_params(self.alpha_optim, alpha_loss)
+                    self.alpha = self.log_alpha.exp().detach()
+
+            with self._phase('learn/target_update'):
+                if self.learn_step_counter % self.target_replace_iter == 0:
+                    #self.critic_target.load_state_dict(self.critic.state_dict())
+                    self.q1_target.load_state_dict(self.q1.state_dict())
+                    self.q2_target.load_state_dict(self.q2.state_dict())
 
             self.learn_step_counter += 1
 
@@ -0,0 +1,244 @@
+# -*- coding:utf-8  -*-
+"""
+Replay buffer of the algo family (dqn, ddpg, td3, sac, maddpg, ppo, pg, ac, tabularq, sarsa, ...).
+
+Every trajectory property (states, states_next, rewards, dones and the properties of the algorithm, e.g. action or
+a_logit) is stored in its own column. Numeric values (numbers, lists of numbers and NumPy arrays) go into a typed
+array preallocated for max_size entries when the first value arrives, which is used as a ring: inserting overwrites
+the oldest entry in O(1) once the buffer is full, instead of list.pop(0). sample() fancy-indexes the columns, i.e.
+it returns contiguous arrays of shape [batch_size, ...] (or torch tensors sharing their memory) that learn() can use
+without converting a list of per-step arrays for every batch.
+Other values (e.g. torch tensors that are part of an autograd graph, as stored by ac) are kept in a list.
+"""
+import numpy as np
+
+_NUMERIC_KINDS = 'biuf'
+
+
+class ColumnView(object):
+    """
+    List-like view of the entries of one column, oldest first (the .data of the former list based ItemBuffer):
+    supports len, iteration, indexing, slicing and del view[:] to clear the column.
+    """
+
+    def __init__(self, item_buffer):
+        self._item_buffer = item_buffer
+
+    def __len__(self):
+        return self._item_buffer.size
+
+    def __iter__(self):
+        return iter(self._item_buffer.values())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._item_buffer.values()[index]
+        size = self._item_buffer.size
+        if not -size <= index < size:
+            raise IndexError('index out of range')
+        return self._item_buffer.get(index % size)
+
+    def __delitem__(self, index):
+        values = self._item_buffer.values()
+        if isinstance(index, slice) and index == slice(None):
+            self._item_buffer.clear()
+            return
+        keep = np.ones(len(values), dtype=bool)
+        keep[index] = False
+        self._item_buffer.clear()
+        for value, kept in zip(values, keep):
+            if kept:
+                self._item_buffer.insert(None, None, value)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class ItemBuffer(object):
+    """
+    Ring of max_size entries of one trajectory property
+    """
+
+    def __init__(self, max_size, name, dtype=None):
+        """
+        :param max_size: capacity of the ring
+        :param name: name of the property
+        :param dtype: dtype of the column (default: the dtype of the first value, promoted if later values need it)
+        """
+        self.max_size = max_size
+        self.name = name
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self._fixed_dtype = dtype is not None
+        self._column = None  # typed array [max_size, *shape] (numeric values)
+        self._objects = None  # list of max_size entries (other values)
+        self._next = 0  # ring position of the next insert
+        self.size = 0
+
+    @property
+    def data(self):
+        return ColumnView(self)
+
+    def clear(self):
+        self._next = 0
+        self.size = 0
+        self._objects = None  # release the references (e.g. autograd graphs), the typed column is reused
+
+    def insert(self, agent_id, step, data):
+        if self._objects is None and (self._column is None or self.size == 0 and not self._fixed_dtype):
+            self._allocate(data)
+        pos = self._next
+        if self._objects is not None:
+            self._objects[pos] = data
+        else:
+            value = _as_numeric(data)
+            column = self._column
+            if value is None or value.shape != column.shape[1:]:
+                self._to_objects()
+                self._objects[pos] = data
+            else:
+                if value.dtype != column.dtype and not np.can_cast(value.dtype, column.dtype, 'safe') \
+                        and not self._fixed_dtype:
+                    self._promote(value.dtype)
+                self._column[pos] = value
+        self._next = (pos + 1) % self.max_size
+        self.size = min(self.size + 1, self.max_size)
+
+    def _allocate(self, data):
+        value = _as_numeric(data)
+        if value is None:
+            self._objects = [None] * self.max_size
+            return
+        dtype = self.dtype if self._fixed_dtype else value.dtype
+        column = self._column
+        if column is None or column.shape[1:] != value.shape or column.dtype != dtype:
+            self._column = np.empty((self.max_size,) + value.shape, dtype=dtype)
+        self.dtype = dtype
+
+    def _promote(self, dtype):
+        self.dtype = np.result_type(self._column.dtype, dtype)
+        self._column = self._column.astype(self.dtype)
+
+    def _to_objects(self):
+        # values of varying shapes: fall back to a list of the entries
+        objects = [None] * self.max_size
+        for i in range(self.size):
+            pos = self._physical(i)
+            objects[pos] = self._column[pos]
+        self._objects = objects
+        self._column = None
+
+    def _physical(self, index):
+        return (self._next - self.size + index) % self.max_size
+
+    def positions(self, index):
+        """
+        Ring positions of the (chronological) indices index, 0 being the oldest entry
+        """
+        return (self._next - self.size + np.asarray(index)) % self.max_size
+
+    def get(self, index):
+        if not 0 <= index < self.size:
+            raise IndexError('{:s}: index out of range'.format(self.name))
+        pos = self._physical(index)
+        if self._objects is not None:
+            return self._objects[pos]
+        return self._column[pos]
+
+    def take(self, index):
+        """
+        Entries at the chronological indices index: an array [len(index), ...] or, for non-numeric columns, a list
+        """
+        positions = self.positions(index)
+        if self._objects is None and self._column is None:  # nothing inserted yet
+            if len(positions):
+                raise IndexError('{:s}: sampling from an empty buffer'.format(self.name))
+            return []
+        if self._objects is not None:
+            return [self._objects[pos] for pos in positions.tolist()]
+        return self._column[positions]
+
+    def values(self):
+        """
+        All entries, oldest first
+        """
+        return self.take(np.arange(self.size))
+
+
+def _as_numeric(data):
+    """
+    data as a numeric array, or None for values that have to be stored as objects (e.g. torch tensors, which can be
+    part of an autograd graph, or ragged lists)
+    """
+    if not isinstance(data, (np.ndarray, np.generic, int, float, bool, list, tuple)):
+        return None
+    try:
+        value = np.asarray(data)
+    except (ValueError, TypeError, RuntimeError):
+        return None
+    return value if value.dtype.kind in _NUMERIC_KINDS else None
+
+
+class Replay_buffer(object):
+    def __init__(self, max_size, trajectory_property, dtypes=None):
+        """
+        :param max_size: capacity of the buffer (transitions)
+        :param trajectory_property: properties stored in addition to states, states_next, rewards and dones
+        :param dtypes: optional dtypes of the columns by property, e.g. {'states': np.float32} to store observations
+                       in the dtype of the networks (default: the dtype of the first inserted value)
+        """
+        self.max_size = max_size
+        self.properties_all = ["states", "states_next", "rewards", "dones"] + list(trajectory_property)
+        self.dtypes = dict(dtypes or {})
+        self.item_buffers = dict()
+        self.buffer_dict = dict()
+
+    def init_item_buffers(self):
+        for p in self.properties_all:
+            self.item_buffers[p] = ItemBuffer(self.max_size, p, self.dtypes.get(p))
+
+    def insert(self, item_name, agent_id, data, type_name="Agent"):
+        if item_name == "dones":
+            agent_id = 0
+        self.item_buffers[item_name].insert(agent_id, None, data)
+
+    def sample(self, batch_size, as_tensor=False):
+        """
+        Random batch of transitions (drawn with np.random, such that seeding np.random draws the same indices from
+        buffers of equal length, as maddpg does for the buffers of its agents)
+        :param batch_size: number of transitions
+        :param as_tensor: return torch tensors (sharing the memory of the sampled arrays) for the numeric properties
+        :return: dict of an array [batch_size, ...] per property (lists for non-numeric properties)
+        """
+        data_length = self.item_buffers["action"].size
+        ind = np.random.randint(0, data_length, size=batch_size)
+        self.buffer_dict = {name: item_buffer.take(ind) for name, item_buffer in self.item_buffers.items()}
+        if as_tensor:
+            self._to_tensors(self.buffer_dict)
+        return self.buffer_dict
+
+    def get_trajectory(self, as_tensor=False):
+        """
+        All stored transitions, oldest first (on-policy algorithms)
+        """
+        self.buffer_dict = {name: item_buffer.values() for name, item_buffer in self.item_buffers.items()}
+        if as_tensor:
+            self._to_tensors(self.buffer_dict)
+        return self.buffer_dict
+
+    def get_step_data(self):
+        """
+        Oldest stored transition (tabular algorithms, with a buffer of capacity 1: the current transition)
+        """
+        self.buffer_dict = {name: item_buffer.get(0) for name, item_buffer in self.item_buffers.items()}
+        return self.buffer_dict
+
+    def item_buffer_clear(self):
+        for p in self.properties_all:
+            self.item_buffers[p].clear()
+
+    @staticmethod
+    def _to_tensors(buffer_dict):
+        import torch
+        for name, values in buffer_dict.items():
+            if isinstance(values, np.ndarray) and values.dtype.kind in _NUMERIC_KINDS:
+                buffer_dict[name] = torch.from_numpy(values)
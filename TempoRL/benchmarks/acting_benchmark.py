@@ -0,0 +1,57 @@
+"""
+Benchmark of selecting single actions and skips with the torch Q-networks and with their NumPy mirrors
+(utils/numpy_mlp.py).
+
+Reports the time of one forward pass for a single observation of Q, TQ and WeightSharingTQ (action and skip output)
+with torch and with MLPMirror, and the largest absolute difference of their outputs.
+
+Example:
+    python benchmarks/acting_benchmark.py --state-dim 8 --repeats 10000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from run_featurized_experiments import Q, TQ, WeightSharingTQ, tt  # noqa: E402
+from utils.numpy_mlp import MLPMirror  # noqa: E402
+
+
+def timed(forward, repeats):
+    forward()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        forward()
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Acting benchmark')
+    parser.add_argument('--state-dim', type=int, default=8)
+    parser.add_argument('--action-dim', type=int, default=4)
+    parser.add_argument('--skip-dim', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=10_000)
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    x = np.random.randn(args.state_dim)
+    a = np.array([1])
+    q, tq = Q(args.state_dim, args.action_dim), TQ(args.state_dim, args.skip_dim)
+    ws = WeightSharingTQ(args.state_dim, args.action_dim, args.skip_dim)
+    q_mirror, tq_mirror, ws_mirror = MLPMirror(q), MLPMirror(tq), MLPMirror(ws)
+    cases = [('Q', lambda: q(tt(x)).detach().numpy(), lambda: q_mirror.q(x)),
+             ('TQ', lambda: tq(tt(x), tt(a)).detach().numpy(), lambda: tq_mirror.skip_q(x, a)),
+             ('WeightSharingTQ (action)', lambda: ws(tt(x)).detach().numpy(), lambda: ws_mirror.q(x)),
+             ('WeightSharingTQ (skip)', lambda: ws(tt(x), tt(a)).detach().numpy(), lambda: ws_mirror.skip_q(x, a))]
+
+    print('{:>26s} {:>12s} {:>12s} {:>10s} {:>12s}'.format('network', 'torch [us]', 'numpy [us]', 'speedup',
+                                                            'max |diff|'))
+    for name, torch_forward, mirror_forward in cases:
+        difference = np.max(np.abs(torch_forward().reshape(-1) - mirror_forward()))
+        torch_time, mirror_time = timed(torch_forward, args.repeats), timed(mirror_forward, args.repeats)
+        print('{:>26s} {:>12.1f} {:>12.1f} {:>10.1f} {:>12.1e}'.format(name, torch_time * 1e6, mirror_time * 1e6,
+                                                                      torch_time / mirror_time, difference))
@@ -0,0 +1,57 @@
+"""
+Benchmark of BatchedFallEnv (grid_envs.py).
+
+Reports environment steps/sec (summed over all episodes) of epsilon-greedy acting on a dense Q-table for a single
+GridCore environment and for BatchedFallEnv with different numbers of episodes.
+
+Example:
+    python benchmarks/batched_grid_benchmark.py --batch-sizes 1 16 256 4096
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from grid_envs import BatchedFallEnv, Bridge6x10Env  # noqa: E402
+from run_tabular_experiments import epsilon_greedy_action, epsilon_greedy_actions  # noqa: E402
+
+
+def single_env(env, q, num_steps, epsilon):
+    s = env.reset()
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        s, _, d, _ = env.step(epsilon_greedy_action(q[s], epsilon))
+        if d:
+            s = env.reset()
+    return num_steps / (time.perf_counter() - start)
+
+
+def batched_env(env, q, num_steps, epsilon):
+    start = time.perf_counter()
+    for _ in range(max(num_steps // env.batch_size, 1)):
+        env.step(epsilon_greedy_actions(q[env.states], epsilon, env.random))
+    return max(num_steps // env.batch_size, 1) * env.batch_size / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Batched grid environment benchmark')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 16, 256, 4096])
+    parser.add_argument('--num-steps', type=int, default=200_000)
+    parser.add_argument('--epsilon', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    env = Bridge6x10Env(max_steps=100, act_fail_prob=0.1, numpy_state=False)
+    env.seed(args.seed)
+    q = np.random.random((env.nS, env.nA))
+
+    print('{:>10s} {:>14s}'.format('episodes', 'steps/sec'))
+    print('{:>10s} {:>14.0f}'.format('GridCore', single_env(env, q, args.num_steps, args.epsilon)))
+    for batch_size in args.batch_sizes:
+        steps_per_sec = batched_env(BatchedFallEnv(env, batch_size, seeds=args.seed), q, args.num_steps,
+                                    args.epsilon)
+        print('{:>10d} {:>14.0f}'.format(batch_size, steps_per_sec))
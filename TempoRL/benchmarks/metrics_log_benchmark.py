@@ -0,0 +1,64 @@
+"""
+Benchmark of the evaluation logging (utils/metrics_log.py).
+
+Reports the time per evaluation of the previous logging (np.savetxt of the full reward and step history after every
+evaluation) and of appending to a MetricsLog, after the given numbers of evaluations.
+
+Example:
+    python benchmarks/metrics_log_benchmark.py --evaluations 100 1000 10000
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.metrics_log import EVAL_FIELDS, MetricsLog, export_txt  # noqa: E402
+
+STATS = {field: 1. for field, _ in EVAL_FIELDS}
+
+
+def bench_savetxt(directory, evaluations, timed):
+    rew, step = [], []
+    for i in range(evaluations):
+        if i == evaluations - timed:
+            start = time.perf_counter()
+        rew.append(STATS['avg_rew_per_eval_ep'])
+        step.append(i)
+        np.savetxt(directory + "/reward.txt", rew)
+        np.savetxt(directory + "/step.txt", step)
+    return (time.perf_counter() - start) / timed
+
+
+def bench_metrics_log(directory, evaluations, timed, fsync_every):
+    metrics = MetricsLog(directory, fsync_every=fsync_every)
+    for i in range(evaluations):
+        if i == evaluations - timed:
+            start = time.perf_counter()
+        metrics.append(STATS)
+    elapsed = (time.perf_counter() - start) / timed
+    metrics.close()
+    start = time.perf_counter()
+    export_txt(directory)
+    return elapsed, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Evaluation logging benchmark')
+    parser.add_argument('--evaluations', nargs='+', type=int, default=[100, 1_000, 10_000])
+    parser.add_argument('--timed', type=int, default=50, help='Number of (last) evaluations to time')
+    args = parser.parse_args()
+
+    print('{:>12s} {:>16s} {:>16s} {:>16s} {:>12s}'.format('evaluations', 'savetxt [ms]', 'log [ms]',
+                                                             'log+fsync [ms]', 'export [ms]'))
+    for evaluations in args.evaluations:
+        with tempfile.TemporaryDirectory() as directory:
+            timed = min(args.timed, evaluations)
+            savetxt = bench_savetxt(directory, evaluations, timed)
+            log, _ = bench_metrics_log(directory, evaluations, timed, fsync_every=0)
+            log_fsync, export = bench_metrics_log(directory, evaluations, timed, fsync_every=1)
+        print('{:>12d} {:>16.3f} {:>16.3f} {:>16.3f} {:>12.1f}'.format(evaluations, savetxt * 1e3, log * 1e3,
+                                                                       log_fsync * 1e3, export * 1e3))
@@ -0,0 +1,72 @@
+"""
+Benchmark of the prioritized skip replay (utils/prioritized_replay.py).
+
+Fills a skip replay buffer (same fields as NoneConcatSkipReplayBuffer) with random skip transitions and reports
+samples/sec of a full prioritized replay cycle: sampling slots with importance-sampling weights, gathering the batch
+and updating the priorities of the batch. Uniform sampling from the RingBuffer is reported as a baseline.
+
+Example:
+    python benchmarks/prioritized_replay_benchmark.py --capacity 1000000 --batch-sizes 32 64 256
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.prioritized_replay import PrioritizedRingBuffer  # noqa: E402
+from utils.replay_buffers import RingBuffer  # noqa: E402
+
+FIELDS = ["states", "actions", "next_states", "rewards", "terminal_flags", "lengths", "behaviour_action"]
+
+
+def fill(buffer, capacity, state_dim, max_skip):
+    states = np.random.uniform(size=(capacity, state_dim)).astype(np.float32)
+    lengths = np.random.randint(1, max_skip + 1, size=capacity)
+    start = time.perf_counter()
+    for i in range(capacity):
+        buffer.add(states[i], lengths[i] - 1, states[i - 1], 1., False, lengths[i], np.array([0]))
+    return capacity / (time.perf_counter() - start)
+
+
+def bench_uniform(buffer, batch_size, num_batches):
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        buffer.random_batch(batch_size)
+    return num_batches * batch_size / (time.perf_counter() - start)
+
+
+def bench_prioritized(buffer, batch_size, num_batches):
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        _, slots, weights = buffer.random_batch(batch_size)
+        buffer.update_priorities(slots, np.random.exponential(size=batch_size))
+    return num_batches * batch_size / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Prioritized skip replay benchmark')
+    parser.add_argument('--capacity', type=int, default=1_000_000)
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[32, 64, 256])
+    parser.add_argument('--num-batches', type=int, default=2_000)
+    parser.add_argument('--state-dim', type=int, default=4)
+    parser.add_argument('--max-skip', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    buffers = [('uniform', RingBuffer(args.capacity, FIELDS)),
+               ('prioritized', PrioritizedRingBuffer(RingBuffer(args.capacity, FIELDS))),
+               ('stratified', PrioritizedRingBuffer(RingBuffer(args.capacity, FIELDS), stratify_by='lengths',
+                                                    num_strata=args.max_skip))]
+    print('{:>12s} {:>14s} {:>10s} {:>14s}'.format('sampling', 'inserts/sec', 'batch', 'samples/sec'))
+    for name, buffer in buffers:
+        inserts_per_sec = fill(buffer, args.capacity, args.state_dim, args.max_skip)
+        for batch_size in args.batch_sizes:
+            if name == 'uniform':
+                samples_per_sec = bench_uniform(buffer, batch_size, args.num_batches)
+            else:
+                samples_per_sec = bench_prioritized(buffer, batch_size, args.num_batches)
+            print('{:>12s} {:>14.0f} {:>10d} {:>14.0f}'.format(name, inserts_per_sec, batch_size, samples_per_sec))
@@ -0,0 +1,84 @@
+"""
+Benchmark of the overhead of the phase profiler (utils/profiler.py).
+
+Reports the cost of one phase (enter and exit) and one count with a disabled and an enabled profiler, and the wall time
+of training TDQN on mountain car for a fixed number of steps with the profiler disabled, enabled and enabled with the
+sampling profiler (best of --repeats runs each).
+
+Example:
+    python benchmarks/profiler_benchmark.py --steps 2000 --repeats 3
+"""
+import argparse
+import contextlib
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import run_featurized_experiments  # noqa: E402
+from run_featurized_experiments import TDQN  # noqa: E402
+from utils.profiler import PhaseProfiler  # noqa: E402
+
+
+class NullWriter:
+    def add_scalar(self, *args, **kwargs):
+        pass
+
+
+def bench_calls(profiler, repeats=200_000):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        with profiler.phase('phase'):
+            pass
+    phase = (time.perf_counter() - start) / repeats
+    start = time.perf_counter()
+    for _ in range(repeats):
+        profiler.count('count')
+    return phase, (time.perf_counter() - start) / repeats
+
+
+def bench_training(steps, profiler_kwargs):
+    from gym.envs.classic_control import MountainCarEnv
+
+    np.random.seed(0)
+    torch.manual_seed(0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        agent = TDQN(2, 3, 10, 0.99, MountainCarEnv(), MountainCarEnv())
+    agent.profiler = PhaseProfiler(writer=NullWriter(), **profiler_kwargs)
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        agent.train(directory, 1_000_000, 200, 0.1, eval_eps=1, eval_every_n_steps=steps // 4,
+                    max_train_time_steps=steps)
+        elapsed = time.perf_counter() - start
+        agent.profiler.close()
+    return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Phase profiler benchmark')
+    parser.add_argument('--steps', type=int, default=2_000, help='Training steps per run')
+    parser.add_argument('--repeats', type=int, default=3, help='Runs per configuration')
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)
+    run_featurized_experiments.writer = NullWriter()  # the module-level writer is only created in __main__
+    for name, profiler in [('disabled', PhaseProfiler()), ('enabled', PhaseProfiler(enabled=True))]:
+        phase, count = bench_calls(profiler)
+        print('{:>10s} profiler: phase {:.2f} us, count {:.2f} us'.format(name, phase * 1e6, count * 1e6))
+
+    configurations = [('disabled', {}), ('enabled', dict(enabled=True)),
+                      ('sampling', dict(enabled=True, sampling_interval=0.01))]
+    times = {name: [] for name, _ in configurations}
+    for _ in range(args.repeats):  # interleaved, such that drifts of the machine affect all configurations alike
+        for name, kwargs in configurations:
+            times[name].append(bench_training(args.steps, kwargs))
+    baseline = min(times['disabled'])
+    print('{:>10s} {:>12s} {:>10s}'.format('profiler', 'train [s]', 'overhead'))
+    for name, _ in configurations:
+        best = min(times[name])
+        print('{:>10s} {:>12.2f} {:>9.1f}%'.format(name, best, 100 * (best / baseline - 1)))
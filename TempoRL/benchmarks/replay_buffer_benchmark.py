@@ -0,0 +1,91 @@
+"""
+Micro-benchmark comparing the list based replay buffer (as previously used by the TempoRL agents)
+with the preallocated NumPy RingBuffer.
+
+Reports inserts/sec (once the buffer is full, i.e. every insertion evicts the oldest transition)
+and samples/sec (batches of size --batch-size) at different fill levels.
+
+Example:
+    python benchmarks/replay_buffer_benchmark.py --fill-levels 10000 100000 1000000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.replay_buffers import RingBuffer  # noqa: E402
+
+FIELDS = ["states", "actions", "next_states", "rewards", "terminal_flags", "lengths", "behaviour_action"]
+
+
+class ListBuffer:
+    """
+    Reference implementation of the old list based NoneConcatSkipReplayBuffer (without the conversion to tensors)
+    """
+
+    def __init__(self, max_size):
+        self._data = {field: [] for field in FIELDS}
+        self._size = 0
+        self._max_size = max_size
+
+    def add(self, *values):
+        for field, value in zip(FIELDS, values):
+            self._data[field].append(value)
+        self._size += 1
+        if self._size > self._max_size:
+            for field in FIELDS:
+                self._data[field].pop(0)
+
+    def random_batch(self, batch_size):
+        batch_indices = np.random.choice(len(self._data['states']), batch_size)
+        return [np.array([self._data[field][i] for i in batch_indices]) for field in FIELDS]
+
+
+def transition(state_dim):
+    return (np.random.random(state_dim), np.random.randint(10), np.random.random(state_dim),
+            np.random.random(), False, np.random.randint(1, 11), np.array([np.random.randint(3)]))
+
+
+def fill(buffer, n, state_dim):
+    # Reuse a small pool of transitions to keep the filling fast
+    pool = [transition(state_dim) for _ in range(1000)]
+    for i in range(n):
+        buffer.add(*pool[i % len(pool)])
+    return pool
+
+
+def bench(buffer, fill_level, state_dim, batch_size, num_inserts, num_samples):
+    pool = fill(buffer, fill_level, state_dim)
+
+    start = time.perf_counter()
+    for i in range(num_inserts):
+        buffer.add(*pool[i % len(pool)])
+    inserts = num_inserts / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(num_samples):
+        buffer.random_batch(batch_size)
+    samples = num_samples / (time.perf_counter() - start)
+    return inserts, samples
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Replay buffer benchmark')
+    parser.add_argument('--fill-levels', nargs='+', type=int, default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--state-dim', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--num-inserts', type=int, default=2_000)
+    parser.add_argument('--num-samples', type=int, default=2_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    print('{:>10s} {:>12s} {:>14s} {:>14s}'.format('fill', 'buffer', 'inserts/sec', 'samples/sec'))
+    for fill_level in args.fill_levels:
+        for name, buffer in [('list', ListBuffer(fill_level)), ('ring', RingBuffer(fill_level, FIELDS))]:
+            inserts, samples = bench(buffer, fill_level, args.state_dim, args.batch_size,
+                                     args.num_inserts, args.num_samples)
+            print('{:>10d} {:>12s} {:>14.0f} {:>14.0f}'.format(fill_level, name, inserts, samples))
@@ -0,0 +1,77 @@
+"""
+Benchmark of loading experiment results with utils/data_handling (load_data and load_dqn_data).
+
+Writes a synthetic experiment tree (tabular runs with test_data.pkl/steps_per_episode.pkl and DQN runs with
+eval_scores.json) to a temporary directory and reports the loading time without the results cache, with a cold cache
+and with a warm cache (in a new session, i.e. read from the cache file, and within the same session).
+
+Example:
+    python benchmarks/results_loader_benchmark.py --runs 500 --evaluations 1000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils import data_handling, results_cache  # noqa: E402
+
+
+def write_runs(root, runs, evaluations, episodes):
+    rng = np.random.RandomState(0)
+    for method in ['sq', 'q']:
+        for seed in range(runs):
+            directory = os.path.join(root, 'tabular', '{:s}-experiments-1.0-linear'.format(method),
+                                     '{:d}_7_100_{:d}'.format(episodes, seed))
+            os.makedirs(directory)
+            with open(os.path.join(directory, 'test_data.pkl'), 'wb') as fh:
+                pickle.dump((rng.random_sample(evaluations).tolist(), rng.randint(1, 100, evaluations).tolist()), fh)
+            with open(os.path.join(directory, 'steps_per_episode.pkl'), 'wb') as fh:
+                pickle.dump((list(range(episodes + 1)), rng.randint(1, 100, evaluations).tolist()), fh)
+    for seed in range(runs):
+        directory = os.path.join(root, 'dqn', 'run_{:d}'.format(seed))
+        os.makedirs(directory)
+        with open(os.path.join(directory, 'eval_scores.json'), 'w') as fh:
+            for i in range(evaluations):
+                json.dump(dict(elapsed_time=1.5 * i, training_steps=1000 * i, training_eps=i,
+                               avg_num_steps_per_eval_ep=float(rng.randint(100)),
+                               avg_num_decs_per_eval_ep=float(rng.randint(100)),
+                               avg_rew_per_eval_ep=float(rng.randn()), std_rew_per_eval_ep=1., eval_eps=1), fh)
+                fh.write('\n')
+
+
+def load(root, episodes, **kwargs):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        data_handling.load_data(os.path.join(root, 'tabular'), episodes=episodes, max_skip=7, max_steps=100, **kwargs)
+        data_handling.load_dqn_data('*', os.path.join(root, 'dqn'), **kwargs)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Results loader benchmark')
+    parser.add_argument('--runs', type=int, default=500, help='Runs per method')
+    parser.add_argument('--evaluations', type=int, default=1_000, help='Evaluations per run')
+    parser.add_argument('--episodes', type=int, default=10_000, help='Training episodes per tabular run')
+    parser.add_argument('--workers', type=int, default=None, help='Processes to parse changed files with')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        write_runs(root, args.runs, args.evaluations, args.episodes)
+        results_cache.RESULTS_CACHE_DIR = os.path.join(root, 'cache')
+        no_cache = load(root, args.episodes, cache=False)
+        cold = load(root, args.episodes, workers=args.workers)
+        results_cache._caches.clear()  # as in a new session
+        new_session = load(root, args.episodes)
+        warm = load(root, args.episodes)
+    print('{:>10s} {:>12s} {:>12s} {:>16s} {:>12s}'.format('runs', 'no cache [s]', 'cold [s]', 'new session [s]',
+                                                            'warm [s]'))
+    print('{:>10d} {:>12.2f} {:>12.2f} {:>16.2f} {:>12.2f}'.format(3 * args.runs, no_cache, cold, new_session, warm))
@@ -0,0 +1,81 @@
+"""
+Benchmark of the tabular agents in run_tabular_experiments.py.
+
+Reports training episodes/sec of q_learning and temporl_q_learning on the 6x10 lava grids (without rendering).
+With --num-seeds the batched trainers (batched_q_learning, batched_temporl_q_learning) are reported as well, with
+episodes/sec summed over all seeds.
+
+Example:
+    python benchmarks/tabular_benchmark.py --episodes 2000 --max-skips 7 --num-seeds 100
+"""
+import argparse
+import contextlib
+import io
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from grid_envs import Bridge6x10Env, Pit6x10Env, ZigZag6x10  # noqa: E402
+from run_tabular_experiments import (batched_q_learning, batched_temporl_q_learning, q_learning,  # noqa: E402
+                                     temporl_q_learning)
+
+ENVS = {'lava': Pit6x10Env, 'lava2': Bridge6x10Env, 'lava3': ZigZag6x10}
+
+
+def bench(agent, env, episodes, max_skip, eval_every):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # silence the progress output
+        if agent == 'q':
+            q_learning(env, episodes, discount_factor=.99, alpha=.5, epsilon=1.0, epsilon_decay='linear',
+                       eval_every=eval_every, render_eval=False)
+        else:
+            temporl_q_learning(env, episodes, discount_factor=.99, alpha=.5, epsilon=1.0, epsilon_decay='linear',
+                               eval_every=eval_every, render_eval=False, max_skip=max_skip)
+    elapsed = time.perf_counter() - start
+    return episodes / elapsed, env.total_steps / elapsed
+
+
+def bench_batched(agent, env, episodes, max_skip, eval_every, seeds):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if agent == 'q':
+            results, _ = batched_q_learning(env, episodes, seeds, discount_factor=.99, alpha=.5, epsilon=1.0,
+                                            epsilon_decay='linear', eval_every=eval_every)
+        else:
+            results, _ = batched_temporl_q_learning(env, episodes, seeds, discount_factor=.99, alpha=.5, epsilon=1.0,
+                                                    epsilon_decay='linear', eval_every=eval_every, max_skip=max_skip)
+    elapsed = time.perf_counter() - start
+    total_steps = sum(steps[0][-1] for _, _, steps in results)
+    return len(seeds) * episodes / elapsed, total_steps / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Tabular agent benchmark')
+    parser.add_argument('--envs', nargs='+', default=['lava', 'lava2', 'lava3'], choices=list(ENVS.keys()))
+    parser.add_argument('--agents', nargs='+', default=['q', 'sq'], choices=['q', 'sq'])
+    parser.add_argument('--episodes', type=int, default=2_000)
+    parser.add_argument('--max-skips', type=int, default=7)
+    parser.add_argument('--eval-eps', type=int, default=100)
+    parser.add_argument('--env-max-steps', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--num-seeds', type=int, default=0, help='Seeds of the batched trainers (0 to skip them)')
+    args = parser.parse_args()
+
+    print('{:>8s} {:>6s} {:>14s} {:>14s}'.format('env', 'agent', 'episodes/sec', 'steps/sec'))
+    for env_name in args.envs:
+        for agent in args.agents:
+            np.random.seed(args.seed)
+            kwargs = dict(goal=(5, 9)) if env_name == 'lava3' else {}
+            env = ENVS[env_name](max_steps=args.env_max_steps, act_fail_prob=0, numpy_state=False, **kwargs)
+            env.seed(args.seed)
+            episodes_per_sec, steps_per_sec = bench(agent, env, args.episodes, args.max_skips, args.eval_eps)
+            print('{:>8s} {:>6s} {:>14.0f} {:>14.0f}'.format(env_name, agent, episodes_per_sec, steps_per_sec))
+            if args.num_seeds > 0:
+                seeds = list(range(args.seed, args.seed + args.num_seeds))
+                episodes_per_sec, steps_per_sec = bench_batched(agent, env, args.episodes, args.max_skips,
+                                                                args.eval_eps, seeds)
+                print('{:>8s} {:>6s} {:>14.0f} {:>14.0f}'.format(env_name, agent + 'x%d' % args.num_seeds,
+                                                                  episodes_per_sec, steps_per_sec))
@@ -0,0 +1,59 @@
+"""
+Benchmark of reading the scalar summaries of event files with utils/tfevents.py.
+
+Reports the time to load all runs below the given directory with TensorBoard's EventAccumulator (if tensorboard is
+installed), and with utils/tfevents without the cache, with a cold cache and with a warm cache (in a new session, i.e.
+read from the cache files, and within the same session).
+
+Example:
+    python benchmarks/tfevents_benchmark.py --runs 'experiments/featurized_results/*'
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils import results_cache, tfevents  # noqa: E402
+
+
+def load_event_accumulator(run_dirs):
+    from tensorboard.backend.event_processing.event_accumulator import EventAccumulator
+    start = time.perf_counter()
+    for run_dir in run_dirs:
+        accumulator = EventAccumulator(run_dir, size_guidance={'scalars': 0})
+        accumulator.Reload()
+        for tag in accumulator.Tags()['scalars']:
+            accumulator.Scalars(tag)
+    return time.perf_counter() - start
+
+
+def load(run_dirs, **kwargs):
+    start = time.perf_counter()
+    tfevents.load_runs(run_dirs, **kwargs)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Event file reader benchmark')
+    parser.add_argument('--runs', default='experiments', help='Glob pattern of the runs (see tfevents.find_runs)')
+    parser.add_argument('--workers', type=int, default=None, help='Processes to decode changed runs with')
+    args = parser.parse_args()
+
+    run_dirs = tfevents.find_runs(args.runs)
+    try:
+        accumulator = load_event_accumulator(run_dirs)
+    except ImportError:
+        accumulator = float('nan')
+    with tempfile.TemporaryDirectory() as cache_dir:
+        results_cache.RESULTS_CACHE_DIR = cache_dir
+        no_cache = load(run_dirs, use_cache=False)
+        cold = load(run_dirs, workers=args.workers)
+        tfevents._runs.clear()  # as in a new session
+        new_session = load(run_dirs)
+        warm = load(run_dirs)
+    print('{:>8s} {:>18s} {:>12s} {:>12s} {:>16s} {:>12s}'.format('runs', 'tensorboard [s]', 'no cache [s]', 'cold [s]',
+                                                                 'new session [s]', 'warm [s]'))
+    print('{:>8d} {:>18.2f} {:>12.2f} {:>12.2f} {:>16.2f} {:>12.3f}'.format(len(run_dirs), accumulator, no_cache, cold,
+                                                                           new_session, warm))
@@ -0,0 +1,97 @@
+"""
+Benchmark of the batched environments in utils/vec_env.py.
+
+Reports frames/sec (environment steps/sec summed over all environments) of random actions for SyncVectorEnv and for
+SubprocVectorEnv with different numbers of worker processes.
+By default Atari environments are created through utils.env_wrappers.make_env (requires the Atari dependencies).
+With --env synthetic a CPU-bound stand-in is used that produces stacked 42x42 uint8 frames by downsampling a
+random 210x160 RGB screen, similar to the Atari preprocessing.
+
+Example:
+    python benchmarks/vec_env_benchmark.py --env pong --num-envs 8 --workers 1 2 4 8
+"""
+import argparse
+import sys
+import time
+from functools import partial
+from pathlib import Path
+
+import gym
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.vec_env import SyncVectorEnv, SubprocVectorEnv  # noqa: E402
+
+
+class SyntheticAtari(gym.Env):
+    """
+    Stand-in for a wrapped Atari environment: every step renders a random RGB screen, converts it to grayscale,
+    downsamples it and pushes it onto a stack of 4 frames.
+    """
+    observation_space = gym.spaces.Box(0, 255, (4, 42, 42), np.uint8)
+    action_space = gym.spaces.Discrete(6)
+
+    def __init__(self, episode_length=1000):
+        self._rng = np.random.RandomState(0)
+        self._episode_length = episode_length
+        self._frames = np.zeros((4, 42, 42), dtype=np.uint8)
+        self._rows = np.linspace(0, 209, 42).astype(np.int64)
+        self._cols = np.linspace(0, 159, 42).astype(np.int64)
+        self._t = 0
+
+    def seed(self, seed=None):
+        self._rng = np.random.RandomState(seed)
+
+    def _frame(self):
+        screen = self._rng.randint(0, 256, (210, 160, 3)).astype(np.float32)
+        gray = screen @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        return gray[np.ix_(self._rows, self._cols)].astype(np.uint8)
+
+    def reset(self):
+        self._t = 0
+        self._frames[:] = self._frame()
+        return self._frames.copy()
+
+    def step(self, action):
+        self._t += 1
+        self._frames[:-1] = self._frames[1:]
+        self._frames[-1] = self._frame()
+        return self._frames.copy(), 0., self._t >= self._episode_length, {}
+
+
+def make_atari(game):
+    from utils.env_wrappers import make_env
+    return make_env('{}Deterministic-v0'.format(''.join([g.capitalize() for g in game.split('_')])))
+
+
+def bench(vec_env, num_steps, seed):
+    rng = np.random.RandomState(seed)
+    vec_env.seed(seed)
+    vec_env.reset()
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        _, _, dones, _ = vec_env.step(rng.randint(vec_env.action_space.n, size=vec_env.num_envs))
+        if dones.any():
+            vec_env.reset(np.flatnonzero(dones))
+    frames_per_sec = num_steps * vec_env.num_envs / (time.perf_counter() - start)
+    vec_env.close()
+    return frames_per_sec
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Vectorized environment benchmark')
+    parser.add_argument('--env', default='pong', type=str, help="Atari game (e.g. 'pong') or 'synthetic'")
+    parser.add_argument('--num-envs', type=int, default=8)
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4, 8])
+    parser.add_argument('--num-steps', type=int, default=500, help='Lockstep steps per measurement')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    env_fn = SyntheticAtari if args.env == 'synthetic' else partial(make_atari, args.env)
+    env_fns = [env_fn] * args.num_envs
+
+    print('{:>10s} {:>10s} {:>14s}'.format('vec env', 'workers', 'frames/sec'))
+    print('{:>10s} {:>10s} {:>14.0f}'.format('sync', '-', bench(SyncVectorEnv(env_fns), args.num_steps, args.seed)))
+    for num_workers in args.workers:
+        frames_per_sec = bench(SubprocVectorEnv(env_fns, num_workers=num_workers), args.num_steps, args.seed)
+        print('{:>10s} {:>10d} {:>14.0f}'.format('subproc', num_workers, frames_per_sec))
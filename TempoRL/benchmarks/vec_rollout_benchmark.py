@@ -0,0 +1,89 @@
+"""
+Benchmark of the acting part of the vectorized rollout (VectorizedRollout in run_featurized_experiments.py).
+
+Reports environment steps/sec of a TDQN agent acting epsilon-greedy on N copies of MountainCar
+(batched decisions with agent.decide, independent action repetitions per environment) without learning updates.
+The single environment baseline uses the unbatched get_action/get_skip as in TDQN.train.
+
+Example:
+    python benchmarks/vec_rollout_benchmark.py --num-envs 1 4 16 64
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from gym.envs.classic_control import MountainCarEnv  # noqa: E402
+from run_featurized_experiments import TDQN  # noqa: E402
+from utils.vec_env import SyncVectorEnv  # noqa: E402
+
+
+def single_env_rollout(agent, env, num_steps, epsilon, max_env_time_steps):
+    s, es, steps = env.reset(), 0, 0
+    start = time.perf_counter()
+    with torch.no_grad():
+        while steps < num_steps:
+            a = agent.get_action(s, epsilon)
+            skip = agent.get_skip(s, np.array([a]), epsilon)
+            for _ in range(skip + 1):
+                s, _, d, _ = env.step(a)
+                es += 1
+                steps += 1
+                if d or es >= max_env_time_steps:
+                    s, es = env.reset(), 0
+                    break
+    return steps / (time.perf_counter() - start)
+
+
+def vectorized_rollout(agent, vec_env, num_steps, epsilon, max_env_time_steps):
+    num_envs = vec_env.num_envs
+    actions = np.zeros(num_envs, dtype=np.int64)
+    remaining = np.zeros(num_envs, dtype=np.int64)
+    es = np.zeros(num_envs, dtype=np.int64)
+    s, steps = vec_env.reset(), 0
+    start = time.perf_counter()
+    while steps < num_steps:
+        deciding = np.flatnonzero(remaining == 0)
+        if len(deciding) > 0:
+            with torch.no_grad():
+                _, actions[deciding], skips = agent.decide(s[deciding], epsilon)
+            remaining[deciding] = skips + 1
+        s, _, d, _ = vec_env.step(actions)
+        remaining -= 1
+        es += 1
+        steps += num_envs
+        ended = np.flatnonzero(d | (es >= max_env_time_steps))
+        if len(ended) > 0:
+            s[ended] = vec_env.reset(ended)
+            remaining[ended] = 0
+            es[ended] = 0
+    return steps / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser('Vectorized rollout benchmark')
+    parser.add_argument('--num-envs', nargs='+', type=int, default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument('--num-steps', type=int, default=20_000)
+    parser.add_argument('--epsilon', type=float, default=0.1)
+    parser.add_argument('--max-skip', type=int, default=10)
+    parser.add_argument('--env-max-steps', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    env = MountainCarEnv()
+    agent = TDQN(2, 3, args.max_skip, 0.99, env, MountainCarEnv())
+
+    print('{:>10s} {:>16s}'.format('num envs', 'env steps/sec'))
+    print('{:>10s} {:>16.0f}'.format('unbatched', single_env_rollout(agent, env, args.num_steps, args.epsilon,
+                                                                     args.env_max_steps)))
+    for num_envs in args.num_envs:
+        vec_env = SyncVectorEnv([MountainCarEnv] * num_envs)
+        vec_env.seed(args.seed)
+        steps_per_sec = vectorized_rollout(agent, vec_env, args.num_steps, args.epsilon, args.env_max_steps)
+        print('{:>10d} {:>16.0f}'.format(num_envs, steps_per_sec))
@@ -1,3 +1,6 @@
+import bisect
+import hashlib
+import os
 import numpy as np
 import sys
 from io import StringIO
@@ -5,6 +8,7 @@ from typing import Tuple
 from gym.envs.toy_text.discrete import DiscreteEnv
 import time
 from scipy.spatial.distance import cityblock
+from utils.disk_cache import CACHE_DIR, save_npz
 
 LEFT = 0
 UP = 1
@@ -12,11 +16,104 @@ RIGHT = 2
 DOWN = 3
 
 
+# Directory in which compiled transition models are cached. None (an empty TEMPORL_CACHE_DIR environment variable)
+# disables the disk cache, models are then only cached in-process.
+MODEL_CACHE_DIR = CACHE_DIR
+_MODEL_VERSION = 1  # increase when the compiled models change, to invalidate cached models
+_models = {}  # in-process cache of compiled transition models
+
+
 class Specs:
     def __init__(self, max_steps):
         self.max_episode_steps = max_steps
 
 
+class TransitionModel:
+    """
+    Compiled transition model of a tabular environment with (at most) K outcomes per state and action.
+    Dense arrays of shape [nS, nA, K] hold the next_state, prob, reward and done flag of every outcome, in the same
+    order as the transition lists of the DiscreteEnv P (unused outcomes have probability 0).
+    """
+
+    def __init__(self, next_state, prob, reward, done):
+        self.next_state = np.asarray(next_state, dtype=np.int64)
+        self.prob = np.asarray(prob, dtype=np.float64)
+        self.reward = np.asarray(reward, dtype=np.float64)
+        self.done = np.asarray(done, dtype=bool)
+        self.cum_prob = np.cumsum(self.prob, axis=-1)
+        # Python lists for fast scalar access when stepping a single environment
+        self._lists = (self.next_state.tolist(), self.prob.tolist(), self.reward.tolist(), self.done.tolist(),
+                       self.cum_prob.tolist())
+
+    @classmethod
+    def from_dict(cls, P, nS, nA, shape=None):
+        """
+        Compile a DiscreteEnv transition dictionary P[s][a] = [(prob, next_state, reward, done), ...]
+        :param shape: grid shape to ravel next states given as coordinates (xy states)
+        """
+        K = max(len(P[s][a]) for s in range(nS) for a in range(nA))
+        next_state = np.tile(np.arange(nS)[:, None, None], (1, nA, K))
+        prob, reward, done = np.zeros((nS, nA, K)), np.zeros((nS, nA, K)), np.zeros((nS, nA, K), dtype=bool)
+        for s in range(nS):
+            for a in range(nA):
+                for k, (p, ns, r, d) in enumerate(P[s][a]):
+                    next_state[s, a, k] = ns if np.ndim(ns) == 0 else np.ravel_multi_index(tuple(ns), shape)
+                    prob[s, a, k], reward[s, a, k], done[s, a, k] = p, r, d
+        return cls(next_state, prob, reward, done)
+
+    def to_dict(self, shape=None):
+        """
+        Transition dictionary P[s][a] = [(prob, next_state, reward, done), ...] as used by DiscreteEnv, with all K
+        outcomes per state and action (including those with probability 0, as in _init_transition_probability)
+        :param shape: grid shape to return the next states as coordinates (xy states)
+        """
+        nS, nA, K = self.prob.shape
+        P = {}
+        for s in range(nS):
+            P[s] = {}
+            for a in range(nA):
+                P[s][a] = [(self.prob[s, a, k],
+                            int(self.next_state[s, a, k]) if shape is None else np.array(
+                                np.unravel_index(self.next_state[s, a, k], shape)),
+                            self.reward[s, a, k], bool(self.done[s, a, k])) for k in range(K)]
+        return P
+
+    def sample(self, s, a, np_random):
+        """
+        Sample an outcome for a single state and action with one random number (as DiscreteEnv.step)
+        :return: (next_state, reward, done, prob)
+        """
+        next_state, prob, reward, done, cum_prob = self._lists
+        k = bisect.bisect_right(cum_prob[s][a], np_random.rand())  # first outcome with cum_prob > u
+        if k == len(cum_prob[s][a]):  # rounding left the last cumulative probability below u
+            k = 0
+        return next_state[s][a][k], reward[s][a][k], done[s][a][k], prob[s][a][k]
+
+    @classmethod
+    def cached(cls, key, build):
+        """
+        Get the compiled model for key from the in-process cache, the disk cache (see MODEL_CACHE_DIR) or build it
+        :param key: tuple identifying the model (e.g. class name, shape, pits, goal, act_fail_prob, reward flags)
+        :param build: function returning the TransitionModel if it is not cached
+        """
+        key = (_MODEL_VERSION,) + tuple(key)
+        if key in _models:
+            return _models[key]
+        path = None
+        if MODEL_CACHE_DIR is not None:
+            path = os.path.join(MODEL_CACHE_DIR, 'grid_model_{}.npz'.format(
+                hashlib.sha1(repr(key).encode()).hexdigest()))
+        if path is not None and os.path.exists(path):
+            with np.load(path) as data:
+                model = cls(data['next_state'], data['prob'], data['reward'], data['done'])
+        else:
+            model = build()
+            if path is not None:
+                save_npz(path, next_state=model.next_state, prob=model.prob, reward=model.reward, done=model.done)
+        _models[key] = model
+        return model
+
+
 class GridCore(DiscreteEnv):
     metadata = {'render.modes': ['human', 'ansi']}
 
@@ -43,7 +140,9 @@ class GridCore(DiscreteEnv):
         self._nps = numpy_state
         self.xy = xy_state
 
-        P = self._init_transition_probability()
+        # The transitions are compiled to dense arrays (see TransitionModel). The DiscreteEnv dictionary P is only
+        # built on first access.
+        self.model = self._compile_transitions()
 
         # We always start in state (3, 0)
         if start is not None:
@@ -56,13 +155,27 @@ class GridCore(DiscreteEnv):
                 isd[pit] = 0.0
             isd *= 1 / (self.nS - len(self._pits) - 1)
 
-        super(GridCore, self).__init__(self.nS, self.nA, P, isd)
+        super(GridCore, self).__init__(self.nS, self.nA, None, isd)
+
+    @property
+    def P(self):
+        if self._P is None:
+            self._P = self.model.to_dict(self.shape if self.xy else None)
+        return self._P
+
+    @P.setter
+    def P(self, P):
+        self._P = P
 
     def step(self, a):
         self._steps += 1
-        s, r, d, i = super(GridCore, self).step(a)
+        # Same as DiscreteEnv.step (including the random numbers drawn) but on the compiled transition model
+        s, r, d, p = self.model.sample(self.s, a, self.np_random)
+        self.s = s
+        self.lastaction = a
+        i = {'prob': p}
         if self.xy:
-            self.s = np.ravel_multi_index(self.s, self.shape)
+            s = np.unravel_index(s, self.shape)
         if self._steps >= self.max_steps:
             d = True
             i['early'] = True
@@ -89,6 +202,13 @@ class GridCore(DiscreteEnv):
     def _init_transition_probability(self):
         raise NotImplementedError
 
+    def _compile_transitions(self):
+        """
+        Compiled transition model. By default compiled from the dictionary of _init_transition_probability.
+        """
+        return TransitionModel.from_dict(self._init_transition_probability(), self.nS, self.nA,
+                                         self.shape if self.xy else None)
+
     def _check_bounds(self, coord):
         coord[0] = min(coord[0], self.shape[0] - 1)
         coord[0] = max(coord[0], 0)
@@ -188,12 +308,55 @@ class FallEnv(GridCore):
                 transitions.append((p, new_position if self.xy else new_state, reward, is_done))
         return transitions
 
-    def _init_transition_probability(self):
+    # Outcome directions and probabilities (index 0: the intended direction) per action, in the order of P
+    _outcome_dirs = {UP: [[-1, 0], [1, 0], [0, -1], [0, 1]],
+                     DOWN: [[1, 0], [0, -1], [0, 1], [-1, 0]],
+                     LEFT: [[0, -1], [0, 1], [-1, 0], [1, 0]],
+                     RIGHT: [[0, 1], [-1, 0], [1, 0], [0, -1]]}
+
+    def _ravel_pits(self):
         for idx, p in enumerate(self._pits):
             try:
                 self._pits[idx] = np.ravel_multi_index(p, self.shape)
             except:
                 pass  # <- this has to be here for the agent. Otherwise it throws an unexplainable error
+
+    def _compile_transitions(self):
+        """
+        Vectorized construction of the transition model (equivalent to _init_transition_probability), cached by the
+        parameters it depends on.
+        """
+        self._ravel_pits()
+        key = (type(self).__name__, tuple(self.shape), tuple(int(p) for p in self._pits), tuple(self.goal), self.afp,
+               self._pr, self._no_goal_rew, self._dr)
+        return TransitionModel.cached(key, self._build_transition_model)
+
+    def _build_transition_model(self):
+        positions = np.stack(np.unravel_index(np.arange(self.nS), self.shape), axis=-1)  # [nS, 2]
+        dirs = np.array([self._outcome_dirs[a] for a in range(self.nA)])  # [nA, K, 2]
+        new_positions = np.clip(positions[:, None, None, :] + dirs[None], 0, np.array(self.shape) - 1)
+        next_state = np.ravel_multi_index((new_positions[..., 0], new_positions[..., 1]), self.shape)
+        other_prob = self.afp / 3.
+        prob = np.broadcast_to(np.array([1 - self.afp, other_prob, other_prob, other_prob]), next_state.shape)
+
+        at_goal = np.all(new_positions == np.array(self.goal), axis=-1)
+        in_pit = np.isin(next_state, np.array(self._pits, dtype=np.int64)) & ~at_goal
+        if self._pr:
+            goal_reward = 1 - (self._steps / self.max_steps)
+        elif not self._no_goal_rew:
+            goal_reward = 100.0 if self._dr else 1.0
+        else:
+            goal_reward = 0.0  # also the distance based reward at the goal
+        if not self._dr:
+            reward = np.zeros(next_state.shape)
+        else:
+            reward = -np.abs(new_positions - np.array(self.goal)).sum(axis=-1).astype(np.float64)
+        reward[at_goal] = goal_reward
+        reward[in_pit] = -100. if self._dr else -1.
+        return TransitionModel(next_state, prob, reward, at_goal | in_pit)
+
+    def _init_transition_probability(self):
+        self._ravel_pits()
         # Calculate transition probabilities
         P = {}
         for s in range(self.nS):
@@ -281,3 +444,127 @@ class ZigZag6x10H(FallEnv):
              [4, 4], [5, 2]
              ]
     _shape = (6, 10)
+
+
+class BatchedRandom:
+    """
+    Independent random number streams for the elements of a batch (e.g. episodes or seeds).
+    Every call draws one number (or n numbers) per element with a single array operation. The numbers are generated in
+    blocks per stream, such that the numbers of element i only depend on seeds[i] and not on the batch size.
+    """
+
+    def __init__(self, seeds, block_size: int = 4096):
+        """
+        :param seeds: one seed per element
+        :param block_size: number of random numbers generated per stream at once
+        """
+        self._streams = [np.random.RandomState(seed) for seed in seeds]
+        self.batch_size = len(self._streams)
+        self._block_size = block_size
+        self._block = np.empty((self.batch_size, 0))
+        self._ptr = 0
+
+    def random(self, n: int = None) -> np.ndarray:
+        """
+        Uniform random numbers in [0, 1)
+        :param n: number of random numbers per element
+        :return: array of shape (batch_size,) or (batch_size, n) if n is given
+        """
+        k = 1 if n is None else n
+        if self._ptr + k > self._block.shape[1]:
+            fresh = np.stack([stream.random_sample(max(self._block_size, k)) for stream in self._streams])
+            self._block = np.concatenate([self._block[:, self._ptr:], fresh], axis=1)
+            self._ptr = 0
+        numbers = self._block[:, self._ptr:self._ptr + k]
+        self._ptr += k
+        return numbers[:, 0] if n is None else numbers
+
+
+class BatchedFallEnv:
+    """
+    B independent episodes of a grid environment (e.g. Bridge6x10Env) that are stepped together with array operations
+    on its compiled transition model (see TransitionModel).
+    As GridCore every episode ends after max_steps steps, and the rewards (percentage_reward, no_goal_rew, dense_reward)
+    are the ones of the transition model. Ended episodes are reset automatically. States are always state indices.
+    """
+
+    def __init__(self, env: GridCore, batch_size: int, seeds=None, max_steps=None):
+        """
+        :param env: environment that defines the grid, transition model and initial state distribution
+        :param batch_size: number of episodes B
+        :param seeds: one seed per episode, a base seed (episode i uses seed + i) or a BatchedRandom
+        :param max_steps: maximal number of steps per episode, either one value or one per episode.
+                          Defaults to env.max_steps.
+        """
+        self.model = env.model
+        self.nS, self.nA, self.shape = env.nS, env.nA, env.shape
+        self.batch_size = batch_size
+        self.action_space, self.observation_space = env.action_space, env.observation_space
+        self.max_steps = np.broadcast_to(env.max_steps if max_steps is None else max_steps, (batch_size,)).copy()
+        if isinstance(seeds, BatchedRandom):
+            self.random = seeds
+        else:
+            if seeds is None or np.ndim(seeds) == 0:
+                base = np.random.randint(2 ** 31 - batch_size) if seeds is None else seeds
+                seeds = base + np.arange(batch_size)
+            self.random = BatchedRandom(seeds)
+        assert self.random.batch_size == batch_size, 'Need one random stream per episode'
+        self._isd_cum_prob = np.cumsum(env.isd)
+        self.states = np.zeros(batch_size, dtype=np.int64)
+        self._steps = np.zeros(batch_size, dtype=np.int64)
+        self.total_steps = 0
+        self.reset()
+
+    def reset(self, indices=None):
+        """
+        Start new episodes
+        :param indices: episodes to reset (all by default)
+        :return: the current states of all episodes
+        """
+        start_states = self._start_states(self.random.random())
+        if indices is None:
+            self.states[:] = start_states
+            self._steps[:] = 0
+        else:
+            self.states[indices] = start_states[indices]
+            self._steps[indices] = 0
+        return self.states
+
+    def _start_states(self, u):
+        return (self._isd_cum_prob > u[:, None]).argmax(axis=1)
+
+    def step(self, actions, hold=None):
+        """
+        Perform one step in every episode and reset the episodes that ended
+        :param actions: one action per episode
+        :param hold: optional boolean mask of episodes that are not stepped (they keep their state and are not done)
+        :return: next states (before resetting), rewards, done flags (including the max_steps limit) and
+                 info with the 'early' flags of the episodes that ended because of max_steps.
+                 The states to act on next are in self.states.
+        """
+        model = self.model
+        s, a = self.states, actions
+        # Every step draws the same numbers per episode (transition and potential reset), so that the random stream of
+        # an episode does not depend on the other episodes
+        u = self.random.random(2)
+        k = (model.cum_prob[s, a] > u[:, :1]).argmax(axis=1)
+        next_states = model.next_state[s, a, k]
+        rewards = model.reward[s, a, k]
+        model_dones = model.done[s, a, k]
+        if hold is not None:
+            next_states = np.where(hold, s, next_states)
+            rewards = np.where(hold, 0., rewards)
+            model_dones = model_dones & ~hold
+            self._steps += ~hold
+            self.total_steps += self.batch_size - int(hold.sum())
+        else:
+            self._steps += 1
+            self.total_steps += self.batch_size
+        early = self._steps >= self.max_steps
+        dones = model_dones | early
+        self.states = next_states.copy()
+        ended = np.flatnonzero(dones)
+        if len(ended) > 0:
+            self.states[ended] = self._start_states(u[ended, 1])
+            self._steps[ended] = 0
+        return next_states, rewards, dones, {'early': early & ~model_dones}
@@ -9,10 +9,14 @@ import torch.optim as optim
 import torch.nn.functional as F
 from torch.autograd import Variable
 from itertools import count
-from collections import namedtuple
 import time
 from mountain_car import MountainCarEnv
 from utils import experiments
+from utils.async_eval import evaluate, report_eval
+from utils.replay_buffers import RingBuffer, FrameRingBuffer, FrameStore
+from utils.prioritized_replay import PrioritizedRingBuffer
+from utils.skip_transitions import SkipReturnAccumulator
+from utils.vec_rollout import VectorizedRollout
 from torch.utils.tensorboard import SummaryWriter
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -242,39 +246,54 @@ class WeightSharingTQ(nn.Module):
         return self.action_fc3(x)
 
 
+def make_storage(max_size, fields, frame_store=None):
+    """
+    Helper to create the storage of the replay buffers.
+    With a frame_store the observations are stored as deduplicated uint8 frames (for stacked image observations).
+    """
+    if frame_store is None:
+        return RingBuffer(max_size, fields)
+    return FrameRingBuffer(max_size, fields, frame_store)
+
+
+def replay_memory_stats(buffers, frame_store=None):
+    """
+    Memory used by the given replay buffers (and their shared frame store) for reporting in the training log
+    """
+    nbytes = sum(buffer.nbytes for buffer in buffers)
+    if frame_store is not None:
+        nbytes += frame_store.nbytes
+    num_transitions = sum(len(buffer) for buffer in buffers)
+    stats = dict(replay_memory_mb=nbytes / 2 ** 20,
+                 replay_bytes_per_transition=nbytes / max(num_transitions, 1))
+    print('Replay memory: {:.1f}MB for {:d} transitions ({:.0f} bytes/transition)'.format(
+        stats['replay_memory_mb'], num_transitions, stats['replay_bytes_per_transition']))
+    return stats
+
+
 class ReplayBuffer:
     """
     Simple Replay Buffer. Used for standard DQN learning.
     """
 
-    def __init__(self, max_size):
-        self._data = namedtuple("ReplayBuffer", ["states", "actions", "next_states", "rewards", "terminal_flags"])
-        self._data = self._data(states=[], actions=[], next_states=[], rewards=[], terminal_flags=[])
-        self._size = 0
+    def __init__(self, max_size, frame_store=None):
+        self._data = make_storage(max_size, ["states", "actions", "next_states", "rewards", "terminal_flags"],
+                                  frame_store)
         self._max_size = max_size
 
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes
+
     def add_transition(self, state, action, next_state, reward, done):
-        self._data.states.append(state)
-        self._data.actions.append(action)
-        self._data.next_states.append(next_state)
-        self._data.rewards.append(reward)
-        self._data.terminal_flags.append(done)
-        self._size += 1
-
-        if self._size > self._max_size:
-            self._data.states.pop(0)
-            self._data.actions.pop(0)
-            self._data.next_states.pop(0)
-            self._data.rewards.pop(0)
-            self._data.terminal_flags.pop(0)
+        self._data.add(state, action, next_state, reward, done)
 
     def random_next_batch(self, batch_size):
-        batch_indices = np.random.choice(len(self._data.states), batch_size)
-        batch_states = np.array([self._data.states[i] for i in batch_indices])
-        batch_actions = np.array([self._data.actions[i] for i in batch_indices])
-        batch_next_states = np.array([self._data.next_states[i] for i in batch_indices])
-        batch_rewards = np.array([self._data.rewards[i] for i in batch_indices])
-        batch_terminal_flags = np.array([self._data.terminal_flags[i] for i in batch_indices])
+        batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags = \
+            self._data.random_batch(batch_size)
         return tt(batch_states), tt(batch_actions), tt(batch_next_states), tt(batch_rewards), tt(batch_terminal_flags)
 
 
@@ -285,38 +304,24 @@ class SkipReplayBuffer:
     Stores transitions as usual but with additional skip-length. The skip-length is used to properly discount.
     """
 
-    def __init__(self, max_size):
-        self._data = namedtuple("ReplayBuffer", ["states", "actions", "next_states",
-                                                 "rewards", "terminal_flags", "lengths"])
-        self._data = self._data(states=[], actions=[], next_states=[], rewards=[], terminal_flags=[], lengths=[])
-        self._size = 0
+    def __init__(self, max_size, frame_store=None):
+        self._data = make_storage(max_size, ["states", "actions", "next_states",
+                                             "rewards", "terminal_flags", "lengths"], frame_store)
         self._max_size = max_size
 
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes
+
     def add_transition(self, state, action, next_state, reward, done, length):
-        self._data.states.append(state)
-        self._data.actions.append(action)
-        self._data.next_states.append(next_state)
-        self._data.rewards.append(reward)
-        self._data.terminal_flags.append(done)
-        self._data.lengths.append(length)  # Observed skip-length of the transition
-        self._size += 1
-
-        if self._size > self._max_size:
-            self._data.states.pop(0)
-            self._data.actions.pop(0)
-            self._data.next_states.pop(0)
-            self._data.rewards.pop(0)
-            self._data.terminal_flags.pop(0)
-            self._data.lengths.pop(0)
+        self._data.add(state, action, next_state, reward, done, length)  # length: Observed skip-length
 
     def random_next_batch(self, batch_size):
-        batch_indices = np.random.choice(len(self._data.states), batch_size)
-        batch_states = np.array([self._data.states[i] for i in batch_indices])
-        batch_actions = np.array([self._data.actions[i] for i in batch_indices])
-        batch_next_states = np.array([self._data.next_states[i] for i in batch_indices])
-        batch_rewards = np.array([self._data.rewards[i] for i in batch_indices])
-        batch_terminal_flags = np.array([self._data.terminal_flags[i] for i in batch_indices])
-        batch_lengths = np.array([self._data.lengths[i] for i in batch_indices])
+        batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags, batch_lengths = \
+            self._data.random_batch(batch_size)
         return tt(batch_states), tt(batch_actions), tt(batch_next_states),\
                tt(batch_rewards), tt(batch_terminal_flags), tt(batch_lengths)
 
@@ -329,46 +334,53 @@ class NoneConcatSkipReplayBuffer:
     Additionally stores the behaviour_action which is the context for this skip-transition.
     """
 
-    def __init__(self, max_size):
-        self._data = namedtuple("ReplayBuffer", ["states", "actions", "next_states",
-                                                 "rewards", "terminal_flags", "lengths", "behaviour_action"])
-        self._data = self._data(states=[], actions=[], next_states=[], rewards=[], terminal_flags=[], lengths=[],
-                                behaviour_action=[])
-        self._size = 0
+    def __init__(self, max_size, frame_store=None):
+        self._data = make_storage(max_size, ["states", "actions", "next_states",
+                                             "rewards", "terminal_flags", "lengths", "behaviour_action"],
+                                  frame_store)
         self._max_size = max_size
 
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes
+
     def add_transition(self, state, action, next_state, reward, done, length, behaviour):
-        self._data.states.append(state)
-        self._data.actions.append(action)
-        self._data.next_states.append(next_state)
-        self._data.rewards.append(reward)
-        self._data.terminal_flags.append(done)
-        self._data.lengths.append(length)  # Observed skip-length
-        self._data.behaviour_action.append(behaviour)  # Behaviour action to condition skip on
-        self._size += 1
-
-        if self._size > self._max_size:
-            self._data.states.pop(0)
-            self._data.actions.pop(0)
-            self._data.next_states.pop(0)
-            self._data.rewards.pop(0)
-            self._data.terminal_flags.pop(0)
-            self._data.lengths.pop(0)
-            self._data.behaviour_action.pop(0)
+        # length: Observed skip-length; behaviour: Behaviour action to condition skip on
+        self._data.add(state, action, next_state, reward, done, length, behaviour)
 
     def random_next_batch(self, batch_size):
-        batch_indices = np.random.choice(len(self._data.states), batch_size)
-        batch_states = np.array([self._data.states[i] for i in batch_indices])
-        batch_actions = np.array([self._data.actions[i] for i in batch_indices])
-        batch_next_states = np.array([self._data.next_states[i] for i in batch_indices])
-        batch_rewards = np.array([self._data.rewards[i] for i in batch_indices])
-        batch_terminal_flags = np.array([self._data.terminal_flags[i] for i in batch_indices])
-        batch_lengths = np.array([self._data.lengths[i] for i in batch_indices])
-        batch_behavoiurs = np.array([self._data.behaviour_action[i] for i in batch_indices])
+        batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags, batch_lengths, \
+            batch_behavoiurs = self._data.random_batch(batch_size)
         return tt(batch_states), tt(batch_actions), tt(batch_next_states),\
                tt(batch_rewards), tt(batch_terminal_flags), tt(batch_lengths), tt(batch_behavoiurs)
 
 
+class PrioritizedSkipReplayBuffer(NoneConcatSkipReplayBuffer):
+    """
+    Skip replay buffer with proportional prioritization by TD-error (see utils/prioritized_replay.py).
+    Optionally every batch is stratified by skip length, such that short skips are not crowded out by the more
+    numerous long skips.
+    random_next_batch additionally returns the importance-sampling weights of the batch. The priorities of the last
+    sampled batch are set with update_priorities.
+    """
+
+    def __init__(self, max_size, max_skip, frame_store=None, stratify=False, alpha=0.6, beta=0.4):
+        super(PrioritizedSkipReplayBuffer, self).__init__(max_size, frame_store)
+        self._data = PrioritizedRingBuffer(self._data, alpha, beta, stratify_by='lengths' if stratify else None,
+                                           num_strata=max_skip)
+        self._batch_slots = None
+
+    def random_next_batch(self, batch_size):
+        batch, self._batch_slots, weights = self._data.random_batch(batch_size)
+        return tuple(tt(x) for x in batch) + (tt(weights),)
+
+    def update_priorities(self, td_errors):
+        self._data.update_priorities(self._batch_slots, td_errors)
+
+
 class DQN:
     """
     Simple double DQN Agent
@@ -402,13 +414,17 @@ class DQN:
         self.final_epsilon = 0.01
         self.epsilon_timesteps = 200_000
         self.train_freq = 4
+        self.gradient_steps = 1  # gradient steps per update
 
         self._loss_function = nn.SmoothL1Loss()  # huber loss # nn.MSELoss()
         self._q_optimizer = optim.Adam(self._q.parameters(), lr=0.0001, betas=(0.9, 0.999), eps=1e-08)
         # self._q_optimizer = optim.RMSprop(self._q.parameters(), lr=0.00025, alpha=0.01, eps=1e-08, momentum=0.95)
         self._action_dim = action_dim
 
-        self._replay_buffer = ReplayBuffer(5e4)
+        # Image observations are stored as deduplicated uint8 frames. The frame store gets some slack for the additional
+        # frames stored at the beginning of each episode.
+        self._frame_store = FrameStore(1.1 * 5e4) if vision else None
+        self._replay_buffer = ReplayBuffer(5e4, self._frame_store)
         self._env = env
         self._eval_env = eval_env
 
@@ -422,6 +438,44 @@ class DQN:
             return np.random.randint(self._action_dim)
         return u
 
+    def learn(self):
+        """
+        One double Q-learning update (with gradient clipping) on a batch sampled from the replay buffer
+        """
+        batch_size = self.batch_size
+        batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags = \
+            self._replay_buffer.random_next_batch(batch_size)
+
+        target = batch_rewards + (1 - batch_terminal_flags) * self._gamma * \
+                 self._q_target(batch_next_states)[torch.arange(batch_size).long(), torch.argmax(
+                     self._q(batch_next_states), dim=1)]
+        current_prediction = self._q(batch_states)[torch.arange(batch_size).long(), batch_actions.long()]
+
+        loss = self._loss_function(current_prediction, target.detach())
+
+        self._q_optimizer.zero_grad()
+        loss.backward()
+        for param in self._q.parameters():
+            param.grad.data.clamp_(-self.grad_clip_val, self.grad_clip_val)
+        self._q_optimizer.step()
+
+    def update(self, total_steps: int) -> bool:
+        """
+        Scheduled learner stage, called once per environment step.
+        Every train_freq environment steps (once more than learning_starts steps were taken) gradient_steps updates
+        are performed and every target_net_upd_freq steps the weights are copied to the target network.
+        On all other steps nothing is sampled or computed.
+        :param total_steps: number of environment steps taken so far
+        :return: True if the networks were updated
+        """
+        if total_steps <= self.learning_starts or total_steps % self.train_freq != 0:
+            return False
+        for _ in range(self.gradient_steps):
+            self.learn()
+        if (total_steps % self.target_net_upd_freq) == 0:
+            hard_update(self._q_target, self._q)
+        return True
+
     def train(self, episodes: int, max_env_time_steps: int, epsilon: float, eval_eps: int = 1,
               eval_every_n_steps: int = 1, max_train_time_steps: int = 1_000_000):
         """
@@ -435,11 +489,6 @@ class DQN:
         :return:
         """
         total_steps = 0
-        num_update_steps = 0
-        batch_size = self.batch_size
-        grad_clip_val = self.grad_clip_val
-        target_net_upd_freq = self.target_net_upd_freq
-        learning_starts = self.learning_starts
 
         start_time = time.time()
 
@@ -473,6 +522,7 @@ class DQN:
                         std_rew_per_eval_ep=float(np.std(eval_r)),
                         eval_eps=eval_eps
                     )
+                    eval_stats.update(replay_memory_stats([self._replay_buffer], self._frame_store))
 
                     with open(os.path.join(out_dir, 'eval_scores.json'), 'a+') as out_fh:
                         json.dump(eval_stats, out_fh)
@@ -482,31 +532,8 @@ class DQN:
                 # Update replay buffer
                 self._replay_buffer.add_transition(s, a, ns, r, d)
 
-                batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags = \
-                    self._replay_buffer.random_next_batch(batch_size)
-
-                ########### Begin double Q-learning update
-                target = batch_rewards + (1 - batch_terminal_flags) * self._gamma * \
-                         self._q_target(batch_next_states)[torch.arange(batch_size).long(), torch.argmax(
-                             self._q(batch_next_states), dim=1)]
-                current_prediction = self._q(batch_states)[torch.arange(batch_size).long(), batch_actions.long()]
-
-                loss = self._loss_function(current_prediction, target.detach())
-
-
-                if (total_steps > learning_starts) and (total_steps % self.train_freq == 0):
-                    num_update_steps += 1
-                    self._q_optimizer.zero_grad()
-                    loss.backward()
-                    for param in self._q.parameters():
-                        param.grad.data.clamp_(-grad_clip_val, grad_clip_val)
-                    self._q_optimizer.step()
-
-
-                    if (total_steps % target_net_upd_freq) == 0:
-                        hard_update(self._q_target, self._q)
-                    # soft_update(self._q_target, self._q, 0.01)
-                    ########### End double Q-learning update
+                ########### Double Q-learning update (only on scheduled steps)
+                self.update(total_steps)
                 if d:
                     break
                 s = ns
@@ -528,6 +555,7 @@ class DQN:
                 std_rew_per_eval_ep=float(np.std(eval_r)),
                 eval_eps=eval_eps
             )
+            eval_stats.update(replay_memory_stats([self._replay_buffer], self._frame_store))
 
             with open(os.path.join(out_dir, 'eval_scores.json'), 'a+') as out_fh:
                 json.dump(eval_stats, out_fh)
@@ -603,12 +631,16 @@ class DAR:
         self.final_epsilon = 0.01
         self.epsilon_timesteps = 200_000
         self.train_freq = 4
+        self.gradient_steps = 1  # gradient steps per update
 
         self._loss_function = nn.SmoothL1Loss()  # huber loss # nn.MSELoss()
         self._q_optimizer = optim.Adam(self._q.parameters(), lr=0.0001, betas=(0.9, 0.999), eps=1e-08)
         self._action_dim = action_dim
 
-        self._replay_buffer = ReplayBuffer(5e4)
+        # Image observations are stored as deduplicated uint8 frames. The frame store gets some slack for the additional
+        # frames stored at the beginning of each episode.
+        self._frame_store = FrameStore(1.1 * 5e4) if vision else None
+        self._replay_buffer = ReplayBuffer(5e4, self._frame_store)
         self._skip_map = skip_map
         self._dup_vals = num_output_duplication
         self._env = env
@@ -624,6 +656,44 @@ class DAR:
             return np.random.randint(self._action_dim)
         return u
 
+    def learn(self):
+        """
+        One double Q-learning update (with gradient clipping) on a batch sampled from the replay buffer
+        """
+        batch_size = self.batch_size
+        batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags = \
+            self._replay_buffer.random_next_batch(batch_size)
+
+        target = batch_rewards + (1 - batch_terminal_flags) * self._gamma * \
+                 self._q_target(batch_next_states)[torch.arange(batch_size).long(), torch.argmax(
+                     self._q(batch_next_states), dim=1)]
+        current_prediction = self._q(batch_states)[torch.arange(batch_size).long(), batch_actions.long()]
+
+        loss = self._loss_function(current_prediction, target.detach())
+
+        self._q_optimizer.zero_grad()
+        loss.backward()
+        for param in self._q.parameters():
+            param.grad.data.clamp_(-self.grad_clip_val, self.grad_clip_val)
+        self._q_optimizer.step()
+
+    def update(self, total_steps: int) -> bool:
+        """
+        Scheduled learner stage, called once per environment step.
+        Every train_freq environment steps (once more than learning_starts steps were taken) gradient_steps updates
+        are performed and every target_net_upd_freq steps the weights are copied to the target network.
+        On all other steps nothing is sampled or computed.
+        :param total_steps: number of environment steps taken so far
+        :return: True if the networks were updated
+        """
+        if total_steps <= self.learning_starts or total_steps % self.train_freq != 0:
+            return False
+        for _ in range(self.gradient_steps):
+            self.learn()
+        if (total_steps % self.target_net_upd_freq) == 0:
+            hard_update(self._q_target, self._q)
+        return True
+
     def train(self, episodes: int, max_env_time_steps: int, epsilon: float, eval_eps: int = 1,
               eval_every_n_steps: int = 1, max_train_time_steps: int = 1_000_000):
         """
@@ -636,11 +706,6 @@ class DAR:
         :param max_train_time_steps: maximum number of steps to train
         """
         total_steps = 0
-        num_update_steps = 0
-        batch_size = self.batch_size
-        grad_clip_val = self.grad_clip_val
-        target_net_upd_freq = self.target_net_upd_freq
-        learning_starts = self.learning_starts
 
         start_time = time.time()
         for e in range(episodes):
@@ -678,35 +743,16 @@ class DAR:
                             std_rew_per_eval_ep=float(np.std(eval_r)),
                             eval_eps=eval_eps
                         )
+                        eval_stats.update(replay_memory_stats([self._replay_buffer], self._frame_store))
 
                         with open(os.path.join(out_dir, 'eval_scores.json'), 'a+') as out_fh:
                             json.dump(eval_stats, out_fh)
                             out_fh.write('\n')
                     ########### End Evaluation
 
-                    ### Q-update based double Q learning
+                    ### Q-update based double Q learning (only on scheduled steps)
                     self._replay_buffer.add_transition(s, a, ns, r, d)
-                    batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags = \
-                        self._replay_buffer.random_next_batch(batch_size)
-
-                    target = batch_rewards + (1 - batch_terminal_flags) * self._gamma * \
-                             self._q_target(batch_next_states)[torch.arange(batch_size).long(), torch.argmax(
-                                 self._q(batch_next_states), dim=1)]
-                    current_prediction = self._q(batch_states)[torch.arange(batch_size).long(), batch_actions.long()]
-
-                    loss = self._loss_function(current_prediction, target.detach())
-                    if (total_steps > learning_starts) and (total_steps % self.train_freq == 0):
-                        num_update_steps += 1
-                        self._q_optimizer.zero_grad()
-                        loss.backward()
-                        for param in self._q.parameters():
-                            param.grad.data.clamp_(-grad_clip_val, grad_clip_val)
-                        self._q_optimizer.step()
-
-                        if (total_steps % target_net_upd_freq) == 0:
-                            hard_update(self._q_target, self._q)
-                        # soft_update(self._q_target, self._q, 0.01)
-                        ########### End double Q-learning update
+                    self.update(total_steps)
                     if es >= max_env_time_steps or d or total_steps >= max_train_time_steps:
                         break
 
@@ -729,6 +775,7 @@ class DAR:
                 std_rew_per_eval_ep=float(np.std(eval_r)),
                 eval_eps=eval_eps
             )
+            eval_stats.update(replay_memory_stats([self._replay_buffer], self._frame_store))
 
             with open(os.path.join(out_dir, 'eval_scores.json'), 'a+') as out_fh:
                 json.dump(eval_stats, out_fh)
@@ -782,7 +829,8 @@ class TDQN:
     TempoRL DQN agent capable of handling more complex state inputs through use of contextualized behaviour actions.
     """
 
-    def __init__(self, state_dim, action_dim, skip_dim, gamma, env, eval_env, vision=False, shared=True):
+    def __init__(self, state_dim, action_dim, skip_dim, gamma, env, eval_env, vision=False, shared=True,
+                 fused_update=False, prioritized_skip_replay=False, stratify_skip_lengths=False):
         """
         Initialize the DQN Agent
         :param state_dim: dimensionality of the input states
@@ -793,6 +841,11 @@ class TDQN:
         :param eval_env: environment to evaluate on
         :param vision: boolean flag to indicate if the input state is an image or not
         :param shared: boolean flag to indicate if a weight sharing input representation is used or not.
+        :param fused_update: boolean flag to evaluate the next states of the skip and behaviour batch with one forward
+                             pass per network (see learn)
+        :param prioritized_skip_replay: boolean flag to sample the skip transitions proportionally to their TD-errors
+        :param stratify_skip_lengths: boolean flag to sample equally many skip transitions of every skip length
+                                      (only with prioritized_skip_replay)
         """
         if not vision:
             if shared:
@@ -822,6 +875,8 @@ class TDQN:
         self._gamma = gamma
         self._action_dim = action_dim
         self._skip_dim = skip_dim
+        self._skip_returns = SkipReturnAccumulator(gamma, skip_dim)
+        self.fused_update = fused_update
 
         self.batch_size = 32
         self.grad_clip_val = 40.0
@@ -831,14 +886,24 @@ class TDQN:
         self.final_epsilon = 0.01
         self.epsilon_timesteps = 200_000
         self.train_freq = 4
+        self.gradient_steps = 1  # gradient steps per update
 
         self._loss_function = nn.SmoothL1Loss()  # huber loss # nn.MSELoss()
         self._skip_loss_function = nn.SmoothL1Loss()  # nn.MSELoss()
+        self._weighted_skip_loss_function = nn.SmoothL1Loss(reduction='none')  # for prioritized skip replay
         self._q_optimizer = optim.Adam(self._q.parameters(), lr=0.001, betas=(0.9, 0.999), eps=1e-08)
         self._skip_q_optimizer = optim.Adam(self._skip_q.parameters(), lr=0.001, betas=(0.9, 0.999), eps=1e-08)
 
-        self._replay_buffer = ReplayBuffer(1e6)
-        self._skip_replay_buffer = NoneConcatSkipReplayBuffer(1e6)
+        # Image observations are stored as deduplicated uint8 frames shared by both buffers. All observations seen while
+        # skipping have to be recognized as duplicates, thus the cache has to cover the maximal skip.
+        self._frame_store = FrameStore(1.1 * 1e6, cache_size=skip_dim + 2) if vision else None
+        self._replay_buffer = ReplayBuffer(1e6, self._frame_store)
+        if prioritized_skip_replay:
+            self._skip_replay_buffer = PrioritizedSkipReplayBuffer(1e6, skip_dim, self._frame_store,
+                                                                   stratify=stratify_skip_lengths)
+        else:
+            self._skip_replay_buffer = NoneConcatSkipReplayBuffer(1e6, self._frame_store)
+        self.prioritized_skip_replay = prioritized_skip_replay
         self._env = env
         self._eval_env = eval_env
 
@@ -862,6 +927,170 @@ class TDQN:
             return np.random.randint(self._skip_dim)
         return u
 
+    def get_epsilon(self, total_steps: int) -> float:
+        """
+        Linearly decaying exploration schedule
+        """
+        if total_steps > self.epsilon_timesteps:
+            return self.final_epsilon
+        return self.initial_epsilon - (self.initial_epsilon - self.final_epsilon) * (
+                total_steps / self.epsilon_timesteps)
+
+    def get_actions(self, x: np.ndarray, epsilon: float) -> np.ndarray:
+        """
+        Batched version of get_action. Selects actions epsilon-greedy for a batch of observations x with a single
+        forward pass.
+        """
+        u = np.argmax(self._q(tt(x)).cpu().detach().numpy(), axis=1)
+        explore = np.random.uniform(size=len(u)) < epsilon
+        u[explore] = np.random.randint(self._action_dim, size=int(explore.sum()))
+        return u
+
+    def get_skips(self, x: np.ndarray, a: np.ndarray, epsilon: float) -> np.ndarray:
+        """
+        Batched version of get_skip. Selects skips epsilon-greedy for a batch of observations x conditioned on the
+        behaviour actions a (shape (batch_size, 1)) with a single forward pass.
+        """
+        u = np.argmax(self._skip_q(tt(x), tt(a)).cpu().detach().numpy(), axis=1)
+        explore = np.random.uniform(size=len(u)) < epsilon
+        u[explore] = np.random.randint(self._skip_dim, size=int(explore.sum()))
+        return u
+
+    def decide(self, x: np.ndarray, epsilon: float):
+        """
+        Batched decisions for the vectorized rollout (see utils.vec_rollout.VectorizedRollout)
+        :return: (actions to store in the replay buffer, actions to play, skips)
+        """
+        actions = self.get_actions(x, epsilon)
+        skips = self.get_skips(x, actions[:, None], epsilon)  # get skips with the selected actions as context
+        return actions, actions, skips
+
+    def add_transition(self, state, action, next_state, reward, done):
+        self._replay_buffer.add_transition(state, action, next_state, reward, done)
+
+    def add_skip_transitions(self, skip_states, skip_lengths, skip_returns, next_state, done, behaviour, skip):
+        """
+        Add all skips of the current action repetition that end in next_state to the skip replay buffer
+        :param skip_states: states at which the skips started
+        :param skip_lengths: lengths of the skips
+        :param skip_returns: discounted returns of the skips (see SkipReturnAccumulator)
+        :param next_state: state in which all skips end
+        :param done: terminal flag of next_state
+        :param behaviour: repeated behaviour action
+        :param skip: skip chosen for the current action repetition (ignored, all observed skips are stored)
+        """
+        for start_state, skip_length, skip_reward in zip(skip_states, skip_lengths, skip_returns):
+            self._skip_replay_buffer.add_transition(start_state, skip_length - 1, next_state, skip_reward, done,
+                                                    skip_length,
+                                                    np.array([behaviour]))  # also keep track of the behavior action
+
+    def _next_state_values(self, next_states, target_values=None):
+        """
+        Double DQN estimate of the values of the next states, i.e. Q_target(s', argmax_a Q(s', a))
+        :param next_states: batch of next states
+        :param target_values: optional Q_target(s') if already computed
+        """
+        if target_values is None:
+            target_values = self._q_target(next_states)
+        return target_values[torch.arange(len(next_states)).long(), torch.argmax(self._q(next_states), dim=1)]
+
+    def _fused_next_state_values(self, skip_next_states, next_states):
+        """
+        Next state values of the skip and the behaviour batch with one forward pass of the target network.
+        With a skip-Q that shares its weights with the behaviour Q the skip-Q update changes the greedy next actions of
+        the behaviour batch, so only the target network values of that batch are returned (see learn).
+        :return: (next state values of the skip batch,
+                  next state values of the behaviour batch or, with shared weights, its target network values)
+        """
+        batch_size = len(skip_next_states)
+        all_next_states = torch.cat([skip_next_states, next_states])
+        target_values = self._q_target(all_next_states)
+        if self._skip_q is self._q:
+            skip_target_values, target_values = target_values.split(batch_size)
+            return self._next_state_values(skip_next_states, skip_target_values), target_values
+        return self._next_state_values(all_next_states, target_values).split(batch_size)
+
+    def learn(self):
+        """
+        One double Q-learning update (with gradient clipping) of the skip-Q and the behaviour Q.
+        In the fused update mode both batches are sampled upfront and the next states of both batches are evaluated
+        with a single forward pass of the target network and, if the skip-Q does not share its weights with the
+        behaviour Q, of the behaviour Q. With shared weights the greedy next actions of the behaviour batch are
+        selected after the skip-Q update as in the unfused mode, i.e. both modes compute the same targets.
+        """
+        batch_size = self.batch_size
+
+        skip_batch = self._skip_replay_buffer.random_next_batch(batch_size)
+        if self.prioritized_skip_replay:
+            skip_batch, skip_weights = skip_batch[:-1], skip_batch[-1]
+        if self.fused_update:
+            batch = self._replay_buffer.random_next_batch(batch_size)
+            with torch.no_grad():
+                skip_next_values, next_values = self._fused_next_state_values(skip_batch[2], batch[2])
+
+        # Skip Q update based on double DQN where target is behavior Q
+        batch_states, batch_actions, batch_next_states, batch_rewards,\
+            batch_terminal_flags, batch_lengths, batch_behaviours = skip_batch
+        if not self.fused_update:
+            skip_next_values = self._next_state_values(batch_next_states)
+
+        target = batch_rewards + (1 - batch_terminal_flags) * np.power(self._gamma, batch_lengths) * skip_next_values
+        current_prediction = self._skip_q(batch_states, batch_behaviours)[
+            torch.arange(batch_size).long(), batch_actions.long()]
+
+        if self.prioritized_skip_replay:
+            # Importance-sampling weighted loss. The new priorities of the batch are its absolute TD-errors.
+            loss = (skip_weights * self._weighted_skip_loss_function(current_prediction, target.detach())).mean()
+            self._skip_replay_buffer.update_priorities((target - current_prediction).detach().cpu().numpy())
+        else:
+            loss = self._skip_loss_function(current_prediction, target.detach())
+
+        self._skip_q_optimizer.zero_grad()
+        loss.backward()
+        for param in self._skip_q.parameters():
+            if param.grad is not None:
+                param.grad.data.clamp_(-self.grad_clip_val, self.grad_clip_val)
+        self._skip_q_optimizer.step()
+
+        # Action Q update based on double DQN with normal target
+        if not self.fused_update:
+            batch = self._replay_buffer.random_next_batch(batch_size)
+        batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags = batch
+        if not self.fused_update:
+            next_values = self._next_state_values(batch_next_states)
+        elif self._skip_q is self._q:  # next_values are the target network values, see _fused_next_state_values
+            with torch.no_grad():
+                next_values = self._next_state_values(batch_next_states, next_values)
+
+        target = batch_rewards + (1 - batch_terminal_flags) * self._gamma * next_values
+        current_prediction = self._q(batch_states)[torch.arange(batch_size).long(), batch_actions.long()]
+
+        loss = self._loss_function(current_prediction, target.detach())
+
+        self._q_optimizer.zero_grad()
+        loss.backward()
+        for param in self._q.parameters():
+            if param.grad is not None:
+                param.grad.data.clamp_(-self.grad_clip_val, self.grad_clip_val)
+        self._q_optimizer.step()
+
+    def update(self, total_steps: int) -> bool:
+        """
+        Scheduled learner stage, called once per environment step.
+        Every train_freq environment steps (once more than learning_starts steps were taken) gradient_steps updates
+        are performed and every target_net_upd_freq steps the weights are copied to the target network.
+        On all other steps nothing is sampled or computed.
+        :param total_steps: number of environment steps taken so far
+        :return: True if the networks were updated
+        """
+        if total_steps <= self.learning_starts or total_steps % self.train_freq != 0:
+            return False
+        for _ in range(self.gradient_steps):
+            self.learn()
+        if (total_steps % self.target_net_upd_freq) == 0:
+            hard_update(self._q_target, self._q)
+        return True
+
     def eval(self, episodes: int, max_env_time_steps: int):
         """
         Simple method that evaluates the agent with fixed epsilon = 0
@@ -898,7 +1127,7 @@ class TDQN:
         return steps, rewards, decisions
 
     def train(self, episodes: int, max_env_time_steps: int, epsilon: float, eval_eps: int = 1,
-              eval_every_n_steps: int = 1, max_train_time_steps: int = 1_000_000):
+              eval_every_n_steps: int = 1, max_train_time_steps: int = 1_000_000, evaluator=None):
         """
         Training loop
         :param episodes: maximum number of episodes to train for
@@ -907,13 +1136,9 @@ class TDQN:
         :param eval_eps: numper of episodes to run for evaluation
         :param eval_every_n_steps: interval of steps after which to evaluate the trained agent
         :param max_train_time_steps: maximum number of steps to train
+        :param evaluator: optional utils.async_eval.AsyncEvaluator to run the evaluations in the background
         """
         total_steps = 0
-        num_update_steps = 0
-        batch_size = self.batch_size
-        grad_clip_val = self.grad_clip_val
-        target_net_upd_freq = self.target_net_upd_freq
-        learning_starts = self.learning_starts
 
         start_time = time.time()
 
@@ -923,109 +1148,38 @@ class TDQN:
             es = 0
             for _ in count():
 
-                if total_steps > self.epsilon_timesteps:
-                    epsilon = self.final_epsilon
-                else:
-                    epsilon = self.initial_epsilon - (self.initial_epsilon - self.final_epsilon) * (
-                                total_steps / self.epsilon_timesteps)
+                epsilon = self.get_epsilon(total_steps)
 
                 a = self.get_action(s, epsilon)
                 skip = self.get_skip(s, np.array([a]), epsilon)  # get skip with the selected action as context
 
                 d = False
-                skip_states, skip_rewards = [], []
+                skip_states = []
+                self._skip_returns.reset()
                 for curr_skip in range(skip + 1):  # repeat the selected action for "skip" times
                     ns, r, d, info_ = self._env.step(a)
                     print("reward:",r)
                     total_steps += 1
                     es += 1
                     skip_states.append(s)  # keep track of all observed skips
-                    skip_rewards.append(r)
+                    _, skip_lengths, skip_returns = self._skip_returns.add(r)  # properly discounted skip returns
 
                     #### Begin Evaluation
                     if (total_steps % eval_every_n_steps) == 0:
-                        eval_s, eval_r, eval_d = self.eval(eval_eps, max_env_time_steps)
-                        eval_stats = dict(
-                            elapsed_time=time.time() - start_time,
-                            training_steps=total_steps,
-                            training_eps=e,
-                            avg_num_steps_per_eval_ep=float(np.mean(eval_s)),
-                            avg_num_decs_per_eval_ep=float(np.mean(eval_d)),
-                            avg_rew_per_eval_ep=float(np.mean(eval_r)),
-                            std_rew_per_eval_ep=float(np.std(eval_r)),
-                            eval_eps=eval_eps
-                        )
-                        self.dict_tensorboard_write(input_dict=eval_stats, index=total_steps)
-                        # with open(os.path.join(out_dir, 'eval_scores.json'), 'a+') as out_fh:
-                        #     json.dump(eval_stats, out_fh)
-                        #     out_fh.write('\n')
+                        self._evaluate(dict(elapsed_time=time.time() - start_time, training_steps=total_steps,
+                                            training_eps=e), eval_eps, max_env_time_steps, evaluator)
+                    if evaluator is not None and evaluator.pending:
+                        for info, eval_results in evaluator.poll():
+                            self._write_eval(info, eval_results)
 
                     #### End Evaluation
 
-                    # Update the skip replay buffer with all observed skips.
-                    # if curr_skip == (skip + 1):
-                    skip_id = 0
-                    for start_state in skip_states:
-                        skip_reward = 0
-                        for exp, r in enumerate(skip_rewards[skip_id:]):  # make sure to properly discount
-                            skip_reward += np.power(self._gamma, exp) * r
-
-                        self._skip_replay_buffer.add_transition(start_state, curr_skip - skip_id, ns,
-                                                                skip_reward, d, curr_skip - skip_id + 1,
-                                                                np.array([a]))  # also keep track of the behavior action
-                        skip_id += 1
-
-                    # Skip Q update based on double DQN where target is behavior Q
-                    batch_states, batch_actions, batch_next_states, batch_rewards,\
-                        batch_terminal_flags, batch_lengths, batch_behaviours = \
-                        self._skip_replay_buffer.random_next_batch(batch_size)
-
-                    target = batch_rewards + (1 - batch_terminal_flags) * np.power(self._gamma, batch_lengths) * \
-                             self._q_target(batch_next_states)[torch.arange(batch_size).long(), torch.argmax(
-                                 self._q(batch_next_states), dim=1)]
-                    current_prediction = self._skip_q(batch_states, batch_behaviours)[
-                        torch.arange(batch_size).long(), batch_actions.long()]
-
-                    loss = self._skip_loss_function(current_prediction, target.detach())
-
-                    if (total_steps > learning_starts) and (total_steps % self.train_freq == 0):
-                        num_update_steps += 1
-                        self._skip_q_optimizer.zero_grad()
-                        loss.backward()
-                        for param in self._skip_q.parameters():
-                            if param.grad is None:
-                                pass
-                                # print("##### Skip Q Parameter with grad = None:", param.name)
-                            else:
-                                param.grad.data.clamp_(-grad_clip_val, grad_clip_val)
-                        self._skip_q_optimizer.step()
-
-                    # Action Q update based on double DQN with normal target
-                    self._replay_buffer.add_transition(s, a, ns, r, d)
-                    batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags = \
-                        self._replay_buffer.random_next_batch(batch_size)
-
-                    target = batch_rewards + (1 - batch_terminal_flags) * self._gamma * \
-                             self._q_target(batch_next_states)[torch.arange(batch_size).long(), torch.argmax(
-                                 self._q(batch_next_states), dim=1)]
-                    current_prediction = self._q(batch_states)[torch.arange(batch_size).long(), batch_actions.long()]
-
-                    loss = self._loss_function(current_prediction, target.detach())
-
-                    if (total_steps > learning_starts) and (total_steps % self.train_freq == 0):
-                        self._q_optimizer.zero_grad()
-                        loss.backward()
-                        for param in self._q.parameters():
-                            if param.grad is None:
-                                pass
-                                # print("##### Q Parameter with grad = None:", param.name)
-                            else:
-                                param.grad.data.clamp_(-grad_clip_val, grad_clip_val)
-                        self._q_optimizer.step()
-
-                        if (total_steps % target_net_upd_freq) == 0:
-                            hard_update(self._q_target, self._q)
-                        # soft_update(self._q_target, self._q, 0.01)
+                    # Update the skip replay buffer with all observed skips and the replay buffer with the transition
+                    self.add_skip_transitions(skip_states, skip_lengths, skip_returns, ns, d, a, skip)
+                    self.add_transition(s, a, ns, r, d)
+
+                    # Skip and behaviour Q updates based on double DQN (only on scheduled steps)
+                    self.update(total_steps)
 
                     if es >= max_env_time_steps or d or total_steps >= max_train_time_steps:
                         break
@@ -1038,22 +1192,35 @@ class TDQN:
 
         # final evaluation
         if (total_steps % eval_every_n_steps) != 0:
-            eval_s, eval_r, eval_d = self.eval(eval_eps, max_env_time_steps)
-            eval_stats = dict(
-                elapsed_time=time.time() - start_time,
-                training_steps=total_steps,
-                training_eps=e,
-                avg_num_steps_per_eval_ep=float(np.mean(eval_s)),
-                avg_num_decs_per_eval_ep=float(np.mean(eval_d)),
-                avg_rew_per_eval_ep=float(np.mean(eval_r)),
-                std_rew_per_eval_ep=float(np.std(eval_r)),
-                eval_eps=eval_eps
-            )
+            self._evaluate(dict(elapsed_time=time.time() - start_time, training_steps=total_steps, training_eps=e),
+                           eval_eps, max_env_time_steps, evaluator)
+        if evaluator is not None:
+            for info, eval_results in evaluator.close():
+                self._write_eval(info, eval_results)
+
+    def _evaluate(self, info, eval_eps, max_env_time_steps, evaluator=None):
+        """
+        Evaluate the agent, either directly or by submitting the current weights to the (asynchronous) evaluator
+        :param info: dict with the elapsed_time, training_steps and training_eps at which the evaluation is started
+        """
+        # The replay memory is reported as of the start of the evaluation
+        info.update(replay_memory_stats([self._replay_buffer, self._skip_replay_buffer], self._frame_store))
+        for done in evaluate(self, info, eval_eps, max_env_time_steps, evaluator):
+            self._write_eval(*done)
 
-            # with open(os.path.join(out_dir, 'eval_scores.json'), 'a+') as out_fh:
-            #     json.dump(eval_stats, out_fh)
-            #     out_fh.write('\n')
-            self.dict_tensorboard_write(input_dict=eval_stats, index=total_steps)
+    def _write_eval(self, info, eval_results):
+        """
+        Report the results of one evaluation to tensorboard
+        :param info: dict with the elapsed_time, training_steps and training_eps (and replay memory statistics)
+                     at which the evaluation was started
+        :param eval_results: result of eval
+        """
+        eval_stats = report_eval(info, eval_results)
+
+        # with open(os.path.join(out_dir, 'eval_scores.json'), 'a+') as out_fh:
+        #     json.dump(eval_stats, out_fh)
+        #     out_fh.write('\n')
+        self.dict_tensorboard_write(input_dict=eval_stats, index=eval_stats['training_steps'])
 
     def save_model(self, path):
         torch.save(self._q.state_dict(), os.path.join(path, 'Q'))
@@ -1132,10 +1299,38 @@ if __name__ == "__main__":
                         type=str,
                         help="Possible envs = 'mountain', 'moon' or any Atari env",
                         default='mountain')
+    parser.add_argument('--num-envs', default=1, type=int,
+                        help='Number of environment copies to train on in lockstep (vectorized rollout). '
+                             'Only supported for tdqn and t-dqn.')
+    parser.add_argument('--vec-env', choices=['sync', 'subproc'], default='subproc',
+                        help='Step the environment copies in this process or in worker processes.')
+    parser.add_argument('--env-workers', default=None, type=int,
+                        help='Number of worker processes for --vec-env subproc. Defaults to one per environment.')
+    parser.add_argument('--fused-update', action='store_true',
+                        help='Evaluate the next states of the skip and behaviour batch with one forward pass of the '
+                             'target network (tdqn, t-dqn) and of the behaviour Q (t-dqn only: with the shared '
+                             'network of tdqn the skip-Q update changes the greedy next actions). The losses equal '
+                             'those of the unfused update up to the floating point rounding of the batched passes.')
+    parser.add_argument('--prioritized-skip-replay', action='store_true',
+                        help='Replay skip transitions proportionally to their TD-errors (tdqn, t-dqn).')
+    parser.add_argument('--stratify-skip-lengths', action='store_true',
+                        help='Sample equally many skip transitions of every skip length '
+                             '(with --prioritized-skip-replay).')
+    parser.add_argument('--async-eval', default=0, type=int, metavar='N',
+                        help='Run the evaluations in N background processes instead of pausing training '
+                             '(tdqn and t-dqn only). Requires the networks on the CPU.')
+    parser.add_argument('--learning-starts', default=None, type=int,
+                        help='Number of environment steps before the first update (default 10000).')
+    parser.add_argument('--train-freq', default=None, type=int,
+                        help='Number of environment steps between updates (default 4).')
+    parser.add_argument('--gradient-steps', default=None, type=int,
+                        help='Number of gradient steps per update (default 1).')
 
 
     # setup output dir
     args = parser.parse_args()
+    if args.async_eval > 0 and args.agent not in ('tdqn', 't-dqn'):
+        parser.error('--async-eval is only supported for tdqn and t-dqn')
     torch.manual_seed(args.seed)
     np.random.seed(args.seed)
     random.seed(args.seed)
@@ -1158,13 +1353,14 @@ if __name__ == "__main__":
         if args.no_frame_skip:
             eval_game = '{}NoFrameskip-v4'.format(game)
             game = '{}NoFrameskip-v0'.format(game)
-            env = make_env_old(game, dim=84 if args.large_image else 42)
+            env_fn = lambda: make_env_old(game, dim=84 if args.large_image else 42)
             eval_env = make_env_old(eval_game, dim=84 if args.large_image else 42)
         else:
             eval_game = '{}Deterministic-v4'.format(game)
             game = '{}Deterministic-v0'.format(game)
-            env = make_env(game, dim=84 if args.large_image else 42)
+            env_fn = lambda: make_env(game, dim=84 if args.large_image else 42)
             eval_env = make_env(eval_game, dim=84 if args.large_image else 42)
+        env = env_fn()
 
         # Setup Agent
         state_dim = env.observation_space.shape[0]  # (4, 42, 42) or (4, 84, 84) for PyTorch order
@@ -1173,10 +1369,14 @@ if __name__ == "__main__":
             agent = DQN(state_dim, action_dim, gamma=0.99, env=env, eval_env=eval_env, vision=True)
         elif args.agent == 'tdqn':
             agent = TDQN(state_dim, action_dim, args.skip_net_max_skips, gamma=0.99, env=env, eval_env=eval_env,
-                         vision=True)
+                         vision=True, fused_update=args.fused_update,
+                         prioritized_skip_replay=args.prioritized_skip_replay,
+                         stratify_skip_lengths=args.stratify_skip_lengths)
         elif args.agent == 't-dqn':
             agent = TDQN(state_dim, action_dim, args.skip_net_max_skips, gamma=0.99, env=env,
-                         eval_env=eval_env, shared=False, vision=True)
+                         eval_env=eval_env, shared=False, vision=True, fused_update=args.fused_update,
+                         prioritized_skip_replay=args.prioritized_skip_replay,
+                         stratify_skip_lengths=args.stratify_skip_lengths)
         elif args.agent == 'dar':
             if args.dar_A is not None and args.dar_B is not None:
                 skip_map = {0: args.dar_A, 1: args.dar_B}
@@ -1192,11 +1392,11 @@ if __name__ == "__main__":
             # if args.sparse:
             if True:
                 from gym.envs.classic_control import MountainCarEnv
-            env = MountainCarEnv()
-            eval_env = MountainCarEnv()
+            env_fn = MountainCarEnv
         elif args.env == 'moon':
-            env = gym.make('LunarLander-v2')
-            eval_env = gym.make('LunarLander-v2')
+            env_fn = lambda: gym.make('LunarLander-v2')
+        env = env_fn()
+        eval_env = env_fn()
 
         # Setup agent
         state_dim = env.observation_space.shape[0]
@@ -1204,10 +1404,15 @@ if __name__ == "__main__":
         if args.agent == 'dqn':
             agent = DQN(state_dim, action_dim, gamma=0.99, env=env, eval_env=eval_env)
         elif args.agent == 'tdqn':
-            agent = TDQN(state_dim, action_dim, args.skip_net_max_skips, gamma=0.99, env=env, eval_env=eval_env)
+            agent = TDQN(state_dim, action_dim, args.skip_net_max_skips, gamma=0.99, env=env, eval_env=eval_env,
+                         fused_update=args.fused_update,
+                         prioritized_skip_replay=args.prioritized_skip_replay,
+                         stratify_skip_lengths=args.stratify_skip_lengths)
         elif args.agent == 't-dqn':
             agent = TDQN(state_dim, action_dim, args.skip_net_max_skips, gamma=0.99, env=env,
-                         eval_env=eval_env, shared=False)
+                         eval_env=eval_env, shared=False, fused_update=args.fused_update,
+                         prioritized_skip_replay=args.prioritized_skip_replay,
+                         stratify_skip_lengths=args.stratify_skip_lengths)
         elif args.agent == 'dar':
             if args.dar_A is not None and args.dar_B is not None:
                 skip_map = {0: args.dar_A, 1: args.dar_B}
@@ -1220,11 +1425,39 @@ if __name__ == "__main__":
         else:
             raise NotImplementedError
 
+    for setting in ['learning_starts', 'train_freq', 'gradient_steps']:
+        if getattr(args, setting) is not None:
+            setattr(agent, setting, getattr(args, setting))
+
     episodes = args.episodes
     max_env_time_steps = args.env_ms
     epsilon = 0.1
 
-    agent.train(episodes, max_env_time_steps, epsilon, args.eval_n_episodes, args.eval_after_n_steps,
-                max_train_time_steps=args.training_steps)
+    evaluator = None
+    if args.async_eval > 0:
+        from utils.async_eval import AsyncEvaluator
+
+        evaluator = AsyncEvaluator(agent, num_workers=args.async_eval)  # before any data is collected
+    if args.num_envs > 1:
+        if not hasattr(agent, 'decide'):
+            raise NotImplementedError('The vectorized rollout is not supported for {}'.format(args.agent))
+        from utils.vec_env import SyncVectorEnv, SubprocVectorEnv
+
+        if args.vec_env == 'subproc':
+            vec_env = SubprocVectorEnv([env_fn] * args.num_envs, num_workers=args.env_workers)
+        else:
+            vec_env = SyncVectorEnv([env_fn] * args.num_envs)
+        vec_env.seed(args.seed)
+        trainer = VectorizedRollout(agent, vec_env, gamma=0.99, max_skip=args.skip_net_max_skips, writer=writer,
+                                    evaluator=evaluator)
+        trainer.train(out_dir, episodes, max_env_time_steps, agent.get_epsilon, args.eval_n_episodes,
+                      args.eval_after_n_steps, max_train_time_steps=args.training_steps)
+        vec_env.close()
+    elif evaluator is not None:
+        agent.train(episodes, max_env_time_steps, epsilon, args.eval_n_episodes, args.eval_after_n_steps,
+                    max_train_time_steps=args.training_steps, evaluator=evaluator)
+    else:
+        agent.train(episodes, max_env_time_steps, epsilon, args.eval_n_episodes, args.eval_after_n_steps,
+                    max_train_time_steps=args.training_steps)
     os.mkdir(os.path.join(out_dir, 'final'))
     agent.save_model(os.path.join(out_dir, 'final'))
@@ -15,6 +15,7 @@ from DDPG.FiGAR import DDPG as FiGARDDPG
 from DDPG.TempoRL import DDPG as TempoRLDDPG
 from DDPG.vanilla import DDPG
 from utils import experiments
+from utils.skip_transitions import SkipReturnAccumulator
 
 
 # Runs policy for X episodes and returns average reward
@@ -142,6 +143,7 @@ if __name__ == "__main__":
         replay_buffer = utils.ReplayBuffer(state_dim, action_dim)
     if 'TempoRL' in args.policy:
         skip_replay_buffer = utils.FiGARReplayBuffer(state_dim, action_dim, rep_dim=1)
+    skip_return_accumulator = SkipReturnAccumulator(args.discount, max_rep)
 
     # Evaluate untrained policy
     evaluations = [[0, *eval_policy(policy, args.env, args.seed, FiGAR='FiGAR' in args.policy,
@@ -215,13 +217,14 @@ if __name__ == "__main__":
                 repetition = 1  # Never skip with vanilla DDPG
 
         # Perform action
-        skip_states, skip_rewards = [], []  # only used for TempoRL to build the local conectedness graph
+        skip_states = []  # only used for TempoRL to build the local conectedness graph
+        skip_return_accumulator.reset()
         for curr_skip in range(repetition):
             next_state, reward, done, _ = env.step(action)
             t += 1
             done_bool = float(done) if episode_timesteps < env._max_episode_steps else 0
             skip_states.append(state)
-            skip_rewards.append(reward)
+            _, skip_lengths, skip_returns = skip_return_accumulator.add(reward)  # properly discounted skip returns
 
             # Store data in replay buffer
             if 'FiGAR' in args.policy:
@@ -234,13 +237,8 @@ if __name__ == "__main__":
                 # TempoRL uses a second replay buffer that is only used for training the skip network
                 if 'TempoRL' in args.policy:
                     # Update the skip buffer with all observed transitions in the local connectedness graph
-                    skip_id = 0
-                    for start_state in skip_states:
-                        skip_reward = 0
-                        for exp, r in enumerate(skip_rewards[skip_id:]):
-                            skip_reward += np.power(policy.discount, exp) * r  # make sure to properly discount rewards
-                        skip_replay_buffer.add(start_state, action, curr_skip - skip_id, next_state, skip_reward, done)
-                        skip_id += 1
+                    for start_state, skip_length, skip_reward in zip(skip_states, skip_lengths, skip_returns):
+                        skip_replay_buffer.add(start_state, action, skip_length - 1, next_state, skip_reward, done)
 
             state = next_state
             episode_reward += reward
@@ -8,10 +8,17 @@ import torch.optim as optim
 import torch.nn.functional as F
 from torch.autograd import Variable
 from itertools import count
-from collections import namedtuple
 import time
 from mountain_car import MountainCarEnv
 from utils import experiments
+from utils.async_eval import evaluate, report_eval
+from utils.metrics_log import MetricsLog, export_txt
+from utils.numpy_mlp import MLPMirror
+from utils.profiler import PhaseProfiler
+from utils.replay_buffers import RingBuffer
+from utils.prioritized_replay import PrioritizedRingBuffer
+from utils.skip_transitions import SkipReturnAccumulator
+from utils.vec_rollout import VectorizedRollout
 from torch.utils.tensorboard import SummaryWriter
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -45,6 +52,20 @@ def hard_update(target, source):
     soft_update(target, source, 1.0)
 
 
+def single_step_skip_transitions(skip_returns, skip):
+    """
+    Lengths and rewards of the skip transitions stored by the featurized TQN/TDQN training loops.
+    After every step of an action repetition all skips observed so far are stored with length 1. Their reward is the
+    last reward of the repetition once all skip + 1 steps were played and 0 before.
+    :param skip_returns: skip returns of the SkipReturnAccumulator after the current step
+    :param skip: skip chosen for the current action repetition
+    :return: (lengths, rewards) of the skip transitions
+    """
+    num_skips = len(skip_returns)
+    reward = skip_returns[-1] if num_skips == skip + 1 else 0.
+    return np.ones(num_skips, dtype=np.int64), np.full(num_skips, reward)
+
+
 class NatureDQN(nn.Module):
     """
     DQN following the DQN implementation from
@@ -230,33 +251,15 @@ class ReplayBuffer:
     """
 
     def __init__(self, max_size):
-        self._data = namedtuple("ReplayBuffer", ["states", "actions", "next_states", "rewards", "terminal_flags"])
-        self._data = self._data(states=[], actions=[], next_states=[], rewards=[], terminal_flags=[])
-        self._size = 0
+        self._data = RingBuffer(max_size, ["states", "actions", "next_states", "rewards", "terminal_flags"])
         self._max_size = max_size
 
     def add_transition(self, state, action, next_state, reward, done):
-        self._data.states.append(state)
-        self._data.actions.append(action)
-        self._data.next_states.append(next_state)
-        self._data.rewards.append(reward)
-        self._data.terminal_flags.append(done)
-        self._size += 1
-
-        if self._size > self._max_size:
-            self._data.states.pop(0)
-            self._data.actions.pop(0)
-            self._data.next_states.pop(0)
-            self._data.rewards.pop(0)
-            self._data.terminal_flags.pop(0)
+        self._data.add(state, action, next_state, reward, done)
 
     def random_next_batch(self, batch_size):
-        batch_indices = np.random.choice(len(self._data.states), batch_size)
-        batch_states = np.array([self._data.states[i] for i in batch_indices])
-        batch_actions = np.array([self._data.actions[i] for i in batch_indices])
-        batch_next_states = np.array([self._data.next_states[i] for i in batch_indices])
-        batch_rewards = np.array([self._data.rewards[i] for i in batch_indices])
-        batch_terminal_flags = np.array([self._data.terminal_flags[i] for i in batch_indices])
+        batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags = \
+            self._data.random_batch(batch_size)
         return tt(batch_states), tt(batch_actions), tt(batch_next_states), tt(batch_rewards), tt(batch_terminal_flags)
 
 
@@ -268,37 +271,16 @@ class SkipReplayBuffer:
     """
 
     def __init__(self, max_size):
-        self._data = namedtuple("ReplayBuffer", ["states", "actions", "next_states",
-                                                 "rewards", "terminal_flags", "lengths"])
-        self._data = self._data(states=[], actions=[], next_states=[], rewards=[], terminal_flags=[], lengths=[])
-        self._size = 0
+        self._data = RingBuffer(max_size, ["states", "actions", "next_states",
+                                           "rewards", "terminal_flags", "lengths"])
         self._max_size = max_size
 
     def add_transition(self, state, action, next_state, reward, done, length):
-        self._data.states.append(state)
-        self._data.actions.append(action)
-        self._data.next_states.append(next_state)
-        self._data.rewards.append(reward)
-        self._data.terminal_flags.append(done)
-        self._data.lengths.append(length)  # Observed skip-length of the transition
-        self._size += 1
-
-        if self._size > self._max_size:
-            self._data.states.pop(0)
-            self._data.actions.pop(0)
-            self._data.next_states.pop(0)
-            self._data.rewards.pop(0)
-            self._data.terminal_flags.pop(0)
-            self._data.lengths.pop(0)
+        self._data.add(state, action, next_state, reward, done, length)  # length: Observed skip-length
 
     def random_next_batch(self, batch_size):
-        batch_indices = np.random.choice(len(self._data.states), batch_size)
-        batch_states = np.array([self._data.states[i] for i in batch_indices])
-        batch_actions = np.array([self._data.actions[i] for i in batch_indices])
-        batch_next_states = np.array([self._data.next_states[i] for i in batch_indices])
-        batch_rewards = np.array([self._data.rewards[i] for i in batch_indices])
-        batch_terminal_flags = np.array([self._data.terminal_flags[i] for i in batch_indices])
-        batch_lengths = np.array([self._data.lengths[i] for i in batch_indices])
+        batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags, batch_lengths = \
+            self._data.random_batch(batch_size)
         return tt(batch_states), tt(batch_actions), tt(batch_next_states),\
                tt(batch_rewards), tt(batch_terminal_flags), tt(batch_lengths)
 
@@ -312,45 +294,44 @@ class NoneConcatSkipReplayBuffer:
     """
 
     def __init__(self, max_size):
-        self._data = namedtuple("ReplayBuffer", ["states", "actions", "next_states",
-                                                 "rewards", "terminal_flags", "lengths", "behaviour_action"])
-        self._data = self._data(states=[], actions=[], next_states=[], rewards=[], terminal_flags=[], lengths=[],
-                                behaviour_action=[])
-        self._size = 0
+        self._data = RingBuffer(max_size, ["states", "actions", "next_states",
+                                           "rewards", "terminal_flags", "lengths", "behaviour_action"])
         self._max_size = max_size
 
     def add_transition(self, state, action, next_state, reward, done, length, behaviour):
-        self._data.states.append(state)
-        self._data.actions.append(action)
-        self._data.next_states.append(next_state)
-        self._data.rewards.append(reward)
-        self._data.terminal_flags.append(done)
-        self._data.lengths.append(length)  # Observed skip-length
-        self._data.behaviour_action.append(behaviour)  # Behaviour action to condition skip on
-        self._size += 1
-
-        if self._size > self._max_size:
-            self._data.states.pop(0)
-            self._data.actions.pop(0)
-            self._data.next_states.pop(0)
-            self._data.rewards.pop(0)
-            self._data.terminal_flags.pop(0)
-            self._data.lengths.pop(0)
-            self._data.behaviour_action.pop(0)
+        # length: Observed skip-length; behaviour: Behaviour action to condition skip on
+        self._data.add(state, action, next_state, reward, done, length, behaviour)
 
     def random_next_batch(self, batch_size):
-        batch_indices = np.random.choice(len(self._data.states), batch_size)
-        batch_states = np.array([self._data.states[i] for i in batch_indices])
-        batch_actions = np.array([self._data.actions[i] for i in batch_indices])
-        batch_next_states = np.array([self._data.next_states[i] for i in batch_indices])
-        batch_rewards = np.array([self._data.rewards[i] for i in batch_indices])
-        batch_terminal_flags = np.array([self._data.terminal_flags[i] for i in batch_indices])
-        batch_lengths = np.array([self._data.lengths[i] for i in batch_indices])
-        batch_behavoiurs = np.array([self._data.behaviour_action[i] for i in batch_indices])
+        batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags, batch_lengths, \
+            batch_behavoiurs = self._data.random_batch(batch_size)
         return tt(batch_states), tt(batch_actions), tt(batch_next_states),\
                tt(batch_rewards), tt(batch_terminal_flags), tt(batch_lengths), tt(batch_behavoiurs)
 
 
+class PrioritizedSkipReplayBuffer(NoneConcatSkipReplayBuffer):
+    """
+    Skip replay buffer with proportional prioritization by TD-error (see utils/prioritized_replay.py).
+    Optionally every batch is stratified by skip length, such that short skips are not crowded out by the more
+    numerous long skips.
+    random_next_batch additionally returns the importance-sampling weights of the batch. The priorities of the last
+    sampled batch are set with update_priorities.
+    """
+
+    def __init__(self, max_size, max_skip, stratify=False, alpha=0.6, beta=0.4):
+        super(PrioritizedSkipReplayBuffer, self).__init__(max_size)
+        self._data = PrioritizedRingBuffer(self._data, alpha, beta, stratify_by='lengths' if stratify else None,
+                                           num_strata=max_skip)
+        self._batch_slots = None
+
+    def random_next_batch(self, batch_size):
+        batch, self._batch_slots, weights = self._data.random_batch(batch_size)
+        return tuple(tt(x) for x in batch) + (tt(weights),)
+
+    def update_priorities(self, td_errors):
+        self._data.update_priorities(self._batch_slots, td_errors)
+
+
 class DQN:
     """
     Simple double DQN Agent
@@ -373,6 +354,7 @@ class DQN:
         else:  # For image states, i.e. Atari
             self._q = NatureDQN(state_dim, action_dim).to(device)
             self._q_target = NatureDQN(state_dim, action_dim).to(device)
+        self._q_mirror = None if vision else MLPMirror(self._q)  # NumPy forward pass for single observations
 
         self._gamma = gamma
         self._loss_function = nn.MSELoss()
@@ -382,17 +364,79 @@ class DQN:
         self._replay_buffer = ReplayBuffer(1e6)
         self._env = env
         self._eval_env = eval_env
+        self.train_freq = 1  # environment steps between updates in the vectorized rollout (see update)
+        self.gradient_steps = 1  # gradient steps per update
 
     def get_action(self, x: np.ndarray, epsilon: float) -> int:
         """
         Simple helper to get action epsilon-greedy based on observation x
         """
-        u = np.argmax(self._q(tt(x)).detach().numpy())
+        if self._q_mirror is not None:
+            u = np.argmax(self._q_mirror.q(x))
+        else:
+            u = np.argmax(self._q(tt(x)).detach().numpy())
         r = np.random.uniform()
         if r < epsilon:
             return np.random.randint(self._action_dim)
         return u
 
+    def get_actions(self, x: np.ndarray, epsilon: float) -> np.ndarray:
+        """
+        Batched version of get_action. Selects actions epsilon-greedy for a batch of observations x with a single
+        forward pass.
+        """
+        u = np.argmax(self._q(tt(x)).detach().numpy(), axis=1)
+        explore = np.random.uniform(size=len(u)) < epsilon
+        u[explore] = np.random.randint(self._action_dim, size=int(explore.sum()))
+        return u
+
+    def decide(self, x: np.ndarray, epsilon: float):
+        """
+        Batched decisions for the vectorized rollout (see VectorizedRollout)
+        :return: (actions to store in the replay buffer, actions to play, skips)
+        """
+        actions = self.get_actions(x, epsilon)
+        return actions, actions, np.zeros_like(actions)
+
+    def add_transition(self, state, action, next_state, reward, done):
+        self._replay_buffer.add_transition(state, action, next_state, reward, done)
+
+    def learn(self, batch_size: int = 64):
+        """
+        Double Q-learning update of the Q-function on one batch sampled from the replay buffer
+        """
+        batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags = \
+            self._replay_buffer.random_next_batch(batch_size)
+
+        target = batch_rewards + (1 - batch_terminal_flags) * self._gamma * \
+                 self._q_target(batch_next_states)[torch.arange(batch_size).long(), torch.argmax(
+                     self._q(batch_next_states), dim=1)]
+        current_prediction = self._q(batch_states)[torch.arange(batch_size).long(), batch_actions.long()]
+
+        loss = self._loss_function(current_prediction, target.detach())
+
+        self._q_optimizer.zero_grad()
+        loss.backward()
+        self._q_optimizer.step()
+        if self._q_mirror is not None:
+            self._q_mirror.mark_stale()
+
+        soft_update(self._q_target, self._q, 0.01)
+
+    def update(self, total_steps: int) -> bool:
+        """
+        Scheduled learner stage, called once per environment step by the vectorized rollout (see VectorizedRollout).
+        Every train_freq environment steps gradient_steps updates (learn) are performed. The defaults give one update
+        per environment step as in train, i.e. the replay ratio does not depend on the number of environments.
+        :param total_steps: number of environment steps taken so far
+        :return: True if the networks were updated
+        """
+        if total_steps % self.train_freq != 0:
+            return False
+        for _ in range(self.gradient_steps):
+            self.learn()
+        return True
+
     def train(self, episodes: int, max_env_time_steps: int, epsilon: float, eval_eps: int = 1,
               eval_every_n_steps: int = 1, max_train_time_steps: int = 1_000_000):
         """
@@ -435,24 +479,8 @@ class DQN:
                 ########### End Evaluation
 
                 # Update replay buffer
-                self._replay_buffer.add_transition(s, a, ns, r, d)
-                batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags = \
-                    self._replay_buffer.random_next_batch(64)
-
-                ########### Begin double Q-learning update
-                target = batch_rewards + (1 - batch_terminal_flags) * self._gamma * \
-                         self._q_target(batch_next_states)[torch.arange(64).long(), torch.argmax(
-                             self._q(batch_next_states), dim=1)]
-                current_prediction = self._q(batch_states)[torch.arange(64).long(), batch_actions.long()]
-
-                loss = self._loss_function(current_prediction, target.detach())
-
-                self._q_optimizer.zero_grad()
-                loss.backward()
-                self._q_optimizer.step()
-
-                soft_update(self._q_target, self._q, 0.01)
-                ########### End double Q-learning update
+                self.add_transition(s, a, ns, r, d)
+                self.learn()
 
                 if d:
                     break
@@ -536,6 +564,7 @@ class DAR:
         # TODO make DAR work for image states to use with ATARI
         self._q = Q(state_dim, action_dim * num_output_duplication).to(device)
         self._q_target = Q(state_dim, action_dim * num_output_duplication).to(device)
+        self._q_mirror = MLPMirror(self._q)  # NumPy forward pass for single observations
 
         self._gamma = gamma
         self._loss_function = nn.MSELoss()
@@ -547,17 +576,88 @@ class DAR:
         self._dup_vals = num_output_duplication
         self._env = env
         self._eval_env = eval_env
+        self.train_freq = 1  # environment steps between updates in the vectorized rollout (see update)
+        self.gradient_steps = 1  # gradient steps per update
+        self.profiler = PhaseProfiler()  # disabled, replace by an enabled one to time the phases of train and learn
 
     def get_action(self, x: np.ndarray, epsilon: float) -> int:
         """
         Simple helper to get action epsilon-greedy based on observation x
         """
-        u = np.argmax(self._q(tt(x)).detach().numpy())
+        if self._q_mirror is not None:
+            u = np.argmax(self._q_mirror.q(x))
+        else:
+            u = np.argmax(self._q(tt(x)).detach().numpy())
         r = np.random.uniform()
         if r < epsilon:
             return np.random.randint(self._action_dim)
         return u
 
+    def get_actions(self, x: np.ndarray, epsilon: float) -> np.ndarray:
+        """
+        Batched version of get_action. Selects actions epsilon-greedy for a batch of observations x with a single
+        forward pass.
+        """
+        u = np.argmax(self._q(tt(x)).detach().numpy(), axis=1)
+        explore = np.random.uniform(size=len(u)) < epsilon
+        u[explore] = np.random.randint(self._action_dim, size=int(explore.sum()))
+        return u
+
+    def decide(self, x: np.ndarray, epsilon: float):
+        """
+        Batched decisions for the vectorized rollout (see VectorizedRollout)
+        :return: (actions to store in the replay buffer, actions to play, skips)
+        """
+        a = self.get_actions(x, epsilon)
+        # convert action ids into the corresponding behaviour actions and skip values
+        act = a // self._dup_vals
+        rep = a // self._action_dim
+        skips = np.array([self._skip_map[r] for r in rep], dtype=np.int64)
+        return a, act, skips
+
+    def add_transition(self, state, action, next_state, reward, done):
+        self._replay_buffer.add_transition(state, action, next_state, reward, done)
+
+    def learn(self, batch_size: int = 64):
+        """
+        Double Q-learning update of the Q-function on one batch sampled from the replay buffer
+        """
+        with self.profiler.phase('learn/sample'):
+            batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags = \
+                self._replay_buffer.random_next_batch(batch_size)
+
+        with self.profiler.phase('learn/q_update'):
+            target = batch_rewards + (1 - batch_terminal_flags) * self._gamma * \
+                     self._q_target(batch_next_states)[torch.arange(batch_size).long(), torch.argmax(
+                         self._q(batch_next_states), dim=1)]
+            current_prediction = self._q(batch_states)[torch.arange(batch_size).long(), batch_actions.long()]
+
+            loss = self._loss_function(current_prediction, target.detach())
+
+            self._q_optimizer.zero_grad()
+            loss.backward()
+            self._q_optimizer.step()
+            if self._q_mirror is not None:
+                self._q_mirror.mark_stale()
+
+        with self.profiler.phase('learn/target_update'):
+            soft_update(self._q_target, self._q, 0.01)
+        self.profiler.count('gradient_steps')
+
+    def update(self, total_steps: int) -> bool:
+        """
+        Scheduled learner stage, called once per environment step by the vectorized rollout (see VectorizedRollout).
+        Every train_freq environment steps gradient_steps updates (learn) are performed. The defaults give one update
+        per environment step as in train, i.e. the replay ratio does not depend on the number of environments.
+        :param total_steps: number of environment steps taken so far
+        :return: True if the networks were updated
+        """
+        if total_steps % self.train_freq != 0:
+            return False
+        for _ in range(self.gradient_steps):
+            self.learn()
+        return True
+
     def train(self, episodes: int, max_env_time_steps: int, epsilon: float, eval_eps: int = 1,
               eval_every_n_steps: int = 1, max_train_time_steps: int = 1_000_000):
         """
@@ -576,7 +676,9 @@ class DAR:
             s = self._env.reset()
             es = 0
             for t in range(max_env_time_steps):
-                a = self.get_action(s, epsilon)
+                with self.profiler.phase('act'):
+                    a = self.get_action(s, epsilon)
+                self.profiler.count('decisions')
 
                 # convert action id int corresponding behaviour action and skip value
                 act = a // self._dup_vals  # behaviour
@@ -584,13 +686,17 @@ class DAR:
                 skip = self._skip_map[rep]  # skip id to corresponding skip value
 
                 for _ in range(skip + 1):  # repeat chosen behaviour action for "skip" steps
-                    ns, r, d, _ = self._env.step(act)
+                    with self.profiler.phase('env_step'):
+                        ns, r, d, _ = self._env.step(act)
                     total_steps += 1
                     es += 1
+                    self.profiler.count('env_steps')
 
                     ########### Begin Evaluation
                     if (total_steps % eval_every_n_steps) == 0:
-                        eval_s, eval_r, eval_d = self.eval(eval_eps, max_env_time_steps)
+                        with self.profiler.phase('evaluation'):
+                            eval_s, eval_r, eval_d = self.eval(eval_eps, max_env_time_steps)
+                        self.profiler.write(total_steps)
                         eval_stats = dict(
                             elapsed_time=time.time() - start_time,
                             training_steps=total_steps,
@@ -608,22 +714,10 @@ class DAR:
                     ########### End Evaluation
 
                     ### Q-update based double Q learning
-                    self._replay_buffer.add_transition(s, a, ns, r, d)
-                    batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags = \
-                        self._replay_buffer.random_next_batch(64)
-
-                    target = batch_rewards + (1 - batch_terminal_flags) * self._gamma * \
-                             self._q_target(batch_next_states)[torch.arange(64).long(), torch.argmax(
-                                 self._q(batch_next_states), dim=1)]
-                    current_prediction = self._q(batch_states)[torch.arange(64).long(), batch_actions.long()]
-
-                    loss = self._loss_function(current_prediction, target.detach())
-
-                    self._q_optimizer.zero_grad()
-                    loss.backward()
-                    self._q_optimizer.step()
-
-                    soft_update(self._q_target, self._q, 0.01)
+                    with self.profiler.phase('replay_fill'):
+                        self.add_transition(s, a, ns, r, d)
+                    with self.profiler.phase('learn'):
+                        self.learn()
                     if es >= max_env_time_steps or d or total_steps >= max_train_time_steps:
                         break
 
@@ -650,6 +744,8 @@ class DAR:
             with open(os.path.join(out_dir, 'eval_scores.json'), 'a+') as out_fh:
                 json.dump(eval_stats, out_fh)
                 out_fh.write('\n')
+        if self.profiler.enabled:
+            print(self.profiler.summary())
 
     def eval(self, episodes: int, max_env_time_steps: int):
         """
@@ -702,7 +798,7 @@ class TQN:
     """
 
     def __init__(self, state_dim: int, action_dim: int, skip_dim: int, gamma: float, env: gym.Env, eval_env: gym.Env,
-                 vision: bool = False):
+                 vision: bool = False, multi_step_skips: bool = False):
         """
         Initialize the DQN Agent
         :param state_dim: dimensionality of the input states
@@ -712,6 +808,9 @@ class TQN:
         :param env: environment to train on
         :param eval_env: environment to evaluate on
         :param vision: boolean flag to indicate if the input state is an image or not
+        :param multi_step_skips: boolean flag to store all observed skips with their lengths and discounted returns
+                                 (as the Atari agents) instead of as skips of length 1
+                                 (see single_step_skip_transitions)
         """
         if not vision:  # featurized states
             self._q = Q(state_dim, action_dim).to(device)
@@ -728,6 +827,8 @@ class TQN:
         self._skip_q_optimizer = optim.Adam(self._skip_q.parameters(), lr=0.001)
         self._action_dim = action_dim
         self._skip_dim = skip_dim
+        self._skip_returns = SkipReturnAccumulator(gamma, skip_dim)
+        self.multi_step_skips = multi_step_skips
 
         self._replay_buffer = ReplayBuffer(1e6)
         self._skip_replay_buffer = SkipReplayBuffer(1e6)
@@ -822,13 +923,14 @@ class TQN:
                 skip = self.get_skip(skip_state, epsilon)
 
                 d = False
-                skip_states, skip_rewards = [], []
+                skip_states = []
+                self._skip_returns.reset()
                 for _ in range(skip + 1):  # play the same action a "skip" times
                     ns, r, d, _ = self._env.step(a)
                     total_steps += 1
                     es += 1
                     skip_states.append(np.hstack([s, [a]]))  # keep track of all states that are visited inbetween
-                    skip_rewards.append(r)
+                    _, skip_lengths, skip_returns = self._skip_returns.add(r)  # properly discounted skip returns
 
                     #### Evaluation
                     if (total_steps % eval_every_n_steps) == 0:
@@ -850,14 +952,11 @@ class TQN:
                     ### Evaluation
 
                     # Update the skip buffer with all observed transitions
-                    skip_id = 0
-                    for start_state in skip_states:
-                        skip_reward = 0
-                        for exp, r in enumerate(skip_rewards[skip:]):
-                            skip_reward += np.power(self._gamma, exp) * r  # make sure to properly discount rewards
-
-                        self._skip_replay_buffer.add_transition(start_state, skip_id, ns, skip_reward, d, skip_id + 1)
-                    skip_id += 1
+                    if not self.multi_step_skips:
+                        skip_lengths, skip_returns = single_step_skip_transitions(skip_returns, skip)
+                    for start_state, skip_length, skip_reward in zip(skip_states, skip_lengths, skip_returns):
+                        self._skip_replay_buffer.add_transition(start_state, skip_length - 1, ns, skip_reward, d,
+                                                                skip_length)
 
                     # Skip Q update based on double DQN where the target is the behaviour network
                     batch_states, batch_actions, batch_next_states, batch_rewards, \
@@ -931,7 +1030,9 @@ class TDQN:
     TempoRL DQN agent capable of handling more complex state inputs through use of contextualized behaviour actions.
     """
 
-    def __init__(self, state_dim, action_dim, skip_dim, gamma, env, eval_env, vision=False, shared=True):
+    def __init__(self, state_dim, action_dim, skip_dim, gamma, env, eval_env, vision=False, shared=True,
+                 fused_update=False, prioritized_skip_replay=False, stratify_skip_lengths=False,
+                 multi_step_skips=False):
         """
         Initialize the DQN Agent
         :param state_dim: dimensionality of the input states
@@ -942,6 +1043,14 @@ class TDQN:
         :param eval_env: environment to evaluate on
         :param vision: boolean flag to indicate if the input state is an image or not
         :param shared: boolean flag to indicate if a weight sharing input representation is used or not.
+        :param fused_update: boolean flag to evaluate the next states of the skip and behaviour batch with one forward
+                             pass per network (see learn)
+        :param prioritized_skip_replay: boolean flag to sample the skip transitions proportionally to their TD-errors
+        :param stratify_skip_lengths: boolean flag to sample equally many skip transitions of every skip length
+                                      (only with prioritized_skip_replay)
+        :param multi_step_skips: boolean flag to store all observed skips with their lengths and discounted returns
+                                 (as the Atari agents) instead of as skips of length 1
+                                 (see single_step_skip_transitions)
         """
         if not vision:
             if shared:
@@ -958,27 +1067,44 @@ class TDQN:
             self._skip_q = self._q
         else:
             self._skip_q = TQ(state_dim, skip_dim).to(device)
+        # NumPy forward passes for single observations
+        self._q_mirror = None if vision else MLPMirror(self._q)
+        self._skip_q_mirror = self._q_mirror if shared or vision else MLPMirror(self._skip_q)
         print('Using {} as Q'.format(str(self._q)))
         print('Using {} as skip-Q\n{}'.format(str(self._skip_q), '#' * 80))
 
         self._gamma = gamma
         self._loss_function = nn.MSELoss()
         self._skip_loss_function = nn.MSELoss()
+        self._weighted_skip_loss_function = nn.MSELoss(reduction='none')  # for prioritized skip replay
         self._q_optimizer = optim.Adam(self._q.parameters(), lr=0.001)
         self._skip_q_optimizer = optim.Adam(self._skip_q.parameters(), lr=0.001)
         self._action_dim = action_dim
         self._skip_dim = skip_dim
+        self._skip_returns = SkipReturnAccumulator(gamma, skip_dim)
+        self.fused_update = fused_update
+        self.multi_step_skips = multi_step_skips
 
         self._replay_buffer = ReplayBuffer(1e6)
-        self._skip_replay_buffer = NoneConcatSkipReplayBuffer(1e6)
+        if prioritized_skip_replay:
+            self._skip_replay_buffer = PrioritizedSkipReplayBuffer(1e6, skip_dim, stratify=stratify_skip_lengths)
+        else:
+            self._skip_replay_buffer = NoneConcatSkipReplayBuffer(1e6)
+        self.prioritized_skip_replay = prioritized_skip_replay
         self._env = env
         self._eval_env = eval_env
+        self.train_freq = 1  # environment steps between updates in the vectorized rollout (see update)
+        self.gradient_steps = 1  # gradient steps per update
+        self.profiler = PhaseProfiler()  # disabled, replace by an enabled one to time the phases of train and learn
 
     def get_action(self, x: np.ndarray, epsilon: float) -> int:
         """
         Simple helper to get action epsilon-greedy based on observation x
         """
-        u = np.argmax(self._q(tt(x[None, :])).cpu().detach().numpy())
+        if self._q_mirror is not None:
+            u = np.argmax(self._q_mirror.q(x))
+        else:
+            u = np.argmax(self._q(tt(x[None, :])).cpu().detach().numpy())
         r = np.random.uniform()
         if r < epsilon:
             return np.random.randint(self._action_dim)
@@ -989,12 +1115,172 @@ class TDQN:
         """
         Simple helper to get the skip epsilon-greedy based on observation x conditioned on behaviour action a
         """
-        u = np.argmax(self._skip_q(tt(x), tt(a)).detach().numpy())
+        if self._skip_q_mirror is not None:
+            u = np.argmax(self._skip_q_mirror.skip_q(x, a))
+        else:
+            u = np.argmax(self._skip_q(tt(x), tt(a)).detach().numpy())
         r = np.random.uniform()
         if r < epsilon:
             return np.random.randint(self._skip_dim)
         return u
 
+    def get_actions(self, x: np.ndarray, epsilon: float) -> np.ndarray:
+        """
+        Batched version of get_action. Selects actions epsilon-greedy for a batch of observations x with a single
+        forward pass.
+        """
+        u = np.argmax(self._q(tt(x)).cpu().detach().numpy(), axis=1)
+        explore = np.random.uniform(size=len(u)) < epsilon
+        u[explore] = np.random.randint(self._action_dim, size=int(explore.sum()))
+        return u
+
+    def get_skips(self, x: np.ndarray, a: np.ndarray, epsilon: float) -> np.ndarray:
+        """
+        Batched version of get_skip. Selects skips epsilon-greedy for a batch of observations x conditioned on the
+        behaviour actions a (shape (batch_size, 1)) with a single forward pass.
+        """
+        u = np.argmax(self._skip_q(tt(x), tt(a)).cpu().detach().numpy(), axis=1)
+        explore = np.random.uniform(size=len(u)) < epsilon
+        u[explore] = np.random.randint(self._skip_dim, size=int(explore.sum()))
+        return u
+
+    def decide(self, x: np.ndarray, epsilon: float):
+        """
+        Batched decisions for the vectorized rollout (see VectorizedRollout)
+        :return: (actions to store in the replay buffer, actions to play, skips)
+        """
+        actions = self.get_actions(x, epsilon)
+        skips = self.get_skips(x, actions[:, None], epsilon)  # get skips with the selected actions as context
+        return actions, actions, skips
+
+    def add_transition(self, state, action, next_state, reward, done):
+        self._replay_buffer.add_transition(state, action, next_state, reward, done)
+
+    def add_skip_transitions(self, skip_states, skip_lengths, skip_returns, next_state, done, behaviour, skip):
+        """
+        Add all skips of the current action repetition that end in next_state to the skip replay buffer
+        (as transitions of length 1 unless multi_step_skips, see single_step_skip_transitions)
+        :param skip_states: states at which the skips started
+        :param skip_lengths: lengths of the skips
+        :param skip_returns: discounted returns of the skips (see SkipReturnAccumulator)
+        :param next_state: state in which all skips end
+        :param done: terminal flag of next_state
+        :param behaviour: repeated behaviour action
+        :param skip: skip chosen for the current action repetition
+        """
+        if not self.multi_step_skips:
+            skip_lengths, skip_returns = single_step_skip_transitions(skip_returns, skip)
+        for start_state, skip_length, skip_reward in zip(skip_states, skip_lengths, skip_returns):
+            self._skip_replay_buffer.add_transition(start_state, skip_length - 1, next_state, skip_reward, done,
+                                                    skip_length,
+                                                    np.array([behaviour]))  # also keep track of the behavior action
+
+    def _next_state_values(self, next_states, target_values=None):
+        """
+        Double DQN estimate of the values of the next states, i.e. Q_target(s', argmax_a Q(s', a))
+        :param next_states: batch of next states
+        :param target_values: optional Q_target(s') if already computed
+        """
+        if target_values is None:
+            target_values = self._q_target(next_states)
+        return target_values[torch.arange(len(next_states)).long(), torch.argmax(self._q(next_states), dim=1)]
+
+    def _fused_next_state_values(self, skip_next_states, next_states):
+        """
+        Next state values of the skip and the behaviour batch with one forward pass of the target network.
+        With a skip-Q that shares its weights with the behaviour Q the skip-Q update changes the greedy next actions of
+        the behaviour batch, so only the target network values of that batch are returned (see learn).
+        :return: (next state values of the skip batch,
+                  next state values of the behaviour batch or, with shared weights, its target network values)
+        """
+        batch_size = len(skip_next_states)
+        all_next_states = torch.cat([skip_next_states, next_states])
+        target_values = self._q_target(all_next_states)
+        if self._skip_q is self._q:
+            skip_target_values, target_values = target_values.split(batch_size)
+            return self._next_state_values(skip_next_states, skip_target_values), target_values
+        return self._next_state_values(all_next_states, target_values).split(batch_size)
+
+    def learn(self, batch_size: int = 64):
+        """
+        Double Q-learning updates of the skip-Q and the behaviour Q on one batch each. Both batches are sampled upfront.
+        In the fused update mode the next states of both batches are evaluated with a single forward pass of the target
+        network and, if the skip-Q does not share its weights with the behaviour Q, of the behaviour Q. With shared
+        weights the greedy next actions of the behaviour batch are selected after the skip-Q update as in the unfused
+        mode, i.e. both modes compute the same targets.
+        """
+        with self.profiler.phase('learn/sample'):
+            skip_batch = self._skip_replay_buffer.random_next_batch(batch_size)
+            if self.prioritized_skip_replay:
+                skip_batch, skip_weights = skip_batch[:-1], skip_batch[-1]
+            batch = self._replay_buffer.random_next_batch(batch_size)
+        if self.fused_update:
+            with self.profiler.phase('learn/fused_targets'), torch.no_grad():
+                skip_next_values, next_values = self._fused_next_state_values(skip_batch[2], batch[2])
+
+        # Skip Q update based on double DQN where target is behavior Q
+        with self.profiler.phase('learn/skip_q_update'):
+            batch_states, batch_actions, batch_next_states, batch_rewards,\
+                batch_terminal_flags, batch_lengths, batch_behaviours = skip_batch
+            if not self.fused_update:
+                skip_next_values = self._next_state_values(batch_next_states)
+
+            target = batch_rewards + (1 - batch_terminal_flags) * np.power(self._gamma, batch_lengths) * \
+                skip_next_values
+            current_prediction = self._skip_q(batch_states, batch_behaviours)[
+                torch.arange(batch_size).long(), batch_actions.long()]
+
+            if self.prioritized_skip_replay:
+                # Importance-sampling weighted loss. The new priorities of the batch are its absolute TD-errors.
+                loss = (skip_weights * self._weighted_skip_loss_function(current_prediction, target.detach())).mean()
+                self._skip_replay_buffer.update_priorities((target - current_prediction).detach().cpu().numpy())
+            else:
+                loss = self._skip_loss_function(current_prediction, target.detach())
+
+            self._skip_q_optimizer.zero_grad()
+            loss.backward()
+            self._skip_q_optimizer.step()
+            if self._skip_q_mirror is not None:
+                self._skip_q_mirror.mark_stale()
+
+        # Action Q update based on double DQN with normal target
+        with self.profiler.phase('learn/q_update'):
+            batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags = batch
+            if not self.fused_update:
+                next_values = self._next_state_values(batch_next_states)
+            elif self._skip_q is self._q:  # next_values are the target network values, see _fused_next_state_values
+                with torch.no_grad():
+                    next_values = self._next_state_values(batch_next_states, next_values)
+
+            target = batch_rewards + (1 - batch_terminal_flags) * self._gamma * next_values
+            current_prediction = self._q(batch_states)[torch.arange(batch_size).long(), batch_actions.long()]
+
+            loss = self._loss_function(current_prediction, target.detach())
+
+            self._q_optimizer.zero_grad()
+            loss.backward()
+            self._q_optimizer.step()
+            if self._q_mirror is not None:
+                self._q_mirror.mark_stale()
+
+        with self.profiler.phase('learn/target_update'):
+            soft_update(self._q_target, self._q, 0.01)
+        self.profiler.count('gradient_steps', 2)
+
+    def update(self, total_steps: int) -> bool:
+        """
+        Scheduled learner stage, called once per environment step by the vectorized rollout (see VectorizedRollout).
+        Every train_freq environment steps gradient_steps updates (learn) are performed. The defaults give one update
+        per environment step as in train, i.e. the replay ratio does not depend on the number of environments.
+        :param total_steps: number of environment steps taken so far
+        :return: True if the networks were updated
+        """
+        if total_steps % self.train_freq != 0:
+            return False
+        for _ in range(self.gradient_steps):
+            self.learn()
+        return True
+
     def eval(self, episodes: int, max_env_time_steps: int):
         """
         Simple method that evaluates the agent with fixed epsilon = 0
@@ -1038,7 +1324,7 @@ class TDQN:
         return steps, rewards, decisions
 
     def train(self, directory, episodes: int, max_env_time_steps: int, epsilon: float, eval_eps: int = 1,
-              eval_every_n_steps: int = 1, max_train_time_steps: int = 1_000_000):
+              eval_every_n_steps: int = 1, max_train_time_steps: int = 1_000_000, evaluator=None):
         """
         Training loop
         :param episodes: maximum number of episodes to train for
@@ -1047,97 +1333,51 @@ class TDQN:
         :param eval_eps: numper of episodes to run for evaluation
         :param eval_every_n_steps: interval of steps after which to evaluate the trained agent
         :param max_train_time_steps: maximum number of steps to train
+        :param evaluator: optional utils.async_eval.AsyncEvaluator to run the evaluations in the background
         """
         total_steps = 0
-        rew = []
-        step = []
+        metrics = MetricsLog(directory)
         start_time = time.time()
         for e in range(episodes):
             print("%s/%s" % (e + 1, episodes))
             s = self._env.reset()
             es = 0
             for _ in count():
-                a = self.get_action(s, epsilon)
-                skip = self.get_skip(s, np.array([a]), epsilon)  # get skip with the selected action as context
+                with self.profiler.phase('act'):
+                    a = self.get_action(s, epsilon)
+                    skip = self.get_skip(s, np.array([a]), epsilon)  # get skip with the selected action as context
+                self.profiler.count('decisions')
 
                 d = False
-                skip_states, skip_rewards = [], []
+                skip_states = []
+                self._skip_returns.reset()
                 for _ in range(skip + 1):  # repeat the selected action for "skip" times
-                    ns, r, d, _ = self._env.step(a)
+                    with self.profiler.phase('env_step'):
+                        ns, r, d, _ = self._env.step(a)
                     total_steps += 1
                     es += 1
+                    self.profiler.count('env_steps')
                     skip_states.append(s)  # keep track of all observed skips
-                    skip_rewards.append(r)
+                    _, skip_lengths, skip_returns = self._skip_returns.add(r)  # properly discounted skip returns
 
                     #### Begin Evaluation
                     if (total_steps % eval_every_n_steps) == 0:
-                        eval_s, eval_r, eval_d = self.eval(eval_eps, max_env_time_steps)
-                        eval_stats = dict(
-                            elapsed_time=time.time() - start_time,
-                            training_steps=total_steps,
-                            training_eps=e,
-                            avg_num_steps_per_eval_ep=float(np.mean(eval_s)),
-                            avg_num_decs_per_eval_ep=float(np.mean(eval_d)),
-                            avg_rew_per_eval_ep=float(np.mean(eval_r)),
-                            std_rew_per_eval_ep=float(np.std(eval_r)),
-                            eval_eps=eval_eps
-                        )
-                        rew.append(eval_stats['avg_rew_per_eval_ep'])
-                        step.append(total_steps)
-                        print("reward:", rew, "  step:", step)
-                        np.savetxt(directory + "/reward.txt", rew)
-                        np.savetxt(directory + "/step.txt", step)
-                        self.dict_tensorboard_write(input_dict=eval_stats, index=total_steps)
-                        # with open(os.path.join(out_dir, 'eval_scores.json'), 'a+') as out_fh:
-                        #     json.dump(eval_stats, out_fh)
-                        #     out_fh.write('\n')
+                        with self.profiler.phase('evaluation'):
+                            info = dict(elapsed_time=time.time() - start_time, training_steps=total_steps,
+                                        training_eps=e)
+                            self._evaluate(metrics, info, eval_eps, max_env_time_steps, evaluator)
+                        self.profiler.write(total_steps)
+                    if evaluator is not None and evaluator.pending:
+                        for info, eval_results in evaluator.poll():
+                            self._write_eval(metrics, info, eval_results)
                     #### End Evaluation
 
-                    # Update the skip replay buffer with all observed skips.
-                    skip_id = 0
-                    for start_state in skip_states:
-                        skip_reward = 0
-                        for exp, r in enumerate(skip_rewards[skip:]):  # make sure to properly discount
-                            skip_reward += np.power(self._gamma, exp) * r
-
-                        self._skip_replay_buffer.add_transition(start_state, skip_id, ns, skip_reward, d, skip_id + 1,
-                                                                np.array([a]))  # also keep track of the behavior action
-                    skip_id += 1
-
-                    # Skip Q update based on double DQN where target is behavior Q
-                    batch_states, batch_actions, batch_next_states, batch_rewards,\
-                        batch_terminal_flags, batch_lengths, batch_behaviours = \
-                        self._skip_replay_buffer.random_next_batch(64)
-
-                    target = batch_rewards + (1 - batch_terminal_flags) * np.power(self._gamma, batch_lengths) * \
-                             self._q_target(batch_next_states)[torch.arange(64).long(), torch.argmax(
-                                 self._q(batch_next_states), dim=1)]
-                    current_prediction = self._skip_q(batch_states, batch_behaviours)[
-                        torch.arange(64).long(), batch_actions.long()]
-
-                    loss = self._skip_loss_function(current_prediction, target.detach())
-
-                    self._skip_q_optimizer.zero_grad()
-                    loss.backward()
-                    self._skip_q_optimizer.step()
-
-                    # Action Q update based on double DQN with normal target
-                    self._replay_buffer.add_transition(s, a, ns, r, d)
-                    batch_states, batch_actions, batch_next_states, batch_rewards, batch_terminal_flags = \
-                        self._replay_buffer.random_next_batch(64)
-
-                    target = batch_rewards + (1 - batch_terminal_flags) * self._gamma * \
-                             self._q_target(batch_next_states)[torch.arange(64).long(), torch.argmax(
-                                 self._q(batch_next_states), dim=1)]
-                    current_prediction = self._q(batch_states)[torch.arange(64).long(), batch_actions.long()]
-
-                    loss = self._loss_function(current_prediction, target.detach())
-
-                    self._q_optimizer.zero_grad()
-                    loss.backward()
-                    self._q_optimizer.step()
-
-                    soft_update(self._q_target, self._q, 0.01)
+                    # Update the skip replay buffer with all observed skips and the replay buffer with the transition
+                    with self.profiler.phase('replay_fill'):
+                        self.add_skip_transitions(skip_states, skip_lengths, skip_returns, ns, d, a, skip)
+                        self.add_transition(s, a, ns, r, d)
+                    with self.profiler.phase('learn'):
+                        self.learn()
                     if es >= max_env_time_steps or d or total_steps >= max_train_time_steps:
                         break
 
@@ -1149,27 +1389,36 @@ class TDQN:
 
         # final evaluation
         if (total_steps % eval_every_n_steps) != 0:
-            eval_s, eval_r, eval_d = self.eval(eval_eps, max_env_time_steps)
-            eval_stats = dict(
-                elapsed_time=time.time() - start_time,
-                training_steps=total_steps,
-                training_eps=e,
-                avg_num_steps_per_eval_ep=float(np.mean(eval_s)),
-                avg_num_decs_per_eval_ep=float(np.mean(eval_d)),
-                avg_rew_per_eval_ep=float(np.mean(eval_r)),
-                std_rew_per_eval_ep=float(np.std(eval_r)),
-                eval_eps=eval_eps
-            )
-            rew.append(eval_stats['avg_rew_per_eval_ep'])
-            step.append(total_steps)
-            print("reward:", rew, "  step:", step)
-            np.savetxt(directory+"/reward.txt", rew)
-            np.savetxt(directory+"/step.txt", step)
-            self.dict_tensorboard_write(input_dict=eval_stats, index=total_steps)
-            # with open(os.path.join(out_dir, 'eval_scores.json'), 'a+') as out_fh:
-            #     json.dump(eval_stats, out_fh)
-            #     out_fh.write('\n')
+            info = dict(elapsed_time=time.time() - start_time, training_steps=total_steps, training_eps=e)
+            self._evaluate(metrics, info, eval_eps, max_env_time_steps, evaluator)
+        if evaluator is not None:
+            for info, eval_results in evaluator.close():
+                self._write_eval(metrics, info, eval_results)
+        metrics.close()
+        export_txt(directory)
+        if self.profiler.enabled:
+            print(self.profiler.summary())
+
+    def _evaluate(self, metrics, info, eval_eps, max_env_time_steps, evaluator=None):
+        """
+        Evaluate the agent, either directly or by submitting the current weights to the (asynchronous) evaluator
+        """
+        for done in evaluate(self, info, eval_eps, max_env_time_steps, evaluator):
+            self._write_eval(metrics, *done)
 
+    def _write_eval(self, metrics, info, eval_results):
+        """
+        Report the results of one evaluation to tensorboard and to the metrics log of the run
+        (reward.txt and step.txt are exported from it at the end of training)
+        :param metrics: utils.metrics_log.MetricsLog of the run
+        :param info: dict with the elapsed_time, training_steps and training_eps at which the evaluation was started
+        :param eval_results: result of eval
+        """
+        eval_stats = report_eval(info, eval_results, metrics)
+        self.dict_tensorboard_write(input_dict=eval_stats, index=eval_stats['training_steps'])
+        # with open(os.path.join(out_dir, 'eval_scores.json'), 'a+') as out_fh:
+        #     json.dump(eval_stats, out_fh)
+        #     out_fh.write('\n')
 
     def save_model(self, path):
         # self.save_always = {self._q, self._skip_q}
@@ -1181,6 +1430,8 @@ class TDQN:
     def dict_tensorboard_write(self, input_dict, index):
         for each in input_dict:
             writer.add_scalar(each, input_dict[each], index)
+
+
 if __name__ == "__main__":
     import argparse
 
@@ -1245,9 +1496,46 @@ if __name__ == "__main__":
     parser.add_argument('--dar-A', default=None, type=int)
     parser.add_argument('--dar-B', default=None, type=int)
     parser.add_argument('--env', choices=['mountain', 'moon', 'pong'], default='mountain')
+    parser.add_argument('--num-envs', default=1, type=int,
+                        help='Number of environment copies to train on in lockstep (vectorized rollout). '
+                             'Only supported for dqn, dar, tdqn and t-dqn. As in the single environment training one '
+                             'update is performed per environment step (see --train-freq and --gradient-steps).')
+    parser.add_argument('--train-freq', default=None, type=int,
+                        help='Number of environment steps between updates with --num-envs > 1 (default 1).')
+    parser.add_argument('--gradient-steps', default=None, type=int,
+                        help='Number of gradient steps per update with --num-envs > 1 (default 1).')
+    parser.add_argument('--vec-env', choices=['sync', 'subproc'], default='sync',
+                        help='Step the environment copies in this process or in worker processes.')
+    parser.add_argument('--env-workers', default=None, type=int,
+                        help='Number of worker processes for --vec-env subproc. Defaults to one per environment.')
+    parser.add_argument('--fused-update', action='store_true',
+                        help='Evaluate the next states of the skip and behaviour batch with one forward pass of the '
+                             'target network (tdqn, t-dqn) and of the behaviour Q (t-dqn only: with the shared '
+                             'network of tdqn the skip-Q update changes the greedy next actions). The losses equal '
+                             'those of the unfused update up to the floating point rounding of the batched passes.')
+    parser.add_argument('--prioritized-skip-replay', action='store_true',
+                        help='Replay skip transitions proportionally to their TD-errors (tdqn, t-dqn).')
+    parser.add_argument('--stratify-skip-lengths', action='store_true',
+                        help='Sample equally many skip transitions of every skip length '
+                             '(with --prioritized-skip-replay).')
+    parser.add_argument('--multi-step-skips', action='store_true',
+                        help='Store every observed skip with its length and discounted return, as the Atari agents do '
+                             '(tqn, tdqn, t-dqn). By default all skips are stored with length 1 as in the original '
+                             'featurized experiments.')
+    parser.add_argument('--async-eval', default=0, type=int, metavar='N',
+                        help='Run the evaluations in N background processes instead of pausing training '
+                             '(tdqn and t-dqn, or any agent with --num-envs > 1). Requires the networks on the CPU.')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time the phases of training (dar, tdqn and t-dqn). The statistics are written to '
+                             'tensorboard at every evaluation and printed as a table at the end of training.')
+    parser.add_argument('--profile-sampling', default=None, type=float, metavar='SECONDS',
+                        help='Sample the call stacks of training at this interval. The samples (and the phase table) '
+                             'are dumped to <out-dir>/profile_<n>.* at the end of training and on SIGUSR1.')
 
     # setup output dir
     args = parser.parse_args()
+    if args.async_eval > 0 and args.num_envs == 1 and args.agent not in ('tdqn', 't-dqn'):
+        parser.error('--async-eval is only supported for tdqn and t-dqn (or with --num-envs > 1)')
     outdir_suffix_dict['seed'] = outdir_suffix_dict['seed'].format(args.seed)
     epis = args.episodes if args.episodes else -1
     outdir_suffix_dict['params'] = outdir_suffix_dict['params'].format(
@@ -1262,8 +1550,9 @@ if __name__ == "__main__":
         from utils.env_wrappers import make_env  # TODO figure out if this wrapping is correct
 
         # Setup Envs
-        env = make_env("PongNoFrameskip-v4")
-        eval_env = make_env("PongNoFrameskip-v4")
+        env_fn = lambda: make_env("PongNoFrameskip-v4")
+        env = env_fn()
+        eval_env = env_fn()
 
         # Setup Agent
         state_dim = env.observation_space.shape[0]
@@ -1272,10 +1561,13 @@ if __name__ == "__main__":
             agent = DQN(state_dim, action_dim, gamma=0.99, env=env, eval_env=eval_env, vision=True)
         elif args.agent == 'tqn':
             agent = TQN(state_dim, action_dim, args.skip_net_max_skips, gamma=0.99, env=env, eval_env=eval_env,
-                        vision=True)
+                        vision=True, multi_step_skips=args.multi_step_skips)
         elif args.agent == 'tdqn':
             agent = TDQN(state_dim, action_dim, args.skip_net_max_skips, gamma=0.99, env=env, eval_env=eval_env,
-                         vision=True)
+                         vision=True, fused_update=args.fused_update,
+                         prioritized_skip_replay=args.prioritized_skip_replay,
+                         stratify_skip_lengths=args.stratify_skip_lengths,
+                         multi_step_skips=args.multi_step_skips)
         elif args.agent == 'dar':
             if args.dar_A is not None and args.dar_B is not None:
                 skip_map = {0: args.dar_A, 1: args.dar_B}
@@ -1290,11 +1582,11 @@ if __name__ == "__main__":
         if args.env == 'mountain':
             if args.sparse:
                 from gym.envs.classic_control import MountainCarEnv
-            env = MountainCarEnv()
-            eval_env = MountainCarEnv()
+            env_fn = MountainCarEnv
         elif args.env == 'moon':
-            env = gym.make('LunarLander-v2')
-            eval_env = gym.make('LunarLander-v2')
+            env_fn = lambda: gym.make('LunarLander-v2')
+        env = env_fn()
+        eval_env = env_fn()
 
         # Setup agent
         state_dim = env.observation_space.shape[0]
@@ -1302,12 +1594,20 @@ if __name__ == "__main__":
         if args.agent == 'dqn':
             agent = DQN(state_dim, action_dim, gamma=0.99, env=env, eval_env=eval_env)
         elif args.agent == 'tqn':
-            agent = TQN(state_dim, action_dim, args.skip_net_max_skips, gamma=0.99, env=env, eval_env=eval_env)
+            agent = TQN(state_dim, action_dim, args.skip_net_max_skips, gamma=0.99, env=env, eval_env=eval_env,
+                        multi_step_skips=args.multi_step_skips)
         elif args.agent == 'tdqn':
-            agent = TDQN(state_dim, action_dim, args.skip_net_max_skips, gamma=0.99, env=env, eval_env=eval_env)
+            agent = TDQN(state_dim, action_dim, args.skip_net_max_skips, gamma=0.99, env=env, eval_env=eval_env,
+                         fused_update=args.fused_update,
+                         prioritized_skip_replay=args.prioritized_skip_replay,
+                         stratify_skip_lengths=args.stratify_skip_lengths,
+                         multi_step_skips=args.multi_step_skips)
         elif args.agent == 't-dqn':
             agent = TDQN(state_dim, action_dim, args.skip_net_max_skips, gamma=0.99, env=env,
-                         eval_env=eval_env, shared=False)
+                         eval_env=eval_env, shared=False, fused_update=args.fused_update,
+                         prioritized_skip_replay=args.prioritized_skip_replay,
+                         stratify_skip_lengths=args.stratify_skip_lengths,
+                         multi_step_skips=args.multi_step_skips)
         elif args.agent == 'dar':
             if args.dar_A is not None and args.dar_B is not None:
                 skip_map = {0: args.dar_A, 1: args.dar_B}
@@ -1320,12 +1620,49 @@ if __name__ == "__main__":
         else:
             raise NotImplementedError
 
+    for setting in ['train_freq', 'gradient_steps']:
+        if getattr(args, setting) is not None:
+            setattr(agent, setting, getattr(args, setting))
+
     episodes = args.episodes
     max_env_time_steps = args.env_ms
     epsilon = 0.1
 
-    agent.train(out_dir, episodes, max_env_time_steps,
-                epsilon, args.eval_n_episodes, args.eval_after_n_steps,
-                max_train_time_steps=args.training_steps, )
+    if args.profile or args.profile_sampling is not None:
+        if not hasattr(agent, 'profiler'):
+            raise NotImplementedError('Profiling is not supported for {}'.format(args.agent))
+        agent.profiler = PhaseProfiler(enabled=args.profile, writer=writer, sampling_interval=args.profile_sampling,
+                                       dump_path=os.path.join(out_dir, 'profile'))
+
+    evaluator = None
+    if args.async_eval > 0:
+        from utils.async_eval import AsyncEvaluator
+
+        evaluator = AsyncEvaluator(agent, num_workers=args.async_eval)  # before any data is collected
+    if args.num_envs > 1:
+        if not hasattr(agent, 'decide'):
+            raise NotImplementedError('The vectorized rollout is not supported for {}'.format(args.agent))
+        from utils.vec_env import SyncVectorEnv, SubprocVectorEnv
+
+        if args.vec_env == 'subproc':
+            vec_env = SubprocVectorEnv([env_fn] * args.num_envs, num_workers=args.env_workers)
+        else:
+            vec_env = SyncVectorEnv([env_fn] * args.num_envs)
+        trainer = VectorizedRollout(agent, vec_env, gamma=0.99, max_skip=args.skip_net_max_skips, writer=writer,
+                                    evaluator=evaluator)
+        trainer.train(out_dir, episodes, max_env_time_steps,
+                      epsilon, args.eval_n_episodes, args.eval_after_n_steps,
+                      max_train_time_steps=args.training_steps, )
+        vec_env.close()
+    elif evaluator is not None:
+        agent.train(out_dir, episodes, max_env_time_steps,
+                    epsilon, args.eval_n_episodes, args.eval_after_n_steps,
+                    max_train_time_steps=args.training_steps, evaluator=evaluator)
+    else:
+        agent.train(out_dir, episodes, max_env_time_steps,
+                    epsilon, args.eval_n_episodes, args.eval_after_n_steps,
+                    max_train_time_steps=args.training_steps, )
+    if hasattr(agent, 'profiler'):
+        agent.profiler.close()
     os.mkdir(os.path.join(out_dir, 'final'))
     agent.save_model(os.path.join(out_dir, 'final'))
@@ -1,32 +1,79 @@
 import os
 import pickle
-from collections import defaultdict
 
 import numpy as np
 from utils import experiments
 
-from grid_envs import GridCore
+from grid_envs import BatchedFallEnv, BatchedRandom, GridCore
 
 
-def make_epsilon_greedy_policy(Q: defaultdict, epsilon: float, nA: int) -> callable:
+def greedy_action(q_values: np.ndarray) -> int:
     """
-    Creates an epsilon-greedy policy based on a given Q-function and epsilon.
-    I.e. create weight vector from which actions get sampled.
+    Greedy action for one row of a Q-table. Ties are broken uniformly at random.
 
-    :param Q: tabular state-action lookup function
+    :param q_values: values of all actions in one state
+    """
+    # For the few actions of one state plain Python is considerably faster than NumPy reductions
+    values = q_values.tolist()
+    best_value = max(values)
+    if values.count(best_value) == 1:  # no tie, no need for a random number
+        return values.index(best_value)
+    best = [a for a, value in enumerate(values) if value == best_value]
+    return best[np.random.randint(len(best))]
+
+
+def greedy_actions(q_values: np.ndarray, tie_breaks: np.ndarray = None) -> np.ndarray:
+    """
+    Vectorized greedy_action over all leading dimensions of q_values (e.g. a batch of states or a full Q-table).
+    Ties are broken uniformly at random.
+
+    :param q_values: array of shape (..., nA)
+    :param tie_breaks: optional uniform random numbers of the same shape to break the ties with
+    :return: integer array of shape q_values.shape[:-1]
+    """
+    if tie_breaks is None:
+        tie_breaks = np.random.random(q_values.shape)
+    is_max = q_values == q_values.max(axis=-1, keepdims=True)
+    return np.argmax(np.where(is_max, tie_breaks, -1.), axis=-1)
+
+
+def epsilon_greedy_action(q_values: np.ndarray, epsilon: float) -> int:
+    """
+    Sample an action epsilon-greedily from one row of a Q-table.
+    I.e. with probability epsilon a uniformly random action, otherwise the greedy action.
+
+    :param q_values: values of all actions in one state
     :param epsilon: exploration factor
-    :param nA: size of action space to consider for this policy
     """
+    if np.random.random() < epsilon:
+        return np.random.randint(len(q_values))
+    return greedy_action(q_values)
 
-    def policy_fn(observation):
-        policy = np.ones(nA) * epsilon / nA
-        best_action = np.random.choice(np.flatnonzero(  # random choice for tie-breaking only
-            Q[observation] == Q[observation].max()
-        )) # 在最大Q对应的action index中随机取一个
-        policy[best_action] += (1 - epsilon)
-        return policy
 
-    return policy_fn
+def epsilon_greedy_actions(q_values: np.ndarray, epsilon, random) -> np.ndarray:
+    """
+    Batched epsilon_greedy_action, e.g. for the episodes of a BatchedFallEnv.
+    Draws the same amount of random numbers for every element of the batch (see BatchedRandom).
+
+    :param q_values: array of shape (B, nA) with the values of all actions in the current state of every element
+    :param epsilon: exploration factor (one for all elements or one per element)
+    :param random: BatchedRandom with B streams
+    :return: integer array of shape (B,)
+    """
+    num_actions = q_values.shape[-1]
+    u = random.random(2 + num_actions)
+    actions = greedy_actions(q_values, u[:, 2:])
+    explore = u[:, 0] < epsilon
+    actions[explore] = (u[explore, 1] * num_actions).astype(np.int64)
+    return actions
+
+
+def q_table_to_dict(q: np.ndarray) -> dict:
+    """
+    Convert a dense Q-table to the dictionary format of Q.pkl and J.pkl, i.e. state -> action-values for an
+    [nS, nA] table and (state, action) -> skip-values for an [nS, nA, max_skip] table.
+    """
+    return {idx: q[idx] for idx in (range(len(q)) if q.ndim == 2 else np.ndindex(q.shape[:-1]))}
 
 
 def get_decay_schedule(start_val: float, decay_start: int, num_steps: int, type_: str):
@@ -60,13 +107,92 @@ def get_decay_schedule(start_val: float, decay_start: int, num_steps: int, type_
         raise NotImplementedError
 
 
-def td_update(q: defaultdict, state: int, action: int, reward: float, next_state: int, gamma: float, alpha: float):
+def td_update(q: np.ndarray, state: int, action: int, reward: float, next_state: int, gamma: float, alpha: float):
     """ Simple TD update rule """
     # TD update
-    best_next_action = np.random.choice(np.flatnonzero(q[next_state] == q[next_state].max()))  # greedy best next
-    td_target = reward + gamma * q[next_state][best_next_action]
-    td_delta = td_target - q[state][action]
-    return q[state][action] + alpha * td_delta
+    td_target = reward + gamma * max(q[next_state].tolist())  # value of the greedy best next action
+    td_delta = td_target - q[state, action]
+    return q[state, action] + alpha * td_delta
+
+
+def greedy_policy(q: np.ndarray) -> np.ndarray:
+    """
+    Action probabilities of greedy_action for every row of a Q-table, i.e. uniform over the tied best actions
+
+    :param q: array of shape (..., nA)
+    :return: array of the same shape
+    """
+    is_max = q == q.max(axis=-1, keepdims=True)
+    return is_max / is_max.sum(axis=-1, keepdims=True)
+
+
+def greedy_skips(temporal_q: np.ndarray) -> np.ndarray:
+    """
+    Greedy skip of the evaluation of temporl_q_learning for every state and action. If there are ties the larger skip
+    is used.
+
+    :param temporal_q: array of shape (..., max_skip)
+    :return: integer array of shape temporal_q.shape[:-1]
+    """
+    return temporal_q.shape[-1] - 1 - np.argmax(temporal_q[..., ::-1], axis=-1)
+
+
+def exact_policy_evaluation(environment: GridCore, policy: np.ndarray, skips: np.ndarray = None):
+    """
+    Expected return, number of decisions and number of steps of an episode of a stationary (action, skip) policy,
+    computed on the compiled transition model of the environment instead of estimated from rollouts.
+
+    As episodes end after environment.max_steps steps, the values depend on the remaining steps. They are the solution
+    of the linear system V = r + P_pi V over the states augmented with the remaining steps. This system is triangular in
+    the remaining steps, so it is solved by back substitution: with t remaining steps
+        V_t = b_t + sum_k E_k V_{t-k}
+    where E_k[s, s'] is the probability that a decision in s ends after k steps in the non-terminal state s' and b_t
+    the expected reward, decisions and steps of a decision (within t steps). E_k and b_t are precomputed from the
+    k-step transition matrices of every action, such that every step of the substitution is one matrix product.
+    Rewards are summed undiscounted as in the evaluation rollouts.
+
+    :param environment: environment with a compiled transition model (e.g. a FallEnv)
+    :param policy: [nS, nA] action probabilities in every state (see greedy_policy)
+    :param skips: optional [nS, nA] skip of every state and action, i.e. the action is repeated skip + 1 times.
+                  Without skips every action is taken once.
+    :return: expected return, number of decisions and number of steps per episode
+    """
+    model = environment.model
+    nS, nA, _ = model.prob.shape
+    # Probabilities of all non-terminal transitions per action [nA, nS, nS] and the expected reward, decisions and
+    # steps of a single step [nA, nS, 3]
+    transitions = np.zeros((nA, nS, nS))
+    s, a, _ = np.indices(model.prob.shape)
+    np.add.at(transitions, (a, s, model.next_state), model.prob * ~model.done)
+    step_values = np.stack([(model.prob * model.reward).sum(axis=-1).T, np.zeros((nA, nS)), np.ones((nA, nS))], axis=-1)
+    repeats = (np.ones((nS, nA), dtype=np.int64) if skips is None else np.asarray(skips) + 1).T  # [nA, nS]
+    max_repeats = int(repeats.max())
+    policy = np.asarray(policy, dtype=np.float64).T  # [nA, nS]
+
+    # partial_values[m, a, s]: expected values of the first m repetitions of a in s
+    # ends[k - 1]: E_k, i.e. the transitions of all decisions that repeat their action k times
+    partial_values = np.zeros((max_repeats + 1, nA, nS, 3))
+    ends = np.zeros((max_repeats, nS, nS))
+    reach = np.broadcast_to(np.eye(nS), (nA, nS, nS))  # m-step transition matrices of every action
+    for m in range(1, max_repeats + 1):
+        partial_values[m] = partial_values[m - 1] + np.matmul(reach, step_values)
+        reach = np.matmul(reach, transitions)
+        ends[m - 1] = ((policy * (repeats == m))[:, :, None] * reach).sum(axis=0)
+    # decision_values[m]: b_t for t = m < max_repeats remaining steps (the decision is cut off) and t >= max_repeats
+    decision_values = np.zeros((max_repeats + 1, nS, 3))
+    for m in range(1, max_repeats + 1):
+        cut_off = partial_values[np.minimum(m, repeats), np.arange(nA)[:, None], np.arange(nS)[None]]
+        decision_values[m] = (policy[..., None] * cut_off).sum(axis=0)
+        decision_values[m, :, 1] += 1
+
+    # values[max_repeats - 1 + t] = V_t, padded with V_t = 0 for t <= 0
+    ends = ends[::-1].transpose(1, 0, 2).reshape(nS, max_repeats * nS)  # E_max_repeats, ..., E_1
+    values = np.zeros((max_repeats + environment.max_steps, nS, 3))
+    for t in range(1, environment.max_steps + 1):
+        history = values[t - 1:t - 1 + max_repeats].reshape(max_repeats * nS, 3)  # V_{t - max_repeats}, ..., V_{t-1}
+        values[max_repeats - 1 + t] = decision_values[min(t, max_repeats)] + ends @ history
+    expected_return, expected_decisions, expected_steps = (environment.isd @ values[-1]).tolist()
+    return expected_return, expected_decisions, expected_steps
 
 
 def q_learning(
@@ -78,7 +204,8 @@ def q_learning(
         epsilon_decay: str = 'const',
         decay_starts: int = 0,
         eval_every: int = 10,
-        render_eval: bool = True):
+        render_eval: bool = True,
+        eval_mode: str = 'rollout'):
     """
     Vanilla tabular Q-learning algorithm
     :param environment: which environment to use
@@ -90,14 +217,17 @@ def q_learning(
     :param decay_starts: After how many episodes epsilon decay starts
     :param eval_every: Number of episodes between evaluations
     :param render_eval: Flag to activate/deactivate rendering of evaluation runs
-    :return: training and evaluation statistics (i.e. rewards and episode lengths)
+    :param eval_mode: 'rollout' to play one episode with the greedy policy per evaluation or 'exact' to compute the
+                      expected return and length of the greedy policy on the transition model
+                      (see exact_policy_evaluation)
+    :return: training and evaluation statistics (i.e. rewards and episode lengths) and the [nS, nA] Q-table
     """
     assert 0 <= discount_factor <= 1, 'Lambda should be in [0, 1]'
+    assert eval_mode in ('rollout', 'exact'), 'Unknown evaluation mode'
     assert 0 <= epsilon <= 1, 'epsilon has to be in [0, 1]'
     assert alpha > 0, 'Learning rate has to be positive'
-    # The action-value function.
-    # Nested dict that maps state -> (action -> action-value).
-    Q = defaultdict(lambda: np.zeros(environment.action_space.n))
+    # The action-value function as dense table of shape [nS, nA]
+    Q = np.zeros((environment.nS, environment.action_space.n))
 
     # Keeps track of episode lengths and rewards
     rewards = []
@@ -111,17 +241,15 @@ def q_learning(
     for i_episode in range(num_episodes + 1):
         # print('#' * 100)
         epsilon = epsilon_schedule[min(i_episode, num_episodes - 1)]
-        # The policy we're following
-        policy = make_epsilon_greedy_policy(Q, epsilon, environment.action_space.n)
         policy_state = environment.reset()
         episode_length, cummulative_reward = 0, 0
         while True:  # roll out episode
-            policy_action = np.random.choice(list(range(environment.action_space.n)), p=policy(policy_state))
+            policy_action = epsilon_greedy_action(Q[policy_state], epsilon)
             s_, policy_reward, policy_done, _ = environment.step(policy_action)
             cummulative_reward += policy_reward
             episode_length += 1
 
-            Q[policy_state][policy_action] = td_update(Q, policy_state, policy_action,
+            Q[policy_state, policy_action] = td_update(Q, policy_state, policy_action,
                                                        policy_reward, s_, discount_factor, alpha)
 
             if policy_done:
@@ -133,13 +261,19 @@ def q_learning(
 
         # evaluation with greedy policy
         test_steps = 0
-        if i_episode % eval_every == 0:
+        if i_episode % eval_every == 0 and eval_mode == 'exact':
+            expected_reward, _, expected_steps = exact_policy_evaluation(environment, greedy_policy(Q))
+            test_rewards.append(expected_reward)
+            test_lens.append(expected_steps)
+            test_steps_list.append(expected_steps)
+            print('Done %4d/%4d episodes' % (i_episode, num_episodes))
+        elif i_episode % eval_every == 0:
             policy_state = environment.reset()
             episode_length, cummulative_reward = 0, 0
             if render_eval:
                 environment.render()
             while True:  # roll out episode
-                policy_action = np.random.choice(np.flatnonzero(Q[policy_state] == Q[policy_state].max()))
+                policy_action = greedy_action(Q[policy_state])
                 environment.total_steps -= 1  # don't count evaluation steps
                 s_, policy_reward, policy_done, _ = environment.step(policy_action)
                 test_steps += 1
@@ -160,26 +294,40 @@ def q_learning(
 
 class SkipTransition:
     """
-    Simple helper class to keep track of all transitions observed when skipping through an MDP
+    Simple helper class to keep track of all transitions observed when skipping through an MDP.
+    For every start offset i within the current action repetition it keeps the start state and the value stored for
+    the skip from i to the latest step. Adding a step updates all offsets with a few vectorized operations.
+
+    The stored value is not the discounted return of the skip. To stay bit-identical with the original implementation
+    the entry of length l+1 is gamma^l * r_{i+l} plus the sum of all earlier entries of the row, e.g. r_i,
+    r_i + gamma * r_{i+1} and 2 * r_i + gamma * r_{i+1} + gamma^2 * r_{i+2} for the first three lengths.
+    The row sums are recomputed on every step, so a step still costs O(idx * skips), i.e. quadratic in the number
+    of skips.
     """
 
     def __init__(self, skips, df):
-        self.state_mat = np.full((skips, skips), -1, dtype=int)  # might need to change type for other envs
-        self.reward_mat = np.full((skips, skips), np.nan, dtype=float)
+        self.states = np.full(skips, -1, dtype=int)  # start state per offset; might need to change type for other envs
+        self.returns = np.zeros(skips)  # value of the skip from each offset to the latest step (see above)
+        self.reward_mat = np.zeros((skips, skips), dtype=float)  # values of all skips per offset (row) and length
+        self._offsets = np.arange(skips)
+        self._discounts = np.array([df ** i for i in range(skips)])
         self.idx = 0
         self.df = df
 
-    def add(self, reward, next_state):
+    def add(self, reward, state):
         """
-        Add reward and next_state to triangular matrix
+        Add the reward of the next step and the state from which it was taken (i.e. the start of a new skip)
         :param reward: received reward
-        :param next_state: state reached
+        :param state: state in which the step was taken
         """
+        self.states[self.idx] = state
         self.idx += 1
-        for i in range(self.idx):
-            self.state_mat[self.idx - i - 1, i] = next_state
-            # Automatically discount rewards when adding to corresponding skip
-            self.reward_mat[self.idx - i - 1, i] = reward * self.df ** i + np.nansum(self.reward_mat[self.idx - i - 1])
+        offsets = self._offsets[:self.idx]
+        lengths = self.idx - 1 - offsets  # length - 1 of the skip from every offset to the new step
+        # Automatically discount rewards when adding to corresponding skip. As before every new entry adds the sum of its
+        # row, which is computed with one reduction over all rows (summing the same way as np.nansum of the full row).
+        self.returns[:self.idx] = reward * self._discounts[lengths] + self.reward_mat[:self.idx].sum(axis=1)
+        self.reward_mat[offsets, lengths] = self.returns[:self.idx]
 
 
 def temporl_q_learning(
@@ -193,7 +341,8 @@ def temporl_q_learning(
         decay_stops: int = None,
         eval_every: int = 10,
         render_eval: bool = True,
-        max_skip: int = 7):
+        max_skip: int = 7,
+        eval_mode: str = 'rollout'):
     """
     Implementation of tabular TempoRL
     :param environment: which environment to use
@@ -207,11 +356,18 @@ def temporl_q_learning(
     :param eval_every: Number of episodes between evaluations
     :param render_eval: Flag to activate/deactivate rendering of evaluation runs
     :param max_skip: Maximum skip size to use.
-    :return: training and evaluation statistics (i.e. rewards and episode lengths)
+    :param eval_mode: 'rollout' to play one episode with the greedy policy per evaluation or 'exact' to compute the
+                      expected return, decisions and steps of the greedy policy on the transition model
+                      (see exact_policy_evaluation)
+    :return: training and evaluation statistics (i.e. rewards and episode lengths) and the [nS, nA] action-Q and
+             [nS, nA, max_skip] temporal-Q tables
     """
+    assert eval_mode in ('rollout', 'exact'), 'Unknown evaluation mode'
     temporal_actions = max_skip
-    action_Q = defaultdict(lambda: np.zeros(environment.action_space.n))
-    temporal_Q = defaultdict(lambda: np.zeros(temporal_actions))
+    # Dense tables of shape [nS, nA] (behaviour) and [nS, nA, max_skip] (skip-values conditioned on the action)
+    action_Q = np.zeros((environment.nS, environment.action_space.n))
+    temporal_Q = np.zeros((environment.nS, environment.action_space.n, temporal_actions))
+    skip_ids_desc = np.arange(max_skip)[::-1]
     if not decay_stops:
         decay_stops = num_episodes
 
@@ -228,17 +384,14 @@ def temporl_q_learning(
         # setup exploration policy for this episode
         epsilon_action = epsilon_schedule_action[min(i_episode, num_episodes - 1)]
         epsilon_temporal = epsilon_schedule_temporal[min(i_episode, num_episodes - 1)]
-        action_policy = make_epsilon_greedy_policy(action_Q, epsilon_action, environment.action_space.n)
-        temporal_policy = make_epsilon_greedy_policy(temporal_Q, epsilon_temporal, temporal_actions)
 
         episode_r = 0
         state = environment.reset()  # type: list
         action_pol_len = 0
         while True:  # roll out episode
-            action = np.random.choice(list(range(environment.action_space.n)), p=action_policy(state))
-            temporal_state = (state, action)
+            action = epsilon_greedy_action(action_Q[state], epsilon_action)
             action_pol_len += 1
-            temporal_action = np.random.choice(list(range(temporal_actions)), p=temporal_policy(temporal_state))
+            temporal_action = epsilon_greedy_action(temporal_Q[state, action], epsilon_temporal)
 
             s_ = None
             done = False
@@ -253,24 +406,18 @@ def temporl_q_learning(
                 skip_transition.add(reward, tmp_state)
 
                 # 1-step update of action Q (like in vanilla Q)
-                action_Q[tmp_state][action] = td_update(action_Q, tmp_state, action,
+                action_Q[tmp_state, action] = td_update(action_Q, tmp_state, action,
                                                         reward, s_, discount_factor, alpha)
 
-                count = 0
-                # For all so far observed transitions compute all forward skip updates
-                for skip_num in range(skip_transition.idx):
-                    skip = skip_transition.state_mat[skip_num]
-                    rew = skip_transition.reward_mat[skip_num]
-                    skip_start_state = (skip[0], action)
-
-                    # Temporal TD update
-                    best_next_action = np.random.choice(
-                        np.flatnonzero(action_Q[s_] == action_Q[s_].max()))  # greedy best next
-                    td_target = rew[skip_transition.idx - 1 - count] + (
-                            discount_factor ** (skip_transition.idx - 1)) * action_Q[s_][best_next_action]
-                    td_delta = td_target - temporal_Q[skip_start_state][skip_transition.idx - count - 1]
-                    temporal_Q[skip_start_state][skip_transition.idx - count - 1] += alpha * td_delta
-                    count += 1
+                # For all so far observed transitions compute all forward skip updates at once (temporal TD updates).
+                # The skip from offset i has length idx - i and all skips end in s_.
+                best_next_value = max(action_Q[s_].tolist())  # value of the greedy best next action
+                idx = skip_transition.idx
+                skip_starts = skip_transition.states[:idx]
+                skip_ids = skip_ids_desc[max_skip - idx:]  # idx - 1, ..., 0
+                td_target = skip_transition.returns[:idx] + (discount_factor ** (idx - 1)) * best_next_value
+                td_delta = td_target - temporal_Q[skip_starts, action, skip_ids]
+                temporal_Q[skip_starts, action, skip_ids] += alpha * td_delta
 
                 tmp_state = s_
             state = s_
@@ -283,14 +430,21 @@ def temporl_q_learning(
         # ---------------------------------------------- EVALUATION -------------------------------------------------
         # ---------------------------------------------- EVALUATION -------------------------------------------------
         test_steps = 0
-        if i_episode % eval_every == 0:
+        if i_episode % eval_every == 0 and eval_mode == 'exact':
+            expected_reward, expected_decisions, expected_steps = exact_policy_evaluation(
+                environment, greedy_policy(action_Q), greedy_skips(temporal_Q))
+            test_rewards.append(expected_reward)
+            test_lens.append(expected_decisions)
+            test_steps_list.append(expected_steps)
+            print('Done %4d/%4d episodes' % (i_episode, num_episodes))
+        elif i_episode % eval_every == 0:
             episode_r = 0
             state = environment.reset()  # type: list
             if render_eval:
                 environment.render(in_control=True)
             action_pol_len = 0
             while True:  # roll out episode
-                action = np.random.choice(np.flatnonzero(action_Q[state] == action_Q[state].max()))
+                action = greedy_action(action_Q[state])
                 temporal_state = (state, action)
                 action_pol_len += 1
 
@@ -323,6 +477,291 @@ def temporl_q_learning(
     return (rewards, lens), (test_rewards, test_lens), (train_steps_list, test_steps_list), (action_Q, temporal_Q)
 
 
+class SeedEpisodes:
+    """
+    Episode bookkeeping of the batched (many-seed) trainers.
+    Every seed alternates training and evaluation episodes in the same order as q_learning/temporl_q_learning (training
+    episodes 0, ..., num_episodes, each followed by an evaluation episode every eval_every episodes) and collects the
+    same statistics.
+    """
+
+    def __init__(self, num_seeds: int, num_episodes: int, eval_every: int, evaluate=None):
+        """
+        :param num_seeds: number of seeds
+        :param num_episodes: number of training episodes
+        :param eval_every: number of episodes between evaluations
+        :param evaluate: optional function mapping a seed to its evaluation (return, length, steps), used instead of
+                         evaluation episodes (e.g. exact_policy_evaluation)
+        """
+        self.num_episodes = num_episodes
+        self.eval_every = eval_every
+        self._evaluate = evaluate
+        self.episode = np.zeros(num_seeds, dtype=np.int64)  # current training episode per seed
+        self.evaluating = np.zeros(num_seeds, dtype=bool)  # whether the current episode is an evaluation episode
+        self.active = np.ones(num_seeds, dtype=bool)  # whether the seed still has episodes to play
+        self.train_steps = np.zeros(num_seeds, dtype=np.int64)  # environment steps of the training episodes
+        self._train = [([], [], []) for _ in range(num_seeds)]  # rewards, lengths and train steps per seed
+        self._test = [([], [], []) for _ in range(num_seeds)]  # rewards, lengths and test steps per seed
+
+    def end_episodes(self, seeds, rewards, lengths, steps):
+        """
+        Record the statistics of the episodes that ended and move to the next episode of these seeds
+        :param seeds: seeds whose episodes ended
+        :param rewards: return per ended episode
+        :param lengths: length (steps or decisions) per ended episode
+        :param steps: number of environment steps per ended episode
+        """
+        for i, reward, length, num_steps in zip(seeds.tolist(), rewards.tolist(), lengths.tolist(), steps.tolist()):
+            if not self.active[i]:
+                continue
+            if self.evaluating[i]:
+                for stat, value in zip(self._test[i], (reward, length, num_steps)):
+                    stat.append(value)
+                self.evaluating[i] = False
+                self.episode[i] += 1
+            else:
+                self.train_steps[i] += num_steps
+                for stat, value in zip(self._train[i], (reward, length, self.train_steps[i])):
+                    stat.append(value)
+                if self.episode[i] % self.eval_every == 0 and self._evaluate is None:
+                    self.evaluating[i] = True
+                else:
+                    if self.episode[i] % self.eval_every == 0:
+                        for stat, value in zip(self._test[i], self._evaluate(i)):
+                            stat.append(value)
+                    self.episode[i] += 1
+            self.active[i] = self.episode[i] <= self.num_episodes
+
+    def results(self):
+        """
+        :return: one ((rewards, lens), (test_rewards, test_lens), (train_steps_list, test_steps_list)) per seed,
+                 i.e. the statistics returned by q_learning and temporl_q_learning
+        """
+        return [((train[0], train[1]), (test[0], test[1]), (train[2], test[2]))
+                for train, test in zip(self._train, self._test)]
+
+
+def batched_q_learning(
+        environment: GridCore,
+        num_episodes: int,
+        seeds,
+        discount_factor: float = 1.0,
+        alpha: float = 0.5,
+        epsilon: float = 0.1,
+        epsilon_decay: str = 'const',
+        decay_starts: int = 0,
+        eval_every: int = 10,
+        eval_mode: str = 'rollout'):
+    """
+    q_learning for many seeds at once. The Q-tables of all seeds are stacked to one [S, nS, nA] array and all seeds
+    are stepped together on a BatchedFallEnv. Every seed has its own random stream (environment and exploration), such
+    that the results of a seed do not depend on the other seeds. The results are statistically equivalent to separate
+    q_learning runs but not bitwise identical, as the random numbers are drawn differently.
+    :param environment: which environment to use
+    :param num_episodes: number of episodes to train
+    :param seeds: one seed per independent run
+    :param discount_factor: discount factor used in TD updates
+    :param alpha: learning rate used in TD updates
+    :param epsilon: exploration fraction (either constant or starting value for schedule)
+    :param epsilon_decay: determine type of exploration (constant, linear/exponential decay schedule)
+    :param decay_starts: After how many episodes epsilon decay starts
+    :param eval_every: Number of episodes between evaluations
+    :param eval_mode: 'rollout' (one greedy evaluation episode) or 'exact' (see exact_policy_evaluation)
+    :return: list with the statistics of q_learning per seed and the [S, nS, nA] Q-tables
+    """
+    assert 0 <= discount_factor <= 1, 'Lambda should be in [0, 1]'
+    assert 0 <= epsilon <= 1, 'epsilon has to be in [0, 1]'
+    assert alpha > 0, 'Learning rate has to be positive'
+    assert eval_mode in ('rollout', 'exact'), 'Unknown evaluation mode'
+    num_seeds = len(seeds)
+    random = BatchedRandom(seeds)
+    env = BatchedFallEnv(environment, num_seeds, seeds=random)
+    Q = np.zeros((num_seeds, environment.nS, environment.action_space.n))
+    all_seeds = np.arange(num_seeds)
+
+    def evaluate(seed):
+        expected_reward, _, expected_steps = exact_policy_evaluation(environment, greedy_policy(Q[seed]))
+        return expected_reward, expected_steps, expected_steps
+
+    episodes = SeedEpisodes(num_seeds, num_episodes, eval_every, evaluate if eval_mode == 'exact' else None)
+
+    epsilon_schedule = get_decay_schedule(epsilon, decay_starts, num_episodes, epsilon_decay)
+    episode_reward = np.zeros(num_seeds)
+    episode_length = np.zeros(num_seeds, dtype=np.int64)
+    last_report = 0
+    while episodes.active.any():
+        state = env.states
+        eps = np.where(episodes.evaluating, 0., epsilon_schedule[np.minimum(episodes.episode, num_episodes - 1)])
+        action = epsilon_greedy_actions(Q[all_seeds, state], eps, random)
+        s_, reward, done, _ = env.step(action)
+        episode_reward += reward
+        episode_length += 1
+
+        # TD update of the seeds that are training
+        learn = np.flatnonzero(episodes.active & ~episodes.evaluating)
+        s, a, ns = state[learn], action[learn], s_[learn]
+        td_target = reward[learn] + discount_factor * Q[learn, ns].max(axis=1)
+        Q[learn, s, a] += alpha * (td_target - Q[learn, s, a])
+
+        ended = np.flatnonzero(done)
+        if len(ended) > 0:
+            episodes.end_episodes(ended, episode_reward[ended], episode_length[ended], episode_length[ended])
+            episode_reward[ended] = 0
+            episode_length[ended] = 0
+            done_episodes = int(episodes.episode.min())
+            if done_episodes // eval_every > last_report // eval_every:
+                print('Done %4d/%4d episodes (all seeds)' % (min(done_episodes, num_episodes), num_episodes))
+            last_report = done_episodes
+    return episodes.results(), Q
+
+
+def batched_temporl_q_learning(
+        environment: GridCore,
+        num_episodes: int,
+        seeds,
+        discount_factor: float = 1.0,
+        alpha: float = 0.5,
+        epsilon: float = 0.1,
+        epsilon_decay: str = 'const',
+        decay_starts: int = 0,
+        decay_stops: int = None,
+        eval_every: int = 10,
+        max_skip: int = 7,
+        eval_mode: str = 'rollout'):
+    """
+    temporl_q_learning for many seeds at once. The action-Q and temporal-Q tables of all seeds are stacked to
+    [S, nS, nA] and [S, nS, nA, max_skip] arrays and all seeds are stepped together on a BatchedFallEnv, each seed
+    repeating its own action for its own skip. Every seed has its own random stream (environment and exploration), such
+    that the results of a seed do not depend on the other seeds. The results are statistically equivalent to separate
+    temporl_q_learning runs but not bitwise identical, as the random numbers are drawn differently.
+    :param environment: which environment to use
+    :param num_episodes: number of episodes to train
+    :param seeds: one seed per independent run
+    :param discount_factor: discount factor used in TD updates
+    :param alpha: learning rate used in TD updates
+    :param epsilon: exploration fraction (either constant or starting value for schedule)
+    :param epsilon_decay: determine type of exploration (constant, linear/exponential decay schedule)
+    :param decay_starts: After how many episodes epsilon decay starts
+    :param decay_stops: Episode after which to stop epsilon decay
+    :param eval_every: Number of episodes between evaluations
+    :param max_skip: Maximum skip size to use.
+    :param eval_mode: 'rollout' (one greedy evaluation episode) or 'exact' (see exact_policy_evaluation)
+    :return: list with the statistics of temporl_q_learning per seed and the [S, nS, nA] action-Q and
+             [S, nS, nA, max_skip] temporal-Q tables
+    """
+    assert eval_mode in ('rollout', 'exact'), 'Unknown evaluation mode'
+    num_seeds = len(seeds)
+    random = BatchedRandom(seeds)
+    env = BatchedFallEnv(environment, num_seeds, seeds=random)
+    action_Q = np.zeros((num_seeds, environment.nS, environment.action_space.n))
+    temporal_Q = np.zeros((num_seeds, environment.nS, environment.action_space.n, max_skip))
+    all_seeds = np.arange(num_seeds)
+
+    def evaluate(seed):
+        return exact_policy_evaluation(environment, greedy_policy(action_Q[seed]), greedy_skips(temporal_Q[seed]))
+
+    episodes = SeedEpisodes(num_seeds, num_episodes, eval_every, evaluate if eval_mode == 'exact' else None)
+    if not decay_stops:
+        decay_stops = num_episodes
+    epsilon_schedule_action = get_decay_schedule(epsilon, decay_starts, decay_stops, epsilon_decay)
+    epsilon_schedule_temporal = get_decay_schedule(epsilon, decay_starts, decay_stops, epsilon_decay)
+
+    # The SkipTransition of every seed as arrays: start state and return per offset and the returns of all skips per
+    # offset (row) and length
+    skip_states = np.zeros((num_seeds, max_skip), dtype=np.int64)
+    skip_returns = np.zeros((num_seeds, max_skip))
+    reward_mat = np.zeros((num_seeds, max_skip, max_skip))
+    skip_idx = np.zeros(num_seeds, dtype=np.int64)
+    offsets = np.arange(max_skip)
+    discounts = np.array([discount_factor ** i for i in range(max_skip)])
+
+    def skip_updates(learn, tmp_state, action, reward, s_):
+        """ SkipTransition.add and the TD updates of temporl_q_learning for the seeds in learn """
+        idx = skip_idx[learn]
+        skip_states[learn, idx] = tmp_state
+        idx += 1
+        skip_idx[learn] = idx
+        valid = offsets < idx[:, None]
+        lengths = np.where(valid, idx[:, None] - 1 - offsets, 0)
+        returns = np.where(valid, reward[:, None] * discounts[lengths] + reward_mat[learn].sum(axis=2), 0.)
+        skip_returns[learn] = returns
+        rows, cols = np.nonzero(valid)
+        reward_mat[learn[rows], cols, lengths[rows, cols]] = returns[rows, cols]
+
+        # 1-step update of action Q (like in vanilla Q)
+        best_next_value = action_Q[learn, s_].max(axis=1)
+        td_target = reward + discount_factor * best_next_value
+        action_Q[learn, tmp_state, action] += alpha * (td_target - action_Q[learn, tmp_state, action])
+
+        # forward skip updates of all so far observed transitions, all skips end in s_
+        best_next_value = action_Q[learn, s_].max(axis=1)
+        td_target = returns[rows, cols] + (discount_factor ** (idx[rows] - 1)) * best_next_value[rows]
+        q_index = learn[rows], skip_states[learn[rows], cols], action[rows], lengths[rows, cols]
+        temporal_Q[q_index] += alpha * (td_target - temporal_Q[q_index])
+
+    episode_decisions = np.zeros(num_seeds, dtype=np.int64)
+    episode_reward = np.zeros(num_seeds)
+    episode_steps = np.zeros(num_seeds, dtype=np.int64)
+    action = np.zeros(num_seeds, dtype=np.int64)
+    remaining = np.zeros(num_seeds, dtype=np.int64)  # number of steps left in the current action repetition
+    # As temporl_q_learning, a training episode that ends within a skip still adds the remaining steps of the skip,
+    # repeating the last reward in the final state. The environments of these seeds are held meanwhile.
+    ghost = np.zeros(num_seeds, dtype=bool)
+    ghost_state = np.zeros(num_seeds, dtype=np.int64)
+    ghost_reward = np.zeros(num_seeds)
+    last_report = 0
+    while episodes.active.any() or ghost.any():
+        state = env.states
+        # Decisions are drawn for all seeds (to keep the random streams independent) but only used where needed
+        episode_index = np.minimum(episodes.episode, num_episodes - 1)
+        eps_action = np.where(episodes.evaluating, 0., epsilon_schedule_action[episode_index])
+        eps_temporal = epsilon_schedule_temporal[episode_index]
+        new_action = epsilon_greedy_actions(action_Q[all_seeds, state], eps_action, random)
+        temporal_values = temporal_Q[all_seeds, state, new_action]
+        new_skip = epsilon_greedy_actions(temporal_values, eps_temporal, random)
+        # if there are ties use the larger skip during evaluation (as temporl_q_learning)
+        greedy_skip = max_skip - 1 - np.argmax(temporal_values[:, ::-1], axis=1)
+        new_skip = np.where(episodes.evaluating, greedy_skip, new_skip)
+        deciding = remaining == 0
+        action = np.where(deciding, new_action, action)
+        remaining = np.where(deciding, new_skip + 1, remaining)
+        skip_idx[deciding] = 0
+        reward_mat[deciding] = 0
+        episode_decisions += deciding
+
+        s_, reward, done, _ = env.step(action, hold=ghost)
+        episode_reward += reward
+        episode_steps += ~ghost
+        tmp_state = np.where(ghost, ghost_state, state)
+        s_ = np.where(ghost, ghost_state, s_)
+        reward = np.where(ghost, ghost_reward, reward)
+
+        learn = np.flatnonzero(ghost | (episodes.active & ~episodes.evaluating))
+        skip_updates(learn, tmp_state[learn], action[learn], reward[learn], s_[learn])
+        remaining -= 1
+        ghost &= remaining > 0
+
+        ended = np.flatnonzero(done)
+        if len(ended) > 0:
+            training = episodes.active[ended] & ~episodes.evaluating[ended]
+            new_ghosts = ended[training & (remaining[ended] > 0)]
+            ghost[new_ghosts] = True
+            ghost_state[new_ghosts] = s_[new_ghosts]
+            ghost_reward[new_ghosts] = reward[new_ghosts]
+            remaining[ended[~ghost[ended]]] = 0
+            # temporl_q_learning does not track the rewards of the training episodes and reports 0 instead
+            episodes.end_episodes(ended, np.where(training, 0., episode_reward[ended]), episode_decisions[ended],
+                                  episode_steps[ended])
+            episode_decisions[ended] = 0
+            episode_reward[ended] = 0
+            episode_steps[ended] = 0
+            done_episodes = int(episodes.episode.min())
+            if done_episodes // eval_every > last_report // eval_every:
+                print('Done %4d/%4d episodes (all seeds)' % (min(done_episodes, num_episodes), num_episodes))
+            last_report = done_episodes
+    return episodes.results(), (action_Q, temporal_Q)
+
+
 if __name__ == '__main__':
     import argparse
 
@@ -390,23 +829,40 @@ if __name__ == '__main__':
                         type=int,
                         default=7,
                         help='Max skip size for tempoRL')
+    parser.add_argument('--eval-mode',
+                        default='rollout',
+                        choices={'rollout', 'exact'},
+                        help='Evaluate the greedy policy with one rollout or compute its expected return, decisions '
+                             'and steps exactly on the transition model of the environment.')
+    parser.add_argument('--num-seeds',
+                        type=int,
+                        default=1,
+                        help='Number of seeds (seed, seed + 1, ...) to train together with the batched trainers. '
+                             'Every seed gets its own output directory.')
 
     # setup output dir
     args = parser.parse_args()
-    outdir_suffix_dict['seed'] = outdir_suffix_dict['seed'].format(args.seed)
-    outdir_suffix_dict['params'] = outdir_suffix_dict['params'].format(
-        args.episodes, args.max_skips, args.env_ms)
-    outdir_suffix_dict['paramsseed'] = outdir_suffix_dict['paramsseed'].format(
-        args.episodes, args.max_skips, args.env_ms, args.seed)
-
-    if not args.no_render:
+    if args.num_seeds > 1 and args.out_dir_suffix not in ('seed', 'paramsseed'):
+        parser.error('--num-seeds > 1 needs a seed-specific --out-dir-suffix (seed or paramsseed)')
+    seeds = [args.seed + i for i in range(args.num_seeds)]
+    out_dirs = []
+    for seed in seeds:  # one output directory per seed, as for separate runs
+        seed_args = argparse.Namespace(**{**vars(args), 'seed': seed})
+        time_format = outdir_suffix_dict[args.out_dir_suffix]
+        if args.out_dir_suffix == 'seed':
+            time_format = time_format.format(seed)
+        elif args.out_dir_suffix == 'paramsseed':
+            time_format = time_format.format(args.episodes, args.max_skips, args.env_ms, seed)
+        elif args.out_dir_suffix == 'params':
+            time_format = time_format.format(args.episodes, args.max_skips, args.env_ms)
+        out_dirs.append(experiments.prepare_output_dir(seed_args, user_specified_dir=args.out_dir,
+                                                       time_format=time_format))
+
+    if not args.no_render and args.num_seeds == 1 and args.eval_mode == 'rollout':
         # Clear screen in ANSI terminal
         print('\033c')
         print('\x1bc')
 
-    out_dir = experiments.prepare_output_dir(args, user_specified_dir=args.out_dir,
-                                             time_format=outdir_suffix_dict[args.out_dir_suffix])
-
     np.random.seed(args.seed)  # seed nump
     d = None
 
@@ -430,37 +886,60 @@ if __name__ == '__main__':
                            act_fail_prob=args.stochasticity, numpy_state=False)
 
     # setup agent
-    if args.agent == 'sq':
+    if args.num_seeds > 1:
+        # all seeds at once with the batched trainers, the tables have a leading seed dimension
+        if args.agent == 'sq':
+            results, tables = batched_temporl_q_learning(d, args.episodes, seeds,
+                                                         epsilon_decay=args.agent_eps_d,
+                                                         epsilon=args.agent_eps,
+                                                         discount_factor=.99, alpha=.5,
+                                                         eval_every=args.eval_eps,
+                                                         max_skip=args.max_skips,
+                                                         eval_mode=args.eval_mode)
+        elif args.agent == 'q':
+            results, Q = batched_q_learning(d, args.episodes, seeds,
+                                            epsilon_decay=args.agent_eps_d,
+                                            epsilon=args.agent_eps,
+                                            discount_factor=.99,
+                                            alpha=.5, eval_every=args.eval_eps,
+                                            eval_mode=args.eval_mode)
+            tables = (Q, )
+        else:
+            raise NotImplementedError
+        tables = list(zip(*tables))
+    elif args.agent == 'sq':
         train_data, test_data, num_steps, (action_Q, t_Q) = temporl_q_learning(d, args.episodes,
                                                                                epsilon_decay=args.agent_eps_d,
                                                                                epsilon=args.agent_eps,
                                                                                discount_factor=.99, alpha=.5,
                                                                                eval_every=args.eval_eps,
                                                                                render_eval=not args.no_render,
-                                                                               max_skip=args.max_skips)
+                                                                               max_skip=args.max_skips,
+                                                                               eval_mode=args.eval_mode)
+        results, tables = [(train_data, test_data, num_steps)], [(action_Q, t_Q)]
     elif args.agent == 'q':
         train_data, test_data, num_steps, Q = q_learning(d, args.episodes,
                                                          epsilon_decay=args.agent_eps_d,
                                                          epsilon=args.agent_eps,
                                                          discount_factor=.99,
                                                          alpha=.5, eval_every=args.eval_eps,
-                                                         render_eval=not args.no_render)
+                                                         render_eval=not args.no_render,
+                                                         eval_mode=args.eval_mode)
+        results, tables = [(train_data, test_data, num_steps)], [(Q, )]
     else:
         raise NotImplemented
 
-    # TODO save resulting Q-function for easy reuse
-    with open(os.path.join(out_dir, 'train_data.pkl'), 'wb') as outfh:
-        pickle.dump(train_data, outfh)
-    with open(os.path.join(out_dir, 'test_data.pkl'), 'wb') as outfh:
-        pickle.dump(test_data, outfh)
-    with open(os.path.join(out_dir, 'steps_per_episode.pkl'), 'wb') as outfh:
-        pickle.dump(num_steps, outfh)
-
-    if args.agent == 'q':
-        with open(os.path.join(out_dir, 'Q.pkl'), 'wb') as outfh:
-            pickle.dump(dict(Q), outfh)
-    elif args.agent == 'sq':
-        with open(os.path.join(out_dir, 'Q.pkl'), 'wb') as outfh:
-            pickle.dump(dict(action_Q), outfh)
-        with open(os.path.join(out_dir, 'J.pkl'), 'wb') as outfh:
-            pickle.dump(dict(t_Q), outfh)
+    for out_dir, (train_data, test_data, num_steps), seed_tables in zip(out_dirs, results, tables):
+        with open(os.path.join(out_dir, 'train_data.pkl'), 'wb') as outfh:
+            pickle.dump(train_data, outfh)
+        with open(os.path.join(out_dir, 'test_data.pkl'), 'wb') as outfh:
+            pickle.dump(test_data, outfh)
+        with open(os.path.join(out_dir, 'steps_per_episode.pkl'), 'wb') as outfh:
+            pickle.dump(num_steps, outfh)
+
+        # Q.pkl/J.pkl keep the dictionary format (state -> values, (state, action) -> values), Q.npy/J.npy the dense
+        # tables
+        for name, table in zip(('Q', 'J'), seed_tables):
+            with open(os.path.join(out_dir, name + '.pkl'), 'wb') as outfh:
+                pickle.dump(q_table_to_dict(table), outfh)
+            np.save(os.path.join(out_dir, name + '.npy'), table)
@@ -0,0 +1,110 @@
+"""
+Regression tests of utils/skip_transitions.SkipReturnAccumulator against the per-step re-summation of the skip returns
+that the training loops used before (np.power discounting of all reward suffixes).
+
+Run from the TempoRL directory:
+    python -m pytest tests
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils.skip_transitions import SkipReturnAccumulator  # noqa: E402
+
+
+def resummed_skips(skip_rewards, gamma):
+    """
+    Skip transitions stored after the last of skip_rewards, as computed by the former Atari/DDPG training loops
+    :return: (starts, lengths, returns)
+    """
+    curr_skip = len(skip_rewards) - 1
+    starts, lengths, returns = [], [], []
+    skip_id = 0
+    for _ in skip_rewards:
+        skip_reward = 0
+        for exp, r in enumerate(skip_rewards[skip_id:]):  # make sure to properly discount
+            skip_reward += np.power(gamma, exp) * r
+        starts.append(skip_id)
+        lengths.append(curr_skip - skip_id + 1)
+        returns.append(skip_reward)
+        skip_id += 1
+    return starts, lengths, returns
+
+
+def single_step_skips(skip_rewards, skip, gamma):
+    """
+    Skip transitions stored after the last of skip_rewards by the former featurized TQN/TDQN training loops, which
+    sliced the rewards with the chosen skip and incremented skip_id after the loop (i.e. all skips have length 1)
+    :return: (lengths, rewards)
+    """
+    lengths, rewards = [], []
+    skip_id = 0
+    for _ in skip_rewards:
+        skip_reward = 0
+        for exp, r in enumerate(skip_rewards[skip:]):
+            skip_reward += np.power(gamma, exp) * r
+        lengths.append(skip_id + 1)
+        rewards.append(skip_reward)
+    skip_id += 1
+    return lengths, rewards
+
+
+def random_rewards(rng, length, kind):
+    if kind == 'int':  # e.g. clipped Atari rewards
+        return rng.randint(-1, 2, size=length).tolist()
+    if kind == 'sparse':
+        return (rng.randn(length) * (rng.uniform(size=length) < 0.1)).tolist()
+    return rng.randn(length).tolist()
+
+
+@pytest.mark.parametrize('gamma', [0.99, 0.9, 1.0])
+@pytest.mark.parametrize('max_skip', [1, 2, 7, 10])
+@pytest.mark.parametrize('kind', ['float', 'int', 'sparse'])
+def test_matches_resummation(gamma, max_skip, kind):
+    rng = np.random.RandomState(max_skip)
+    accumulator = SkipReturnAccumulator(gamma, max_skip)
+    # Repetitions of up to 3 * max_skip steps, i.e. also longer than the initial arrays of the accumulator
+    for repetition_length in rng.randint(1, 3 * max_skip + 2, size=20):
+        rewards = random_rewards(rng, repetition_length, kind)
+        accumulator.reset()
+        for t, reward in enumerate(rewards):
+            starts, lengths, returns = accumulator.add(reward)
+            expected_starts, expected_lengths, expected_returns = resummed_skips(rewards[:t + 1], gamma)
+            np.testing.assert_array_equal(starts, expected_starts)
+            np.testing.assert_array_equal(lengths, expected_lengths)
+            np.testing.assert_array_equal(returns, expected_returns)  # same order of additions, i.e. bitwise equal
+
+
+@pytest.mark.parametrize('max_skip', [1, 4, 10])
+@pytest.mark.parametrize('kind', ['float', 'int'])
+def test_featurized_single_step_skips(max_skip, kind):
+    single_step_skip_transitions = pytest.importorskip('run_featurized_experiments').single_step_skip_transitions
+    rng = np.random.RandomState(max_skip)
+    accumulator = SkipReturnAccumulator(0.99, max_skip)
+    for skip in rng.randint(0, max_skip, size=20):
+        rewards = random_rewards(rng, skip + 1, kind)
+        accumulator.reset()
+        for t, reward in enumerate(rewards):
+            _, _, skip_returns = accumulator.add(reward)
+            lengths, skip_rewards = single_step_skip_transitions(skip_returns, skip)
+            expected_lengths, expected_rewards = single_step_skips(rewards[:t + 1], skip, 0.99)
+            np.testing.assert_array_equal(lengths, expected_lengths)
+            np.testing.assert_array_equal(skip_rewards, expected_rewards)
+
+
+def test_growth_keeps_returns():
+    accumulator = SkipReturnAccumulator(0.5, 1)
+    for reward in [1., 2., 4.]:  # grows from 1 to 2 and from 2 to 4 entries
+        starts, lengths, returns = accumulator.add(reward)
+    np.testing.assert_array_equal(starts, [0, 1, 2])
+    np.testing.assert_array_equal(lengths, [3, 2, 1])
+    np.testing.assert_array_equal(returns, [1. + 0.5 * 2. + 0.25 * 4., 2. + 0.5 * 4., 4.])
+
+    accumulator.reset()
+    starts, lengths, returns = accumulator.add(3.)
+    np.testing.assert_array_equal(starts, [0])
+    np.testing.assert_array_equal(lengths, [1])
+    np.testing.assert_array_equal(returns, [3.])
@@ -0,0 +1,168 @@
+"""
+Evaluation of the TempoRL agents in background worker processes, such that training does not stall while the
+evaluation episodes are played.
+"""
+import multiprocessing
+import queue
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+def evaluate(agent, info, eval_eps, max_env_time_steps, evaluator=None):
+    """
+    Evaluate the agent, either directly or by submitting the current weights to the (asynchronous) evaluator
+    :param agent: agent providing eval(episodes, max_env_time_steps)
+    :param info: dict with the elapsed_time, training_steps and training_eps at which the evaluation is started
+    :param eval_eps: number of episodes to evaluate for
+    :param max_env_time_steps: maximum number of steps per evaluation episode
+    :param evaluator: optional AsyncEvaluator
+    :return: list of (info, eval results) of the evaluations that finished (see AsyncEvaluator.poll)
+    """
+    if evaluator is None:
+        return [(info, agent.eval(eval_eps, max_env_time_steps))]
+    return evaluator.submit(info, eval_eps, max_env_time_steps)
+
+
+def report_eval(info, eval_results, metrics=None):
+    """
+    Summarize the results of one evaluation
+    :param info: dict with the elapsed_time, training_steps and training_eps at which the evaluation was started.
+                 Further entries (e.g. replay memory statistics) are added to the statistics.
+    :param eval_results: result of agent.eval, i.e. (steps per episode, reward per episode, decisions per episode)
+    :param metrics: optional utils.metrics_log.MetricsLog of the run to append the statistics to
+    :return: dict of the evaluation statistics, e.g. to write them to tensorboard
+    """
+    eval_s, eval_r, eval_d = eval_results
+    eval_stats = dict(
+        elapsed_time=info['elapsed_time'],
+        training_steps=info['training_steps'],
+        training_eps=info['training_eps'],
+        avg_num_steps_per_eval_ep=float(np.mean(eval_s)),
+        avg_num_decs_per_eval_ep=float(np.mean(eval_d)),
+        avg_rew_per_eval_ep=float(np.mean(eval_r)),
+        std_rew_per_eval_ep=float(np.std(eval_r)),
+        eval_eps=len(eval_s)
+    )
+    eval_stats.update({k: v for k, v in info.items() if k not in eval_stats})
+    if metrics is not None:
+        metrics.append(eval_stats)
+        print("reward:", eval_stats['avg_rew_per_eval_ep'], "  step:", eval_stats['training_steps'])
+    return eval_stats
+
+
+def _snapshot(networks):
+    return {name: {k: v.detach().cpu().clone() for k, v in network.state_dict().items()}
+            for name, network in networks.items()}
+
+
+def _worker(agent, networks, requests, results):
+    """
+    Worker loop of AsyncEvaluator. Loads the received weight snapshot into the worker's copy of the agent and runs
+    agent.eval on it.
+    """
+    torch.set_num_threads(1)  # do not compete with the learner for the cores
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        seq, snapshot, eval_args = request
+        for name, state_dict in snapshot.items():
+            networks[name].load_state_dict(state_dict)
+        with torch.no_grad():
+            results.put((seq, agent.eval(*eval_args)))
+
+
+class AsyncEvaluator:
+    """
+    Runs agent.eval in worker processes on snapshots of the agent's networks.
+
+    The workers are forked from the training process when the evaluator is created, i.e. every worker owns a copy of
+    the agent (including its eval environment). On submit the weights of all torch modules of the agent are copied
+    and sent to a worker, so training can continue immediately. Finished evaluations are collected with poll and are
+    returned in the order in which they were submitted, together with the info (e.g. training_steps) passed to submit.
+    Create the evaluator before the replay buffers are filled, as the workers inherit the memory of the process.
+    As CUDA can not be used in forked processes, all networks of the agent have to be on the CPU.
+    """
+
+    def __init__(self, agent, num_workers: int = 1, max_pending: int = 4):
+        """
+        :param agent: agent providing eval(episodes, max_env_time_steps)
+        :param num_workers: number of evaluation processes
+        :param max_pending: maximal number of submitted but unfinished evaluations. If exceeded, submit blocks until
+                            the oldest evaluation has finished (bounds the memory used by weight snapshots).
+        """
+        self._networks = {name: module for name, module in vars(agent).items() if isinstance(module, nn.Module)}
+        for name, module in self._networks.items():
+            devices = {p.device for p in module.parameters()} - {torch.device('cpu')}
+            if devices:
+                raise ValueError('Asynchronous evaluation requires the networks on the CPU (CUDA can not be used in '
+                                 'forked processes), but {} is on {}'.format(name, devices.pop()))
+        self._max_pending = max_pending
+        ctx = multiprocessing.get_context('fork')
+        self._requests = ctx.Queue()
+        self._results = ctx.Queue()
+        self._workers = [ctx.Process(target=_worker, args=(agent, self._networks, self._requests, self._results),
+                                     daemon=True) for _ in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+        self._infos = {}  # seq -> info of submitted evaluations
+        self._finished = {}  # seq -> results of evaluations that finished out of order
+        self._next_seq = 0
+        self._next_result = 0
+
+    @property
+    def pending(self):
+        return len(self._infos)
+
+    def submit(self, info, *eval_args):
+        """
+        Evaluate the current weights of the agent
+        :param info: arbitrary information to return with the results, e.g. a dict with training_steps
+        :param eval_args: arguments of agent.eval, i.e. (episodes, max_env_time_steps)
+        :return: evaluations that finished while waiting for a free slot (see poll)
+        """
+        done = []
+        while self.pending >= self._max_pending:
+            done.extend(self.poll(block=True))
+        self._infos[self._next_seq] = info
+        self._requests.put((self._next_seq, _snapshot(self._networks), eval_args))
+        self._next_seq += 1
+        return done
+
+    def poll(self, block: bool = False):
+        """
+        Collect finished evaluations
+        :param block: wait until the oldest pending evaluation has finished
+        :return: list of (info, (steps per episode, reward per episode, decisions per episode)) in submission order
+        """
+        if block and self.pending > 0:
+            while self._next_result not in self._finished:
+                seq, result = self._results.get()
+                self._finished[seq] = result
+        while True:
+            try:
+                seq, result = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._finished[seq] = result
+        done = []
+        while self._next_result in self._finished:
+            done.append((self._infos.pop(self._next_result), self._finished.pop(self._next_result)))
+            self._next_result += 1
+        return done
+
+    def close(self):
+        """
+        Wait for all pending evaluations and stop the workers
+        :return: the remaining evaluations (see poll)
+        """
+        done = []
+        while self.pending > 0:
+            done.extend(self.poll(block=True))
+        for _ in self._workers:
+            self._requests.put(None)
+        for worker in self._workers:
+            worker.join()
+        return done
@@ -1,12 +1,12 @@
 import yaml
 import os
 import glob
-import pickle
 import numpy as np
 
-import json
 import pandas as pd
 
+from utils.results_cache import load_results
+
 
 def load_config():
     with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config'), 'r') as ymlf:
@@ -15,7 +15,12 @@ def load_config():
 
 
 def load_data(experiment_dir="experiments_01_28", methods=['sq', 'q'], exp_version='-1.0-linear',
-              episodes=50_000, max_skip=6, max_steps=100, local=True, debug=False):
+              episodes=50_000, max_skip=6, max_steps=100, local=True, debug=False, cache=True, workers=None):
+    """
+    Load the evaluation results of the tabular experiments
+    :param cache: use the results cache (see utils/results_cache.py), i.e. only parse new or changed files
+    :param workers: number of processes to parse changed files with
+    """
     cfg = load_config()
     method_test_rewards = {}
     method_test_lengths = {}
@@ -35,18 +40,17 @@ def load_data(experiment_dir="experiments_01_28", methods=['sq', 'q'], exp_versi
                 max_steps
             ))
         test_rewards, test_lens, steps_per_eps = [], [], []
-        for file in files:
+        test_data = load_results(files, 'pickled_tuple', cache, workers)
+        steps_data = load_results([file.replace('test_data', 'steps_per_episode') for file in files],
+                                  'pickled_tuple', cache, workers)
+        for file, data, steps in zip(files, test_data, steps_data):
             if debug:
                 print('Loading', file)
-            with open(file, 'rb') as fh:
-                data = pickle.load(fh)
-                test_rewards.append(data[0])
-                test_lens.append(data[1])
-            try:
-                with open(file.replace('test_data', 'steps_per_episode'), 'rb') as fh:
-                    data = pickle.load(fh)
-                    steps_per_eps.append(data[1])
-            except FileNotFoundError:
+            test_rewards.append(data['0'])
+            test_lens.append(data['1'])
+            if steps is not None:
+                steps_per_eps.append(steps['1'])
+            else:
                 print('No steps data found')
 
         method_test_rewards[method] = np.array(test_rewards)
@@ -55,7 +59,12 @@ def load_data(experiment_dir="experiments_01_28", methods=['sq', 'q'], exp_versi
     return method_test_rewards, method_test_lengths, method_steps_per_episodes
 
 
-def load_dqn_data(experiment_dir, method, max_steps=None, succ_threashold=None, debug=False):
+def load_dqn_data(experiment_dir, method, max_steps=None, succ_threashold=None, debug=False, cache=True, workers=None):
+    """
+    Load the evaluation results (eval_scores.json) of the DQN experiments and aggregate them over the runs
+    :param cache: use the results cache (see utils/results_cache.py), i.e. only parse new or changed files
+    :param workers: number of processes to parse changed files with
+    """
     cfg = load_config()
     print(os.path.abspath(os.path.join(method, experiment_dir, 'eval_scores.json')))
     files = glob.glob(
@@ -65,20 +74,19 @@ def load_dqn_data(experiment_dir, method, max_steps=None, succ_threashold=None,
     frames = []
     max_len = 0
     succ_count = 0
-    for file in sorted(files):
+    files = sorted(files)
+    for file, columns in zip(files, load_results(files, 'eval_scores', cache, workers)):
         if debug:
             print('Loading', file)
-        data = []
-        with open(file, 'r') as fh:
-            for line in fh:
-                loaded = json.loads(line)
-                data.append(loaded)
-                if max_steps and loaded['training_steps'] >= max_steps:
-                    break
-            frame = pd.DataFrame(data)
-            max_len = max(max_len, frame.shape[0])
+        num_records = len(columns['training_steps']) if columns else 0
+        if max_steps and num_records > 0:
+            # up to (including) the first evaluation after max_steps
+            reached = np.flatnonzero(columns['training_steps'] >= max_steps)
+            num_records = reached[0] + 1 if len(reached) > 0 else num_records
+        frame = pd.DataFrame({field: values[:num_records] for field, values in columns.items()})
+        max_len = max(max_len, frame.shape[0])
         if succ_threashold:
-            if loaded['avg_rew_per_eval_ep'] > succ_threashold:
+            if frame['avg_rew_per_eval_ep'].iloc[-1] > succ_threashold:
                 succ_count += 1
         frames.append(frame)
     rews, lens, decs, training_steps, training_eps = [], [], [], [], []
@@ -0,0 +1,27 @@
+"""
+Location and writing of the disk caches of the compiled grid models (grid_envs.py), the parsed experiment results
+(utils/results_cache.py) and the tensorboard scalars (utils/tfevents.py).
+"""
+import os
+
+import numpy as np
+
+# Directory of the disk caches: the TEMPORL_CACHE_DIR environment variable, ~/.cache/temporl by default.
+# None (an empty TEMPORL_CACHE_DIR) disables the disk caches, results are then only cached in-process.
+CACHE_DIR = os.environ.get('TEMPORL_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'temporl')) or None
+
+
+def save_npz(path, **arrays):
+    """
+    Write arrays to the .npz file path via a temporary file that replaces path atomically, such that parallel
+    processes never read partial files. Failures (e.g. on read-only file systems) are ignored as caching is optional.
+    :return: True if the file was written
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.tmp.npz'.format(path[:-4], os.getpid())
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,119 @@
+"""
+Append-only binary log of the evaluation results of a run.
+
+Every evaluation appends one fixed-width record to <name>.bin, so writing an evaluation costs the same regardless of
+the length of the run. The record layout (a NumPy structured dtype) is stored once in the small index <name>.json next
+to it. reward.txt and step.txt of the previous np.savetxt logging can be exported from the log at any time.
+"""
+import json
+import os
+
+import numpy as np
+
+# Fields of the evaluation statistics written by the TempoRL agents
+EVAL_FIELDS = [('elapsed_time', '<f8'),
+               ('training_steps', '<i8'),
+               ('training_eps', '<i8'),
+               ('avg_num_steps_per_eval_ep', '<f8'),
+               ('avg_num_decs_per_eval_ep', '<f8'),
+               ('avg_rew_per_eval_ep', '<f8'),
+               ('std_rew_per_eval_ep', '<f8'),
+               ('eval_eps', '<i8')]
+
+_VERSION = 1
+
+
+def _paths(directory, name):
+    return os.path.join(directory, name + '.bin'), os.path.join(directory, name + '.json')
+
+
+class MetricsLog:
+    """
+    Writer of the log. Records are appended with a single write. When resuming a log, a record that was only partially
+    written (e.g. the process was killed) is dropped.
+    """
+
+    def __init__(self, directory, fields=EVAL_FIELDS, name: str = 'metrics', fsync_every: int = 1,
+                 resume: bool = False):
+        """
+        :param directory: directory of the run
+        :param fields: list of (name, dtype) of the record fields
+        :param name: file name (without extension) of the log
+        :param fsync_every: fsync the log after every fsync_every records (0 to only fsync on close)
+        :param resume: continue an existing log instead of replacing it (as reward.txt and step.txt were replaced by a
+                       new run in the same directory)
+        """
+        self.dtype = np.dtype(fields)
+        self._data_path, self._index_path = _paths(directory, name)
+        self._fsync_every = fsync_every
+        self._unsynced = 0
+        index = dict(version=_VERSION, fields=[(field, self.dtype[field].str) for field in self.dtype.names],
+                     record_size=self.dtype.itemsize)
+        if not resume:
+            for path in (self._data_path, self._index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        if os.path.exists(self._index_path):
+            with open(self._index_path, 'r') as fh:
+                existing = json.load(fh)
+            if [tuple(field) for field in existing['fields']] != index['fields']:
+                raise ValueError('{:s} has different fields'.format(self._index_path))
+        else:
+            with open(self._index_path, 'w') as fh:
+                json.dump(index, fh)
+        self._file = open(self._data_path, 'ab')
+        size = self._file.tell()
+        if size % self.dtype.itemsize != 0:  # drop a partially written record
+            self._file.truncate(size - size % self.dtype.itemsize)
+        self._count = size // self.dtype.itemsize
+        self._record = np.zeros(1, dtype=self.dtype)
+
+    def __len__(self):
+        return self._count
+
+    def append(self, values: dict):
+        """
+        Append one record
+        :param values: value of every field (further entries are ignored)
+        """
+        record = self._record
+        for field in self.dtype.names:
+            record[field] = values[field]
+        self._file.write(record.tobytes())
+        self._file.flush()
+        self._count += 1
+        self._unsynced += 1
+        if self._fsync_every and self._unsynced >= self._fsync_every:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+
+def read_metrics(directory, name: str = 'metrics') -> np.ndarray:
+    """
+    Read all complete records of a log (also while it is being written)
+    :param directory: directory of the run
+    :param name: file name (without extension) of the log
+    :return: structured array with one entry per evaluation, e.g. read_metrics(d)['avg_rew_per_eval_ep']
+    """
+    data_path, index_path = _paths(directory, name)
+    with open(index_path, 'r') as fh:
+        index = json.load(fh)
+    dtype = np.dtype([tuple(field) for field in index['fields']])
+    count = os.path.getsize(data_path) // dtype.itemsize
+    return np.fromfile(data_path, dtype=dtype, count=count)
+
+
+def export_txt(directory, name: str = 'metrics', reward_field: str = 'avg_rew_per_eval_ep',
+               step_field: str = 'training_steps'):
+    """
+    Write reward.txt and step.txt (as previously written with np.savetxt after every evaluation) from a log
+    """
+    records = read_metrics(directory, name)
+    np.savetxt(os.path.join(directory, 'reward.txt'), records[reward_field].astype(np.float64))
+    np.savetxt(os.path.join(directory, 'step.txt'), records[step_field].astype(np.float64))
@@ -0,0 +1,101 @@
+"""
+NumPy inference of the small fully connected Q-networks (Q, TQ and WeightSharingTQ of run_featurized_experiments.py)
+for selecting single actions and skips.
+
+With a batch of one observation and hidden layers of 50 units, a torch forward pass is dominated by the per-operator
+dispatch overhead. MLPMirror evaluates the same network with a few matrix-vector products on NumPy arrays instead.
+For networks on the CPU the arrays are views of the torch parameters, i.e. they always hold the current weights, as
+the optimizers, soft_update and load_state_dict update the parameters in place. For networks on other devices the
+weights are copied, and mark_stale has to be called after every optimizer step to copy them again before the next
+forward pass.
+"""
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+class MLPMirror:
+    """
+    NumPy mirror of a Q-network with the layers fc1, fc2 and the output layers fc3 (Q), action_fc3 (action output of
+    WeightSharingTQ) and skip_fc2/skip_fc3 (skip output with the behaviour action as context, TQ and WeightSharingTQ)
+    """
+
+    def __init__(self, module: torch.nn.Module):
+        """
+        :param module: network to mirror. Only ReLU non-linearities are supported.
+        """
+        if getattr(module, '_non_linearity', F.relu) is not F.relu:
+            raise ValueError('MLPMirror only supports ReLU networks')
+        self._module = module
+        self._layers = [name for name in ('fc1', 'fc2', 'fc3', 'action_fc3', 'skip_fc2', 'skip_fc3')
+                        if hasattr(module, name)]
+        self._shared_memory = all(parameter.device.type == 'cpu' and parameter.dtype == torch.float32
+                                  for parameter in module.parameters())
+        self._stale = True
+        self._weights = {}
+        self._hidden = np.empty(module.fc1.out_features, dtype=np.float32)
+        self._x = np.empty(module.fc1.in_features, dtype=np.float32)
+        if hasattr(module, 'skip_fc3'):
+            # state features and context features are concatenated before the skip output layer
+            self._context = np.empty(module.skip_fc3.in_features, dtype=np.float32)
+        self.sync()
+
+    def sync(self):
+        """
+        Bind (CPU) or copy the current weights of the network
+        """
+        with torch.no_grad():
+            for name in self._layers:
+                layer = getattr(self._module, name)
+                if self._shared_memory:
+                    self._weights[name] = (layer.weight.detach().numpy(), layer.bias.detach().numpy())
+                else:
+                    self._weights[name] = (np.array(layer.weight.detach().cpu().numpy(), dtype=np.float32),
+                                           np.array(layer.bias.detach().cpu().numpy(), dtype=np.float32))
+        self._stale = False
+
+    def mark_stale(self):
+        """
+        Signal that the weights of the network changed. Only copied networks are synced again (before the next forward).
+        """
+        if not self._shared_memory:
+            self._stale = True
+
+    def _features(self, x):
+        if self._stale:
+            self.sync()
+        self._x[:] = x.reshape(-1)
+        hidden = self._hidden
+        weight, bias = self._weights['fc1']
+        np.dot(weight, self._x, out=hidden)
+        hidden += bias
+        np.maximum(hidden, 0, out=hidden)
+        weight, bias = self._weights['fc2']
+        hidden = weight.dot(hidden)
+        hidden += bias
+        return np.maximum(hidden, 0, out=hidden)
+
+    def q(self, x: np.ndarray) -> np.ndarray:
+        """
+        Action values of a single observation (output of Q, or the action output of WeightSharingTQ)
+        """
+        features = self._features(x)
+        weight, bias = self._weights['fc3' if 'fc3' in self._weights else 'action_fc3']
+        values = weight.dot(features)
+        values += bias
+        return values
+
+    def skip_q(self, x: np.ndarray, a) -> np.ndarray:
+        """
+        Skip values of a single observation given the behaviour action a (output of TQ or the skip output of
+        WeightSharingTQ)
+        """
+        context = self._context
+        num_hidden = len(self._hidden)
+        context[:num_hidden] = self._features(x)
+        weight, bias = self._weights['skip_fc2']
+        np.maximum(weight[:, 0] * np.float32(np.reshape(a, -1)[0]) + bias, 0, out=context[num_hidden:])
+        weight, bias = self._weights['skip_fc3']
+        values = weight.dot(context)
+        values += bias
+        return values
@@ -0,0 +1,259 @@
+"""
+Proportional prioritized replay (Schaul et al., 2016) on top of the RingBuffer storage of utils/replay_buffers.py.
+
+Used by the TempoRL agents to replay skip transitions. As every decision adds up to max_skip correlated skip
+transitions, the skip replay buffer is dominated by long skips. Prioritizing by TD-error and optionally stratifying
+the batches by skip length counteracts this.
+"""
+import numpy as np
+
+
+class SumTree:
+    """
+    Binary trees in a flat array in which every node holds the sum of its children. The leaves hold the priorities.
+    Updating a priority and finding the leaf of a cumulative priority are O(log n). Both are vectorized over batches.
+    Several trees of equal capacity (e.g. one per stratum) can be stored in the same array, such that batches spanning
+    several trees are still processed with one vectorized pass.
+    """
+
+    def __init__(self, capacity, num_trees=1):
+        """
+        :param capacity: number of leaves per tree (rounded up to the next power of two)
+        :param num_trees: number of trees
+        """
+        self.capacity = 1 << int(np.ceil(np.log2(max(int(capacity), 1))))
+        self.num_trees = num_trees
+        self._tree = np.zeros(num_trees * 2 * self.capacity, dtype=np.float64)
+
+    def _base(self, trees):
+        return np.asarray(trees, dtype=np.int64) * (2 * self.capacity)
+
+    @property
+    def totals(self):
+        """
+        Sum of all priorities of every tree
+        """
+        return self._tree[1::2 * self.capacity]
+
+    def get(self, indices, trees=0):
+        return self._tree[self._base(trees) + np.asarray(indices) + self.capacity]
+
+    def set(self, index, priority, tree=0):
+        """
+        Set the priority of a single leaf
+        """
+        base = int(tree) * 2 * self.capacity
+        t = self._tree
+        i = int(index) + self.capacity
+        t[base + i] = priority
+        i >>= 1
+        while i >= 1:
+            t[base + i] = t[base + 2 * i] + t[base + 2 * i + 1]
+            i >>= 1
+
+    def update(self, indices, priorities, trees=0):
+        """
+        Set the priorities of a batch of leaves. For duplicate leaves the last priority is kept.
+        """
+        nodes = np.asarray(indices, dtype=np.int64) + self.capacity
+        if len(nodes) == 0:  # e.g. all sampled slots were overwritten since sampling
+            return
+        base = self._base(trees)
+        t = self._tree
+        t[base + nodes] = priorities
+        nodes >>= 1
+        while nodes[0] >= 1:  # all nodes are on the same level, duplicates are harmless
+            t[base + nodes] = t[base + 2 * nodes] + t[base + 2 * nodes + 1]
+            nodes >>= 1
+
+    def find(self, values, trees=0):
+        """
+        Find the leaves at which the cumulative priorities reach the given values
+        :param values: array of values in [0, total of the tree)
+        :param trees: tree of every value (or one tree for all values)
+        :return: int64 array of leaf indices. Leaves with zero priority are never returned (unless the tree is empty).
+        """
+        base = self._base(trees)
+        t = self._tree
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.capacity:
+            children = base + 2 * nodes
+            left = t[children]
+            go_right = (values >= left) & (t[children + 1] > 0)
+            values -= left * go_right
+            nodes = 2 * nodes + go_right
+        return nodes - self.capacity
+
+    def grow(self, capacity):
+        """
+        Increase the number of leaves per tree to (at least) capacity, keeping the priorities
+        """
+        leaves = self._tree.reshape(self.num_trees, -1)[:, self.capacity:]
+        self.__init__(capacity, self.num_trees)
+        tree = self._tree.reshape(self.num_trees, -1)
+        tree[:, self.capacity:self.capacity + leaves.shape[1]] = leaves
+        lo = self.capacity // 2
+        while lo >= 1:
+            tree[:, lo:2 * lo] = tree[:, 2 * lo:4 * lo:2] + tree[:, 2 * lo + 1:4 * lo:2]
+            lo //= 2
+
+    @property
+    def nbytes(self):
+        return self._tree.nbytes
+
+
+class PrioritizedSampler:
+    """
+    Priorities of the slots of a replay buffer, optionally partitioned into strata.
+
+    Every stratum has its own sum tree over a compact list of its slots (removal swaps in the last slot). The trees
+    grow with the largest stratum, i.e. the priorities take num_strata times the size of the largest stratum.
+    Without stratification slots are sampled proportionally to priority^alpha. With stratification the batch is split
+    evenly over all non-empty strata and slots are sampled proportionally within their stratum.
+    Within a tree the cumulative priority is split into one segment per sample (stratified sampling as in the paper).
+    """
+
+    def __init__(self, max_size, alpha=0.6, beta=0.4, epsilon=1e-6, num_strata=1):
+        """
+        :param max_size: number of slots
+        :param alpha: prioritization exponent (0 is uniform sampling)
+        :param beta: exponent of the importance-sampling correction (1 fully compensates the non-uniform sampling)
+        :param epsilon: added to the absolute TD-errors, such that no transition has zero probability
+        :param num_strata: number of strata (1 for no stratification)
+        """
+        self.max_size = int(max_size)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        self.num_strata = num_strata
+        self._tree = SumTree(self.max_size if num_strata == 1 else min(self.max_size, 1024), num_strata)
+        self._slots = np.zeros((num_strata, self._tree.capacity), dtype=np.int64)  # position -> slot
+        self._counts = np.zeros(num_strata, dtype=np.int64)
+        self._stratum_of = np.full(self.max_size, -1, dtype=np.int64)  # -1 for empty slots
+        self._position_of = np.zeros(self.max_size, dtype=np.int64)
+        self._max_priority = 1.0
+
+    def __len__(self):
+        return int(self._counts.sum())
+
+    def add(self, slot, stratum=0):
+        """
+        (Re-)insert a slot with the maximal priority seen so far, such that new transitions are replayed at least once
+        """
+        priority = self._max_priority ** self.alpha
+        if self._stratum_of[slot] == stratum:
+            self._tree.set(self._position_of[slot], priority, stratum)
+            return
+        self.remove(slot)
+        position = self._counts[stratum]
+        if position == self._tree.capacity:
+            self._tree.grow(2 * self._tree.capacity)
+            slots = np.zeros((self.num_strata, self._tree.capacity), dtype=np.int64)
+            slots[:, :position] = self._slots
+            self._slots = slots
+        self._tree.set(position, priority, stratum)
+        self._slots[stratum, position] = slot
+        self._position_of[slot] = position
+        self._stratum_of[slot] = stratum
+        self._counts[stratum] += 1
+
+    def remove(self, slot):
+        """
+        Remove a slot from sampling (e.g. an entry that was dropped from the buffer)
+        """
+        stratum = self._stratum_of[slot]
+        if stratum < 0:
+            return
+        slots = self._slots[stratum]
+        position, last = self._position_of[slot], self._counts[stratum] - 1
+        if position != last:
+            self._tree.set(position, self._tree.get(last, stratum), stratum)
+            slots[position] = slots[last]
+            self._position_of[slots[position]] = position
+        self._tree.set(last, 0., stratum)
+        self._counts[stratum] -= 1
+        self._stratum_of[slot] = -1
+
+    def sample(self, batch_size):
+        """
+        Sample slots (with replacement)
+        :return: (int64 array of slots, float32 array of importance-sampling weights normalized to a maximum of 1)
+        """
+        strata = np.flatnonzero(self._counts)
+        sizes = np.full(len(strata), batch_size // len(strata))
+        sizes[np.random.choice(len(strata), batch_size % len(strata), replace=False)] += 1
+        sample_strata = np.repeat(strata, sizes)
+        segments = np.arange(batch_size) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        totals = self._tree.totals[sample_strata]
+        values = np.minimum((segments + np.random.uniform(size=batch_size)) * totals / sizes.repeat(sizes), totals)
+        positions = np.minimum(self._tree.find(values, sample_strata), self._counts[sample_strata] - 1)
+        probabilities = self._tree.get(positions, sample_strata) / (totals * len(strata))
+        weights = np.power(len(self) * probabilities, -self.beta)
+        return self._slots[sample_strata, positions], (weights / weights.max()).astype(np.float32)
+
+    def update(self, slots, td_errors):
+        """
+        Set the priorities of sampled slots from their (absolute) TD-errors
+        """
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64)).reshape(-1) + self.epsilon
+        self._max_priority = max(self._max_priority, priorities.max())
+        strata = self._stratum_of[slots]
+        valid = strata >= 0  # slots might have been overwritten since they were sampled
+        self._tree.update(self._position_of[slots[valid]], np.power(priorities[valid], self.alpha), strata[valid])
+
+    @property
+    def nbytes(self):
+        return self._tree.nbytes + self._slots.nbytes + self._stratum_of.nbytes + self._position_of.nbytes
+
+
+class PrioritizedRingBuffer:
+    """
+    Prioritized sampling from a RingBuffer or FrameRingBuffer. The slots of the storage are tracked by a
+    PrioritizedSampler, including entries that are overwritten or dropped by the storage.
+    """
+
+    def __init__(self, storage, alpha=0.6, beta=0.4, epsilon=1e-6, stratify_by=None, num_strata=1):
+        """
+        :param storage: RingBuffer (or FrameRingBuffer) holding the transitions
+        :param alpha: prioritization exponent
+        :param beta: exponent of the importance-sampling correction
+        :param epsilon: added to the absolute TD-errors
+        :param stratify_by: optional name of an integer field with values in [1, num_strata] (e.g. skip lengths) to
+                            stratify the batches by
+        :param num_strata: number of strata
+        """
+        self.storage = storage
+        self._stratum_field = None if stratify_by is None else storage.fields.index(stratify_by)
+        self.sampler = PrioritizedSampler(storage.max_size, alpha, beta, epsilon,
+                                          num_strata if stratify_by is not None else 1)
+
+    def __len__(self):
+        return len(self.storage)
+
+    @property
+    def nbytes(self):
+        return self.storage.nbytes + self.sampler.nbytes
+
+    def add(self, *values):
+        storage = self.storage
+        slot, size = storage.ptr, storage.size
+        storage.add(*values)
+        stratum = 0
+        if self._stratum_field is not None:
+            stratum = min(max(int(values[self._stratum_field]) - 1, 0), self.sampler.num_strata - 1)
+        self.sampler.add(slot, stratum)
+        # Entries dropped by a FrameRingBuffer are the oldest ones
+        for i in range(min(size + 1, storage.max_size) - storage.size):
+            self.sampler.remove((storage.ptr - storage.size - 1 - i) % storage.max_size)
+
+    def random_batch(self, batch_size):
+        """
+        Sample a batch proportionally to the priorities
+        :return: (list of arrays, one per field; slots of the batch; importance-sampling weights)
+        """
+        slots, weights = self.sampler.sample(batch_size)
+        return self.storage.gather(slots), slots, weights
+
+    def update_priorities(self, slots, td_errors):
+        self.sampler.update(slots, td_errors)
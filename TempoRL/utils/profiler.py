@@ -0,0 +1,233 @@
+"""
+Low-overhead profiling of the phases of a training loop (environment steps, replay buffer filling, batch sampling,
+updates, evaluation, ...).
+
+The training loops wrap their phases in `with profiler.phase('name'):` blocks and count events with
+profiler.count('name'). A disabled PhaseProfiler (the default of the agents) replaces both methods by no-ops, such
+that the instrumentation costs a single function call. An enabled one accumulates per phase the wall time, the number
+of calls and the net number of allocated Python memory blocks per call (sys.getallocatedblocks, i.e. the growth of the
+Python heap, not counting torch or NumPy buffers). As reading the number of blocks scans the whole heap, it is only
+measured for every alloc_every-th call of a phase. Nested phases are timed independently, i.e. the time of
+'learn/sample' is included in 'learn'.
+
+The statistics since the previous report are written to tensorboard with write(step), and the statistics of
+the whole run are formatted as a table with summary(). Optionally a sampling profiler records the call stacks of the
+training thread in the background. Its samples are written in the collapsed stack format (one "frame;frame;... count"
+line per stack, e.g. for flamegraph.pl or speedscope) with dump(path), which can also be triggered from outside the
+process with a signal (kill -USR1 <pid>).
+"""
+import collections
+import contextlib
+import os
+import signal
+import sys
+import threading
+import time
+
+_NULL_PHASE = contextlib.nullcontext()
+
+
+def _null_phase(name):
+    return _NULL_PHASE
+
+
+def _null_count(name, n=1):
+    pass
+
+
+class _Phase:
+    """
+    Accumulating timer of one phase (a reusable context manager, not re-entrant)
+    """
+    __slots__ = ('calls', 'time', 'blocks', 'alloc_calls', '_alloc_every', '_start', '_start_blocks')
+
+    def __init__(self, alloc_every):
+        self.calls = 0
+        self.time = 0.
+        self.blocks = 0  # net allocated blocks of the calls with allocation measurement
+        self.alloc_calls = 0  # number of calls with allocation measurement
+        self._alloc_every = alloc_every
+        self._start = 0.
+        self._start_blocks = None
+
+    def __enter__(self):
+        if self._alloc_every and self.calls % self._alloc_every == 0:
+            self._start_blocks = sys.getallocatedblocks()  # outside of the timed region
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.time += time.perf_counter() - self._start
+        self.calls += 1
+        if self._start_blocks is not None:
+            self.blocks += sys.getallocatedblocks() - self._start_blocks
+            self.alloc_calls += 1
+            self._start_blocks = None
+
+
+class SamplingProfiler:
+    """
+    Samples the call stack of one thread at a fixed interval from a background thread
+    """
+
+    def __init__(self, interval: float = 0.005, thread_id: int = None):
+        """
+        :param interval: seconds between two samples
+        :param thread_id: thread to sample (default: the thread creating the profiler)
+        """
+        self._interval = interval
+        self._thread_id = threading.get_ident() if thread_id is None else thread_id
+        self._stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='SamplingProfiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:  # the sampled thread has finished
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{:s} ({:s}:{:d})'.format(code.co_name, os.path.basename(code.co_filename),
+                                                       code.co_firstlineno))
+                frame = frame.f_back
+            self._stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self, path):
+        """
+        Write the samples so far in the collapsed stack format
+        """
+        stacks = dict(self._stacks)  # copied at once, as the sampling thread may add stacks meanwhile
+        with open(path, 'w') as fh:
+            for stack, samples in sorted(stacks.items(), key=lambda item: -item[1]):
+                fh.write('{:s} {:d}\n'.format(stack, samples))
+
+
+class PhaseProfiler:
+    """
+    Named phase timers and event counters of a training loop
+    """
+
+    def __init__(self, enabled: bool = False, writer=None, alloc_every: int = 256, sampling_interval: float = None,
+                 dump_path: str = None, dump_signal: int = getattr(signal, 'SIGUSR1', None)):
+        """
+        :param enabled: time the phases. Otherwise phase and count are no-ops.
+        :param writer: optional tensorboard SummaryWriter for the statistics (see write)
+        :param alloc_every: measure the allocations of every alloc_every-th call of a phase (0 to not measure them)
+        :param sampling_interval: seconds between the stack samples of the (optional) sampling profiler
+        :param dump_path: path prefix of the dumps (<dump_path>_<n>.txt with the summary table and
+                          <dump_path>_<n>.stacks with the stack samples). Dumps are written on dump_signal and on close.
+        :param dump_signal: signal triggering a dump (only installed if dump_path is given, from the main thread)
+        """
+        self.enabled = enabled
+        self._writer = writer
+        self._alloc_every = alloc_every
+        self._phases = {}
+        self._counters = collections.Counter()
+        self._start = time.perf_counter()
+        self._last_report = (self._start, {}, {})  # time, phase totals and counter totals of the last write
+        self._dump_path = dump_path
+        self._dumps = 0
+        if not enabled:
+            self.phase = _null_phase
+            self.count = _null_count
+        self._sampler = None
+        if sampling_interval is not None:
+            self._sampler = SamplingProfiler(sampling_interval)
+            self._sampler.start()
+        if dump_path is not None and dump_signal is not None and \
+                threading.current_thread() is threading.main_thread():
+            signal.signal(dump_signal, lambda signum, frame: self.dump())
+
+    def phase(self, name: str):
+        """
+        Context manager timing one execution of the phase name
+        """
+        timer = self._phases.get(name)
+        if timer is None:
+            timer = self._phases[name] = _Phase(self._alloc_every)
+        return timer
+
+    def count(self, name: str, n: int = 1):
+        """
+        Count n events (e.g. transitions or gradient steps)
+        """
+        self._counters[name] += n
+
+    def write(self, step: int):
+        """
+        Write the statistics of the phases and counters since the previous write to tensorboard
+        :param step: global step of the scalars (e.g. the number of training steps)
+        """
+        if not self.enabled or self._writer is None:
+            return
+        writer = self._writer
+        now = time.perf_counter()
+        last_time, last_phases, last_counters = self._last_report
+        elapsed = max(now - last_time, 1e-9)
+        phases = {name: (timer.calls, timer.time, timer.blocks, timer.alloc_calls)
+                  for name, timer in self._phases.items()}
+        for name, (calls, total, blocks, alloc_calls) in phases.items():
+            last_calls, last_total, last_blocks, last_alloc_calls = last_phases.get(name, (0, 0., 0, 0))
+            writer.add_scalar('profile/{:s}/wall_time'.format(name), total - last_total, step)
+            writer.add_scalar('profile/{:s}/time_share'.format(name), (total - last_total) / elapsed, step)
+            writer.add_scalar('profile/{:s}/calls_per_s'.format(name), (calls - last_calls) / elapsed, step)
+            if alloc_calls > last_alloc_calls:
+                writer.add_scalar('profile/{:s}/blocks_per_call'.format(name),
+                                  (blocks - last_blocks) / (alloc_calls - last_alloc_calls), step)
+        for name, total in self._counters.items():
+            writer.add_scalar('profile/count/{:s}_per_s'.format(name), (total - last_counters.get(name, 0)) / elapsed,
+                              step)
+        self._last_report = (now, phases, dict(self._counters))
+
+    def summary(self) -> str:
+        """
+        Table of the statistics of all phases and counters since the profiler was created
+        """
+        elapsed = max(time.perf_counter() - self._start, 1e-9)
+        lines = ['{:<28s} {:>10s} {:>10s} {:>8s} {:>12s} {:>10s} {:>12s}'.format(
+            'phase', 'calls', 'total [s]', 'share', 'per call', 'calls/s', 'blocks/call')]
+        for name in sorted(self._phases):
+            timer = self._phases[name]
+            lines.append('{:<28s} {:>10d} {:>10.2f} {:>7.1f}% {:>10.1f}us {:>10.1f} {:>12s}'.format(
+                name, timer.calls, timer.time, 100 * timer.time / elapsed, 1e6 * timer.time / max(timer.calls, 1),
+                timer.calls / elapsed, '{:.1f}'.format(timer.blocks / timer.alloc_calls) if timer.alloc_calls else ''))
+        for name in sorted(self._counters):
+            lines.append('{:<28s} {:>10d} {:>10s} {:>8s} {:>12s} {:>10.1f}'.format(
+                name, self._counters[name], '', '', '', self._counters[name] / elapsed))
+        lines.append('{:<28s} {:>10s} {:>10.2f}'.format('wall time', '', elapsed))
+        return '\n'.join(lines)
+
+    def dump(self, path: str = None):
+        """
+        Write the summary table and the stack samples (if sampling)
+        :param path: path prefix of the dump files (default: dump_path, numbered)
+        """
+        if path is None:
+            if self._dump_path is None:
+                return
+            path = '{:s}_{:d}'.format(self._dump_path, self._dumps)
+            self._dumps += 1
+        with open(path + '.txt', 'w') as fh:
+            fh.write(self.summary() + '\n')
+        if self._sampler is not None:
+            self._sampler.dump(path + '.stacks')
+
+    def close(self):
+        """
+        Stop the sampling profiler and write the final dump (if dump_path is given)
+        """
+        if self._sampler is not None:
+            self._sampler.stop()
+        self.dump()
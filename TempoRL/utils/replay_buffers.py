@@ -0,0 +1,236 @@
+"""
+NumPy backed replay storage shared by the TempoRL agents.
+
+The agents in run_featurized_experiments.py and run_atari_experiments.py keep their familiar ReplayBuffer,
+SkipReplayBuffer and NoneConcatSkipReplayBuffer classes but store the data in a RingBuffer.
+For stacked image observations (Atari) a FrameRingBuffer stores every frame only once as uint8 in a FrameStore.
+"""
+import collections
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Preallocated, typed column storage with a write pointer.
+    Each column (field) is a single NumPy array of shape (max_size, *item_shape). Columns are allocated on the first
+    insertion, such that the shape of the stored items does not have to be known upfront.
+    Once the buffer is full the oldest entry is overwritten, i.e. insertion is O(1).
+    Batches are gathered with one fancy-indexing call per column into freshly allocated batch arrays.
+    """
+
+    def __init__(self, max_size, fields, dtypes=None):
+        """
+        :param max_size: maximal number of entries to store
+        :param fields: names of the columns in the order in which values are passed to add
+        :param dtypes: optional dictionary mapping field names to dtypes. Defaults to float32 for all fields.
+        """
+        self.max_size = int(max_size)
+        self.fields = tuple(fields)
+        self._dtypes = dtypes or {}
+        self._columns = None
+        self.ptr = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _allocate(self, values):
+        self._columns = []
+        for field, value in zip(self.fields, values):
+            value = np.asarray(value)
+            dtype = self._dtypes.get(field, np.float32)
+            self._columns.append(np.zeros((self.max_size, *value.shape), dtype=dtype))
+
+    def add(self, *values):
+        """
+        Store one entry. Values have to be given in the same order as the fields.
+        """
+        if self._columns is None:
+            self._allocate(values)
+        for column, value in zip(self._columns, values):
+            column[self.ptr] = value
+        self.ptr = (self.ptr + 1) % self.max_size
+        self.size = min(self.size + 1, self.max_size)
+
+    def sample_indices(self, batch_size):
+        """
+        Uniformly sample indices of stored entries (with replacement)
+        """
+        return np.random.randint(0, self.size, size=batch_size)
+
+    def gather(self, indices):
+        """
+        Gather the entries at the given indices.
+        The returned arrays are new copies, i.e. tensors sharing their memory (torch.from_numpy) stay valid when
+        further batches are gathered.
+        :param indices: integer array of indices into the buffer
+        :return: list of arrays, one per field
+        """
+        return [np.take(column, indices, axis=0) for column in self._columns]
+
+    def random_batch(self, batch_size):
+        """
+        Sample a batch uniformly at random.
+        :return: list of arrays, one per field
+        """
+        return self.gather(self.sample_indices(batch_size))
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes used by the stored entries
+        """
+        if self._columns is None:
+            return 0
+        return self.size * sum(column[0].nbytes for column in self._columns)
+
+
+class FrameStore:
+    """
+    Stores the individual frames of stacked image observations (e.g. 4x84x84 Atari observations) exactly once as uint8.
+    Observations are represented by the ids of their frames. Consecutive observations of a frame stack share all but
+    their newest frame, so every environment step typically adds a single frame.
+
+    Frame ids increase monotonically. Frame id i is stored in slot i % capacity, i.e. once the store is full the oldest
+    frames are overwritten. Observations referencing overwritten frames are no longer valid (see oldest_valid_id).
+    """
+
+    def __init__(self, capacity, cache_size=32):
+        """
+        :param capacity: maximal number of frames to store
+        :param cache_size: number of recently added observations that are checked for duplicates before storing frames.
+                           Should be at least the maximal skip length, as all observations seen while skipping are
+                           added to the skip buffer after the fact.
+        """
+        self.capacity = int(capacity)
+        self._frames = None
+        self._scale = None
+        self._num_frames = 0  # total number of frames ever added, i.e. the next frame id
+        self._cache = collections.deque(maxlen=cache_size)  # (uint8 frames, ids) of recently added observations
+
+    def _to_uint8(self, observation):
+        observation = np.asarray(observation)
+        if self._scale is None:
+            # Observations of make_env are uint8 in [0, 255], the ones of make_env_old float32 in [0, 1]
+            self._scale = 255. if np.issubdtype(observation.dtype, np.floating) else 1.
+            self._frames = np.zeros((self.capacity, *observation.shape[1:]), dtype=np.uint8)
+        if self._scale != 1.:
+            return np.rint(observation * self._scale).astype(np.uint8)
+        return np.array(observation, dtype=np.uint8)
+
+    def _push(self, frame):
+        self._frames[self._num_frames % self.capacity] = frame
+        self._num_frames += 1
+        return self._num_frames - 1
+
+    @property
+    def oldest_valid_id(self):
+        return max(0, self._num_frames - self.capacity)
+
+    def add(self, observation):
+        """
+        Store the frames of a stacked observation that are not yet stored.
+        :param observation: stacked observation of shape (history_len, height, width)
+        :return: int64 array of shape (history_len,) with the frame ids of the observation
+        """
+        frames = self._to_uint8(observation)
+        oldest_valid_id = self.oldest_valid_id
+        for cached_frames, ids in reversed(self._cache):
+            if ids[0] >= oldest_valid_id and np.array_equal(cached_frames, frames):
+                return ids
+
+        ids = np.empty(len(frames), dtype=np.int64)
+        start = 0
+        if self._cache:
+            last_frames, last_ids = self._cache[-1]
+            if len(frames) > 1 and last_ids[1] >= oldest_valid_id and np.array_equal(last_frames[1:], frames[:-1]):
+                # The frame stack moved by one frame. Only the newest frame is new
+                ids[:-1] = last_ids[1:]
+                start = len(frames) - 1
+        for i in range(start, len(frames)):
+            if i > 0 and np.array_equal(frames[i], frames[i - 1]):  # e.g. repeated first frame after a reset
+                ids[i] = ids[i - 1]
+            else:
+                ids[i] = self._push(frames[i])
+        self._cache.append((frames, ids))
+        return ids
+
+    def decode(self, ids, out=None):
+        """
+        Rebuild stacked float32 observations from frame ids
+        :param ids: int64 array of shape (batch_size, history_len)
+        :param out: optional float32 array of shape (batch_size, history_len, height, width) to write the result to
+        """
+        frames = np.take(self._frames, ids % self.capacity, axis=0)
+        if out is None:
+            out = np.empty(frames.shape, dtype=np.float32)
+        if self._scale != 1.:
+            np.divide(frames, np.float32(self._scale), out=out, dtype=np.float32)
+        else:
+            np.copyto(out, frames)
+        return out
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes used by the stored frames
+        """
+        return 0 if self._frames is None else len(self) * self._frames[0].nbytes
+
+    def __len__(self):
+        return min(self._num_frames, self.capacity)
+
+
+class FrameRingBuffer(RingBuffer):
+    """
+    RingBuffer for stacked image observations. The observation fields only hold frame ids into a FrameStore
+    (which can be shared between buffers) and are rebuilt to float32 observations when gathering a batch.
+    Entries referencing frames that were overwritten in the FrameStore are dropped.
+    """
+
+    def __init__(self, max_size, fields, frame_store, frame_fields=("states", "next_states"), dtypes=None):
+        """
+        :param max_size: maximal number of entries to store
+        :param fields: names of the columns in the order in which values are passed to add
+        :param frame_store: FrameStore in which the frames of the observations are stored
+        :param frame_fields: names of the fields that contain stacked observations
+        :param dtypes: optional dictionary mapping field names to dtypes. Defaults to float32 for all other fields.
+        """
+        dtypes = dict(dtypes or {})
+        dtypes.update({field: np.int64 for field in frame_fields})
+        super(FrameRingBuffer, self).__init__(max_size, fields, dtypes)
+        self.frame_store = frame_store
+        self._frame_idxs = [self.fields.index(field) for field in frame_fields]
+        self._oldest_ids = np.zeros(self.max_size, dtype=np.int64)  # smallest frame id referenced by each entry
+
+    def add(self, *values):
+        values = list(values)
+        oldest_id = np.inf
+        for idx in self._frame_idxs:
+            values[idx] = self.frame_store.add(values[idx])
+            oldest_id = min(oldest_id, values[idx][0])
+        self._oldest_ids[self.ptr] = oldest_id
+        super(FrameRingBuffer, self).add(*values)
+
+        # Drop the oldest entries if their frames have been overwritten in the meantime
+        oldest_valid_id = self.frame_store.oldest_valid_id
+        while self.size > 0 and self._oldest_ids[(self.ptr - self.size) % self.max_size] < oldest_valid_id:
+            self.size -= 1
+
+    def sample_indices(self, batch_size):
+        # The valid entries are the "size" entries before the write pointer
+        return (self.ptr - self.size + np.random.randint(0, self.size, size=batch_size)) % self.max_size
+
+    def gather(self, indices):
+        batch = super(FrameRingBuffer, self).gather(indices)
+        for idx in self._frame_idxs:
+            batch[idx] = self.frame_store.decode(batch[idx])
+        return batch
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes used by the stored entries (without the shared FrameStore)
+        """
+        return super(FrameRingBuffer, self).nbytes + self.size * self._oldest_ids.itemsize
@@ -0,0 +1,152 @@
+"""
+Cache of parsed experiment results for utils/data_handling.
+
+Re-plotting hundreds of runs used to unpickle every test_data.pkl and parse every eval_scores.json on every notebook
+run. ResultsCache keeps the parsed arrays of all files of one kind in a single columnar .npz file (the values of every
+column concatenated over all files, plus offsets). Only files whose modification time or size changed since they
+were cached are parsed again, in parallel worker processes.
+The cache is stored in RESULTS_CACHE_DIR (the TEMPORL_CACHE_DIR environment variable, ~/.cache/temporl by default).
+An empty TEMPORL_CACHE_DIR disables the cache file, results are then only cached in memory.
+"""
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from utils.disk_cache import CACHE_DIR, save_npz
+
+RESULTS_CACHE_DIR = CACHE_DIR
+_CACHE_VERSION = 1  # increase when the parsers change, to invalidate cached results
+_caches = {}  # kind -> ResultsCache, such that repeated loads in one session do not re-read the cache file
+
+
+def parse_pickled_tuple(path):
+    """
+    Columns of a pickled tuple of lists, e.g. test_data.pkl (test rewards, test lengths) or steps_per_episode.pkl
+    (train steps, test steps). The columns are named by their position in the tuple.
+    """
+    with open(path, 'rb') as fh:
+        data = pickle.load(fh)
+    return {str(i): np.asarray(column) for i, column in enumerate(data)}
+
+
+def parse_eval_scores(path):
+    """
+    Columns of an eval_scores.json with one json dict of evaluation statistics per line. Records without a field get
+    NaN for it.
+    """
+    records = []
+    with open(path, 'r') as fh:
+        for line in fh:
+            records.append(json.loads(line))
+    fields = []
+    for record in records:
+        fields.extend(field for field in record if field not in fields)
+    return {field: np.array([record.get(field, np.nan) for record in records], dtype=np.float64) for field in fields}
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ResultsCache:
+    """
+    Parsed results (a dict of 1-D column arrays per file) of all files of one kind, keyed by their absolute paths
+    """
+
+    def __init__(self, kind: str, parse, cache_dir: str = RESULTS_CACHE_DIR):
+        """
+        :param kind: name of the cache file
+        :param parse: function mapping a path to a dict of 1-D arrays (has to be picklable for the worker processes)
+        :param cache_dir: directory of the cache file (None to only cache in memory)
+        """
+        self._parse = parse
+        self._path = None if cache_dir is None else os.path.join(
+            cache_dir, 'results_{:s}_v{:d}.npz'.format(kind, _CACHE_VERSION))
+        self._entries = {}  # path -> ((mtime_ns, size), columns)
+        self._cache_stat = None  # stat of the cache file when it was read or written
+        self._read()
+
+    def load(self, files, workers: int = None):
+        """
+        Parsed results of files, parsing only new and changed files
+        :param files: paths of the files
+        :param workers: number of processes to parse the changed files with (default: number of CPUs, 1 for serial)
+        :return: list with a dict of column arrays per file (None for files that do not exist)
+        """
+        self._read()
+        paths = [os.path.abspath(file) for file in files]
+        with ThreadPoolExecutor(max_workers=32) as pool:  # stat in parallel, e.g. for network file systems
+            stats = list(pool.map(_stat, paths))
+        stale = sorted({path for path, stat in zip(paths, stats)
+                        if stat is not None and self._entries.get(path, (None,))[0] != stat})
+        if stale:
+            if workers == 1 or len(stale) == 1:
+                parsed = list(map(self._parse, stale))
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    parsed = list(pool.map(self._parse, stale, chunksize=max(1, len(stale) // 64)))
+            current = dict(zip(paths, stats))
+            for path, columns in zip(stale, parsed):
+                self._entries[path] = (current[path], columns)
+            self._write()
+        return [None if stat is None else self._entries[path][1] for path, stat in zip(paths, stats)]
+
+    def _read(self):
+        """
+        (Re-)read the cache file if it was changed (e.g. by another process) since it was last read or written
+        """
+        if self._path is None or _stat(self._path) in (None, self._cache_stat):
+            return
+        with np.load(self._path, allow_pickle=True) as data:
+            paths, mtimes, sizes = data['paths'].tolist(), data['mtimes'].tolist(), data['sizes'].tolist()
+            entries = [((mtime, size), {}) for mtime, size in zip(mtimes, sizes)]
+            for column in data['columns'].tolist():
+                values, offsets = data['values__' + column], data['offsets__' + column].tolist()
+                for i, dtype in enumerate(data['dtypes__' + column].tolist()):
+                    if dtype:  # empty dtype: the file has no such column
+                        entries[i][1][column] = values[offsets[i]:offsets[i + 1]].astype(dtype)
+        self._entries.update(zip(paths, entries))
+        self._cache_stat = _stat(self._path)
+
+    def _write(self):
+        if self._path is None:
+            return
+        paths = sorted(self._entries)
+        entries = [self._entries[path] for path in paths]
+        columns = sorted({column for _, file_columns in entries for column in file_columns})
+        arrays = dict(paths=np.array(paths, dtype=str),
+                      mtimes=np.array([stat[0] for stat, _ in entries], dtype=np.int64),
+                      sizes=np.array([stat[1] for stat, _ in entries], dtype=np.int64),
+                      columns=np.array(columns, dtype=str))
+        for column in columns:
+            values = [file_columns.get(column) for _, file_columns in entries]
+            lengths = [0 if value is None else len(value) for value in values]
+            arrays['values__' + column] = np.concatenate([value for value in values if value is not None])
+            arrays['offsets__' + column] = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+            arrays['dtypes__' + column] = np.array(['' if value is None else value.dtype.str for value in values])
+        if save_npz(self._path, **arrays):
+            self._cache_stat = _stat(self._path)
+
+
+def load_results(files, kind: str, use_cache: bool = True, workers: int = None):
+    """
+    Parsed results of files of one kind
+    :param files: paths of the files
+    :param kind: 'pickled_tuple' (test_data.pkl, steps_per_episode.pkl) or 'eval_scores' (eval_scores.json)
+    :param use_cache: use the results cache. Otherwise all files are parsed (serially) without caching.
+    :param workers: number of processes to parse changed files with
+    :return: list with a dict of column arrays per file (None for files that do not exist)
+    """
+    parse = {'pickled_tuple': parse_pickled_tuple, 'eval_scores': parse_eval_scores}[kind]
+    if not use_cache:
+        return [parse(file) if os.path.exists(file) else None for file in files]
+    if kind not in _caches:
+        _caches[kind] = ResultsCache(kind, parse, RESULTS_CACHE_DIR)
+    return _caches[kind].load(files, workers)
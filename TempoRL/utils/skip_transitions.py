@@ -0,0 +1,53 @@
+"""
+Helper to compute the returns of all skip transitions observed while repeating an action.
+Shared by the TempoRL agents in run_featurized_experiments.py, run_atari_experiments.py and run_ddpg_experiments.py.
+"""
+import numpy as np
+
+
+class SkipReturnAccumulator:
+    """
+    Incrementally computes the discounted returns of all skips that can be built from the steps of one repeated action.
+    After the t-th step (0-indexed) the skip starting at step i (i <= t) has length t - i + 1 and return
+        sum_{j=i}^{t} gamma^(j - i) * r_j
+    Each new reward is added to the running returns of all start steps in one vectorized operation, i.e. O(k) per step
+    instead of recomputing all suffix sums.
+    """
+
+    def __init__(self, gamma: float, max_skip: int = 1):
+        """
+        :param gamma: discount factor
+        :param max_skip: expected maximal number of steps per repetition (grows automatically if exceeded)
+        """
+        self._gamma = gamma
+        self._allocate(max_skip)
+        self.t = 0
+
+    def _allocate(self, max_skip):
+        exps = np.arange(max_skip)
+        self._powers = np.array([np.power(self._gamma, exp) for exp in exps])
+        self._starts = exps
+        self._returns = np.zeros(max_skip)
+        self._lengths = exps[::-1] + 1  # lengths of the skips after the last step of a max_skip repetition
+
+    def reset(self):
+        """
+        Start a new repetition
+        """
+        self.t = 0
+
+    def add(self, reward: float):
+        """
+        Add the reward of the next step
+        :return: (starts, lengths, returns) of all skips ending in this step. starts are the indices of the steps
+                 at which the skips started, i.e. starts[i] == i. The arrays are only valid until the next call.
+        """
+        t = self.t
+        if t >= len(self._returns):
+            returns = self._returns[:t]
+            self._allocate(2 * len(self._returns))
+            self._returns[:t] = returns
+        self._returns[t] = 0.
+        self._returns[:t + 1] += self._powers[t::-1] * reward  # gamma^(t - i) for start i
+        self.t += 1
+        return self._starts[:self.t], self._lengths[-self.t:], self._returns[:self.t]
@@ -0,0 +1,395 @@
+"""
+Fast reader of the scalar summaries in TensorBoard event files (events.out.tfevents.*), without TensorFlow.
+
+Every record of an event file is framed as (uint64 length, uint32 masked crc of the length, data, uint32 masked crc of
+the data), where data is a serialized Event protobuf. The records are decoded with a minimal protobuf wire-format
+decoder that only extracts wall_time, step and the scalar summary values (simple_value, or a single float of a tensor as
+written by newer summary writers). The CRCs are not checked. A record that is not complete yet (the file is still being
+written) ends the scan and is decoded with the next update.
+
+A run directory holds several event files when it was rerun (or when several runs wrote to it at the same time). The
+event files are merged in the order of their first wall time, keeping the order of the records in each file, and a
+point of a tag is dropped when a later point of the tag has the same or a smaller step (the run was restarted). This
+leaves one point per step in increasing step order, and a rerun replaces the points of earlier runs from its first step.
+
+The decoded points are cached per run directory in a columnar .npz file (step, wall_time, value and source file of
+every tag) in <RESULTS_CACHE_DIR>/tfevents, together with the size and modification time of every event file and the
+offset up to which it was decoded. As event files are only appended to, grown files are decoded from that offset only.
+Without a RESULTS_CACHE_DIR (an empty TEMPORL_CACHE_DIR) runs are only cached in memory.
+
+Example:
+    from utils.tfevents import scalar_curves
+    steps, mean, std, count = scalar_curves('experiments/featurized_results/sparsemountain/tdqn/*',
+                                            'avg_rew_per_eval_ep')
+"""
+import glob
+import hashlib
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils import results_cache
+from utils.disk_cache import save_npz
+
+_CACHE_VERSION = 1  # increase when the decoder changes, to invalidate cached runs
+_PREFIX = 'events.out.tfevents'
+_HEADER = struct.Struct('<QI')  # length, masked crc of the length
+_FLOAT = struct.Struct('<f')
+_DOUBLE = struct.Struct('<d')
+_DT_FLOAT, _DT_DOUBLE = 1, 2  # tensorflow DataType enum values
+_runs = {}  # absolute run directory -> run entry, such that repeated queries in one session do not re-read the cache
+
+SCALAR_DTYPE = np.dtype([('step', '<i8'), ('wall_time', '<f8'), ('value', '<f8')])
+
+
+def _varint(buf, pos):
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _skip(buf, pos, wire):
+    if wire == 0:
+        return _varint(buf, pos)[1]
+    if wire == 1:
+        return pos + 8
+    if wire == 2:
+        length, pos = _varint(buf, pos)
+        return pos + length
+    if wire == 5:
+        return pos + 4
+    raise ValueError('Unsupported protobuf wire type {:d}'.format(wire))
+
+
+def _tensor_scalar(buf, pos, end):
+    """
+    The value of a TensorProto holding a single float or double, otherwise None
+    """
+    dtype, values, content = 0, [], b''
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if field == 1 and wire == 0:
+            dtype, pos = _varint(buf, pos)
+        elif field == 4 and wire == 2:
+            length, pos = _varint(buf, pos)
+            content, pos = bytes(buf[pos:pos + length]), pos + length
+        elif field in (5, 6) and wire == 2:  # packed float_val / double_val
+            length, pos = _varint(buf, pos)
+            fmt = _FLOAT if field == 5 else _DOUBLE
+            values.extend(value for value, in fmt.iter_unpack(buf[pos:pos + length]))
+            pos += length
+        elif field == 5 and wire == 5:
+            values.append(_FLOAT.unpack_from(buf, pos)[0])
+            pos += 4
+        elif field == 6 and wire == 1:
+            values.append(_DOUBLE.unpack_from(buf, pos)[0])
+            pos += 8
+        else:
+            pos = _skip(buf, pos, wire)
+    if dtype == _DT_FLOAT and len(content) == 4:
+        return _FLOAT.unpack(content)[0]
+    if dtype == _DT_DOUBLE and len(content) == 8:
+        return _DOUBLE.unpack(content)[0]
+    if dtype in (_DT_FLOAT, _DT_DOUBLE) and len(values) == 1:
+        return values[0]
+    return None
+
+
+def _summary_value(buf, pos, end):
+    """
+    (tag, value) of a Summary.Value, value is None if it is not a scalar
+    """
+    tag, value = None, None
+    while pos < end:
+        key = buf[pos]
+        if key < 0x80:  # inline the common single byte varints
+            pos += 1
+        else:
+            key, pos = _varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if field == 1 and wire == 2:
+            length = buf[pos]
+            if length < 0x80:
+                pos += 1
+            else:
+                length, pos = _varint(buf, pos)
+            tag, pos = bytes(buf[pos:pos + length]).decode('utf-8'), pos + length
+        elif field == 2 and wire == 5:
+            value, pos = _FLOAT.unpack_from(buf, pos)[0], pos + 4
+        elif field == 8 and wire == 2:
+            length, pos = _varint(buf, pos)
+            value, pos = _tensor_scalar(buf, pos, pos + length), pos + length
+        else:
+            pos = _skip(buf, pos, wire)
+    return tag, value
+
+
+def parse_event(buf, pos: int = 0, end: int = None):
+    """
+    Scalar summaries of one serialized Event
+    :param buf: bytes holding the event
+    :param pos: start of the event in buf
+    :param end: end of the event in buf (default: end of buf)
+    :return: wall_time, step, list of (tag, value)
+    """
+    end = len(buf) if end is None else end
+    wall_time, step, scalars = 0., 0, []
+    while pos < end:
+        key = buf[pos]
+        if key < 0x80:  # inline the common single byte varints
+            pos += 1
+        else:
+            key, pos = _varint(buf, pos)
+        field, wire = key >> 3, key & 7
+        if field == 1 and wire == 1:
+            wall_time, pos = _DOUBLE.unpack_from(buf, pos)[0], pos + 8
+        elif field == 2 and wire == 0:
+            step, pos = _varint(buf, pos)
+            if step >= 1 << 63:  # negative int64
+                step -= 1 << 64
+        elif field == 5 and wire == 2:  # summary
+            length, pos = _varint(buf, pos)
+            summary_end = pos + length
+            while pos < summary_end:
+                key, pos = _varint(buf, pos)
+                if key == 0x0a:  # value (field 1, length delimited)
+                    length = buf[pos]
+                    if length < 0x80:
+                        pos += 1
+                    else:
+                        length, pos = _varint(buf, pos)
+                    tag, value = _summary_value(buf, pos, pos + length)
+                    if tag is not None and value is not None:
+                        scalars.append((tag, value))
+                    pos += length
+                else:
+                    pos = _skip(buf, pos, key & 7)
+        else:
+            pos = _skip(buf, pos, wire)
+    return wall_time, step, scalars
+
+
+def scan_event_file(path, offset: int = 0):
+    """
+    Decode the scalar summaries of the complete records of an event file
+    :param path: path of the event file
+    :param offset: byte offset of the first record to decode (the end offset of a previous scan)
+    :return: dict tag -> (list of steps, list of wall times, list of values), offset after the last complete record
+    """
+    with open(path, 'rb') as fh:
+        fh.seek(offset)
+        data = fh.read()
+    tags = {}
+    pos, size = 0, len(data)
+    while pos + _HEADER.size <= size:
+        length, _ = _HEADER.unpack_from(data, pos)
+        start = pos + _HEADER.size
+        if start + length + 4 > size:  # incomplete record
+            break
+        wall_time, step, scalars = parse_event(data, start, start + length)
+        for tag, value in scalars:
+            if tag not in tags:
+                tags[tag] = ([], [], [])
+            steps, wall_times, values = tags[tag]
+            steps.append(step)
+            wall_times.append(wall_time)
+            values.append(value)
+        pos = start + length + 4
+    return tags, offset + pos
+
+
+def _event_files(run_dir):
+    return sorted(name for name in os.listdir(run_dir) if name.startswith(_PREFIX))
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _cache_path(run_dir):
+    if results_cache.RESULTS_CACHE_DIR is None:
+        return None
+    key = hashlib.sha1(run_dir.encode('utf-8')).hexdigest()[:20]
+    return os.path.join(results_cache.RESULTS_CACHE_DIR, 'tfevents', '{:s}_v{:d}.npz'.format(key, _CACHE_VERSION))
+
+
+def _empty_run(run_dir):
+    # files: name -> ((mtime_ns, size), decoded offset); tags: tag -> dict of column arrays
+    return dict(run=run_dir, files={}, tags={})
+
+
+def _read_cache(run_dir):
+    path = _cache_path(run_dir)
+    if path is None:
+        return _empty_run(run_dir)
+    try:
+        with np.load(path) as data:
+            if str(data['run']) != run_dir:
+                return _empty_run(run_dir)
+            files = {name: ((mtime, size), offset) for name, mtime, size, offset in zip(
+                data['files'].tolist(), data['mtimes'].tolist(), data['sizes'].tolist(), data['offsets'].tolist())}
+            tags = {tag: {column: data['{:s}__{:d}'.format(column, i)] for column in ('file',) + SCALAR_DTYPE.names}
+                    for i, tag in enumerate(data['tags'].tolist())}
+    except (OSError, KeyError, ValueError):
+        return _empty_run(run_dir)
+    return dict(run=run_dir, files=files, tags=tags)
+
+
+def _write_cache(run):
+    path = _cache_path(run['run'])
+    if path is None:
+        return
+    names = sorted(run['files'])
+    tags = sorted(run['tags'])
+    arrays = dict(run=np.array(run['run']), files=np.array(names, dtype=str),
+                  mtimes=np.array([run['files'][name][0][0] for name in names], dtype=np.int64),
+                  sizes=np.array([run['files'][name][0][1] for name in names], dtype=np.int64),
+                  offsets=np.array([run['files'][name][1] for name in names], dtype=np.int64),
+                  tags=np.array(tags, dtype=str))
+    for i, tag in enumerate(tags):
+        for column, values in run['tags'][tag].items():
+            arrays['{:s}__{:d}'.format(column, i)] = values
+    save_npz(path, **arrays)
+
+
+def _update_run(run_dir, run=None, use_cache=True):
+    """
+    Bring the decoded points of a run up to date with its event files
+    :param run_dir: absolute path of the run directory
+    :param run: run entry of a previous update (default: read from the cache file)
+    :param use_cache: read and write the cache file
+    :return: updated run entry
+    """
+    if run is None:
+        run = _read_cache(run_dir) if use_cache else _empty_run(run_dir)
+    names = _event_files(run_dir)
+    stats = {name: _stat(os.path.join(run_dir, name)) for name in names}
+    if all(run['files'].get(name, (None,))[0] == stats[name] for name in names) and len(run['files']) == len(names):
+        return run
+    files, offsets = {}, {}
+    for name in names:
+        cached = run['files'].get(name)
+        # event files are only appended to: continue a grown file after its last decoded record
+        offsets[name] = cached[1] if cached is not None and stats[name][1] >= cached[1] else 0
+    index = {name: i for i, name in enumerate(names)}
+    old_names = sorted(run['files'])
+    renumber = np.array([index[name] if offsets.get(name, 0) > 0 else -1 for name in old_names], dtype=np.int64)
+    columns = {}
+    for tag, arrays in run['tags'].items():  # keep the points of the files that are continued, renumbered
+        new_file = renumber[arrays['file']]
+        mask = new_file >= 0
+        columns[tag] = [dict(file=new_file[mask].astype(np.int32),
+                             **{column: arrays[column][mask] for column in SCALAR_DTYPE.names})]
+    for name in names:
+        if stats[name] == run['files'].get(name, (None,))[0]:
+            files[name] = run['files'][name]
+            continue
+        tags, offset = scan_event_file(os.path.join(run_dir, name), offsets[name])
+        files[name] = (stats[name], offset)
+        for tag, (steps, wall_times, values) in tags.items():
+            columns.setdefault(tag, []).append(dict(
+                file=np.full(len(steps), index[name], dtype=np.int32), step=np.array(steps, dtype=np.int64),
+                wall_time=np.array(wall_times, dtype=np.float64), value=np.array(values, dtype=np.float64)))
+    run = dict(run=run_dir, files=files, tags={
+        tag: {column: np.concatenate([part[column] for part in parts]) for column in parts[0]}
+        for tag, parts in columns.items()})
+    if use_cache:
+        _write_cache(run)
+    return run
+
+
+def merge_points(file, step, wall_time, value):
+    """
+    Merge the points of one tag from all event files of a run: the files are ordered by their first wall time (keeping
+    the order of the points in each file), and a point is dropped when a later point has the same or a smaller step
+    :param file: index of the event file of every point
+    :return: structured array (SCALAR_DTYPE) with increasing steps
+    """
+    starts = np.full(int(file.max()) + 1 if len(file) else 0, np.inf)
+    np.minimum.at(starts, file, wall_time)
+    order = np.lexsort((file, starts[file]))  # stable, i.e. keeps the order within a file
+    step, wall_time, value = step[order], wall_time[order], value[order]
+    later_min = np.minimum.accumulate(step[::-1])[::-1]  # smallest step from each point on
+    keep = step < np.append(later_min[1:], np.iinfo(np.int64).max)
+    points = np.empty(int(keep.sum()), dtype=SCALAR_DTYPE)
+    points['step'], points['wall_time'], points['value'] = step[keep], wall_time[keep], value[keep]
+    return points
+
+
+def find_runs(pattern):
+    """
+    Run directories (directories holding event files) matching a glob pattern or below a matching directory
+    :param pattern: glob pattern of run directories or of directories containing run directories
+    :return: sorted list of run directories
+    """
+    runs = set()
+    for match in glob.glob(pattern, recursive=True):
+        for directory, _, names in os.walk(match):
+            if any(name.startswith(_PREFIX) for name in names):
+                runs.add(directory)
+    return sorted(runs)
+
+
+def load_runs(run_dirs, use_cache: bool = True, workers: int = None):
+    """
+    Merged scalar summaries of several runs
+    :param run_dirs: run directories
+    :param use_cache: use the tfevents cache. Otherwise all event files are decoded (serially) without caching.
+    :param workers: number of processes to decode changed runs with (default: number of CPUs, 1 for serial)
+    :return: list with a dict tag -> structured array (SCALAR_DTYPE) per run
+    """
+    run_dirs = [os.path.abspath(run_dir) for run_dir in run_dirs]
+    if not use_cache:
+        runs = [_update_run(run_dir, use_cache=False) for run_dir in run_dirs]
+    else:
+        # runs already read in this session are updated in place, the others are read from their cache files and
+        # updated in parallel
+        stale = sorted({run_dir for run_dir in run_dirs if run_dir not in _runs})
+        if workers == 1 or len(stale) <= 1:
+            updated = list(map(_update_run, stale))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                updated = list(pool.map(_update_run, stale, chunksize=max(1, len(stale) // 64)))
+        _runs.update(zip(stale, updated))
+        for run_dir in set(run_dirs) - set(stale):
+            _runs[run_dir] = _update_run(run_dir, _runs[run_dir])
+        runs = [_runs[run_dir] for run_dir in run_dirs]
+    return [{tag: merge_points(arrays['file'], arrays['step'], arrays['wall_time'], arrays['value'])
+             for tag, arrays in run['tags'].items()} for run in runs]
+
+
+def load_scalars(run_dir, use_cache: bool = True):
+    """
+    Merged scalar summaries of one run
+    :return: dict tag -> structured array (SCALAR_DTYPE) with fields step, wall_time and value
+    """
+    return load_runs([run_dir], use_cache=use_cache)[0]
+
+
+def scalar_curves(runs, tag: str, use_cache: bool = True, workers: int = None):
+    """
+    Mean and standard deviation of a scalar over runs, e.g. over the seeds of an experiment
+    :param runs: list of run directories, or a glob pattern (see find_runs)
+    :param tag: tag of the scalar, e.g. 'avg_rew_per_eval_ep'
+    :param use_cache: use the tfevents cache
+    :param workers: number of processes to decode changed runs with
+    :return: steps (union over the runs), mean, std, number of runs with a value at each step
+    """
+    run_dirs = find_runs(runs) if isinstance(runs, str) else list(runs)
+    curves = [run[tag] for run in load_runs(run_dirs, use_cache, workers) if tag in run]
+    if not curves:
+        raise ValueError('No run has the tag {:s}'.format(tag))
+    steps = np.unique(np.concatenate([curve['step'] for curve in curves]))
+    values = np.full((len(curves), len(steps)), np.nan)
+    for i, curve in enumerate(curves):
+        values[i, np.searchsorted(steps, curve['step'])] = curve['value']
+    return steps, np.nanmean(values, axis=0), np.nanstd(values, axis=0), np.sum(~np.isnan(values), axis=0)
@@ -0,0 +1,223 @@
+"""
+Batched environments for training the TempoRL agents on several copies of an environment at once.
+
+All vectorized environments share a gym-like batched API:
+    reset(indices=None) -> observations of the (selected) environments, shape (len(indices), *obs_shape)
+    step(actions) -> (observations, rewards, dones, infos) of all environments
+    step_async(actions) / step_wait() -> step split into sending the actions and collecting the results, such that the
+                                         caller can do other work (e.g. a learning update) while the environments step
+Environments are not reset automatically when an episode ends, since the agents decide when an episode is over
+(e.g. after max_env_time_steps).
+"""
+import multiprocessing
+
+import cloudpickle
+import numpy as np
+
+
+class SyncVectorEnv:
+    """
+    Steps N copies of an environment in lockstep in the calling process.
+    """
+
+    def __init__(self, env_fns):
+        """
+        :param env_fns: list of callables that create the environments
+        """
+        self.envs = [env_fn() for env_fn in env_fns]
+        self.num_envs = len(self.envs)
+        self.observation_space = self.envs[0].observation_space
+        self.action_space = self.envs[0].action_space
+        self._actions = None
+
+    def seed(self, seed):
+        for i, env in enumerate(self.envs):
+            env.seed(seed + i)
+
+    def reset(self, indices=None):
+        """
+        Reset the environments with the given indices (all by default)
+        :return: stacked observations of the reset environments
+        """
+        if indices is None:
+            indices = range(self.num_envs)
+        return np.stack([np.asarray(self.envs[i].reset()) for i in indices])
+
+    def step_async(self, actions):
+        self._actions = actions
+
+    def step_wait(self):
+        observations, rewards, dones, infos = zip(*[env.step(a) for env, a in zip(self.envs, self._actions)])
+        return np.stack([np.asarray(o) for o in observations]), np.array(rewards, dtype=np.float64), \
+            np.array(dones, dtype=bool), list(infos)
+
+    def step(self, actions):
+        """
+        Perform one step in every environment
+        :param actions: one action per environment
+        :return: stacked observations, rewards, done flags and a list of infos
+        """
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+
+
+class _CloudpickleWrapper:
+    """
+    Uses cloudpickle to serialize the environment constructors (e.g. lambdas) for the worker processes
+    """
+
+    def __init__(self, x):
+        self.x = x
+
+    def __getstate__(self):
+        return cloudpickle.dumps(self.x)
+
+    def __setstate__(self, state):
+        self.x = cloudpickle.loads(state)
+
+
+def _worker(remote, parent_remote, env_fns, env_ids, shared_observations, shape, dtype):
+    """
+    Worker loop of SubprocVectorEnv. Steps its environments on request and writes their observations directly into
+    the shared observation buffer. Only rewards, done flags and infos are sent back through the pipe.
+    """
+    parent_remote.close()
+    envs = [env_fn() for env_fn in env_fns.x]
+    observations = np.frombuffer(shared_observations, dtype=dtype).reshape((-1, *shape))
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                rewards, dones, infos = [], [], []
+                for env_id, env, action in zip(env_ids, envs, data):
+                    observation, reward, done, info = env.step(action)
+                    observations[env_id] = observation
+                    rewards.append(reward)
+                    dones.append(done)
+                    infos.append(info)
+                remote.send((rewards, dones, infos))
+            elif cmd == 'reset':
+                for i in data:
+                    observations[env_ids[i]] = envs[i].reset()
+                remote.send(None)
+            elif cmd == 'seed':
+                for i, env in enumerate(envs):
+                    env.seed(data + env_ids[i])
+                remote.send(None)
+            elif cmd == 'close':
+                break
+            else:
+                raise NotImplementedError(cmd)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for env in envs:
+            env.close()
+
+
+class SubprocVectorEnv:
+    """
+    Steps N environments in worker processes. Every worker owns a contiguous block of the environments.
+    The workers write observations into one shared memory buffer of shape (N, *obs_shape), i.e. observations
+    (e.g. stacked Atari frames) are never pickled. Only actions, rewards, done flags and infos go through pipes.
+
+    The environment constructors have to be picklable with cloudpickle. One environment is created in the calling
+    process to determine the observation shape and dtype.
+    """
+
+    def __init__(self, env_fns, num_workers=None, start_method=None):
+        """
+        :param env_fns: list of callables that create the environments
+        :param num_workers: number of worker processes (defaults to one per environment)
+        :param start_method: multiprocessing start method (defaults to the platform default)
+        """
+        self.num_envs = len(env_fns)
+        num_workers = min(num_workers or self.num_envs, self.num_envs)
+
+        probe = env_fns[0]()
+        self.observation_space = probe.observation_space
+        self.action_space = probe.action_space
+        observation = np.asarray(probe.reset())
+        probe.close()
+
+        ctx = multiprocessing.get_context(start_method)
+        self._shared_observations = ctx.RawArray('b', self.num_envs * observation.nbytes)
+        self._observations = np.frombuffer(self._shared_observations, dtype=observation.dtype).reshape(
+            (self.num_envs, *observation.shape))
+
+        self._env_ids = np.array_split(np.arange(self.num_envs), num_workers)
+        self._worker_of = np.concatenate([np.full(len(ids), w) for w, ids in enumerate(self._env_ids)])
+        self._local_id = np.concatenate([np.arange(len(ids)) for ids in self._env_ids])
+        self._remotes, self._processes = [], []
+        for env_ids in self._env_ids:
+            remote, work_remote = ctx.Pipe()
+            process = ctx.Process(target=_worker, args=(
+                work_remote, remote, _CloudpickleWrapper([env_fns[i] for i in env_ids]), env_ids,
+                self._shared_observations, observation.shape, observation.dtype), daemon=True)
+            process.start()
+            work_remote.close()
+            self._remotes.append(remote)
+            self._processes.append(process)
+        self._waiting = False
+        self._closed = False
+
+    def seed(self, seed):
+        for remote in self._remotes:
+            remote.send(('seed', seed))
+        for remote in self._remotes:
+            remote.recv()
+
+    def reset(self, indices=None):
+        """
+        Reset the environments with the given indices (all by default)
+        :return: stacked observations of the reset environments
+        """
+        indices = np.arange(self.num_envs) if indices is None else np.asarray(indices)
+        workers = self._worker_of[indices]
+        active = np.unique(workers)
+        for w in active:
+            self._remotes[w].send(('reset', self._local_id[indices[workers == w]]))
+        for w in active:
+            self._remotes[w].recv()
+        return self._observations[indices]
+
+    def step_async(self, actions):
+        for remote, env_ids in zip(self._remotes, self._env_ids):
+            remote.send(('step', [actions[i] for i in env_ids]))
+        self._waiting = True
+
+    def step_wait(self):
+        results = [remote.recv() for remote in self._remotes]
+        self._waiting = False
+        rewards, dones, infos = [], [], []
+        for worker_rewards, worker_dones, worker_infos in results:
+            rewards.extend(worker_rewards)
+            dones.extend(worker_dones)
+            infos.extend(worker_infos)
+        # Copy the observations out of the shared buffer as it is overwritten by the next step
+        return self._observations.copy(), np.array(rewards, dtype=np.float64), np.array(dones, dtype=bool), infos
+
+    def step(self, actions):
+        """
+        Perform one step in every environment
+        :param actions: one action per environment
+        :return: stacked observations, rewards, done flags and a list of infos
+        """
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self._closed:
+            return
+        if self._waiting:
+            for remote in self._remotes:
+                remote.recv()
+        for remote in self._remotes:
+            remote.send(('close', None))
+        for process in self._processes:
+            process.join()
+        self._closed = True
@@ -0,0 +1,149 @@
+"""
+Lockstep training of the TempoRL agents on a batched environment (see utils/vec_env.py).
+Used by run_featurized_experiments.py and run_atari_experiments.py with --num-envs > 1.
+"""
+import time
+
+import numpy as np
+import torch
+
+from utils.async_eval import evaluate, report_eval
+from utils.metrics_log import MetricsLog, export_txt
+from utils.skip_transitions import SkipReturnAccumulator
+
+
+class VectorizedRollout:
+    """
+    Trains an agent on N copies of the environment that are stepped in lockstep.
+    Whenever environments finished repeating their last action, the decisions (action and skip) for all of them are
+    computed with one batched forward pass per network (agent.decide). As the agents choose different skips for
+    different environments, every environment tracks its own action repetition and skip transitions.
+
+    The learning updates run while the environments are stepping (step_async/step_wait), i.e. with environments in
+    worker processes (SubprocVectorEnv) learning and simulation overlap.
+    Agents with a scheduled learner stage (agent.update(total_steps), the DQN, DAR and TDQN agents) get it called once
+    for every environment step, such that the replay ratio, learning_starts and the target updates refer to
+    environment steps as in the single environment training. Otherwise agent.learn is called once per lockstep step,
+    i.e. for every N environment steps.
+
+    The agent has to provide decide, add_transition, learn and eval. Agents providing add_skip_transitions
+    (TempoRL) additionally get all observed skip transitions together with the chosen skip.
+    """
+
+    def __init__(self, agent, vec_env, gamma: float, max_skip: int = 1, writer=None, evaluator=None):
+        """
+        :param agent: agent to train
+        :param vec_env: batched environment, e.g. SyncVectorEnv or SubprocVectorEnv
+        :param gamma: discount factor used for the skip returns
+        :param max_skip: maximal skip-size
+        :param writer: optional tensorboard SummaryWriter for the evaluation results
+        :param evaluator: optional utils.async_eval.AsyncEvaluator to run the evaluations in the background
+        """
+        self._agent = agent
+        self._vec_env = vec_env
+        self._writer = writer
+        self._evaluator = evaluator
+        self._learn_skips = hasattr(agent, 'add_skip_transitions')
+        self._skip_returns = [SkipReturnAccumulator(gamma, max_skip) for _ in range(vec_env.num_envs)]
+
+    def _learn(self, total_steps, num_envs):
+        """
+        Perform the learning updates for the last num_envs environment steps
+        :param total_steps: number of environment steps taken so far
+        :param num_envs: number of environment steps taken in the last lockstep step
+        """
+        if hasattr(self._agent, 'update'):
+            for t in range(max(1, total_steps - num_envs + 1), total_steps + 1):
+                self._agent.update(t)
+        elif total_steps > 0:
+            self._agent.learn()
+
+    def train(self, directory, episodes: int, max_env_time_steps: int, epsilon, eval_eps: int = 1,
+              eval_every_n_steps: int = 1, max_train_time_steps: int = 1_000_000):
+        """
+        Training loop
+        :param directory: directory to write the metrics log (and at the end reward.txt and step.txt) to
+        :param episodes: maximum number of episodes (summed over all environments) to train for
+        :param max_env_time_steps: maximum number of steps in the environment to perform per episode
+        :param epsilon: epsilon for exploration when selecting actions. Either a constant or a callable mapping the
+                        number of environment steps to epsilon.
+        :param eval_eps: numper of episodes to run for evaluation
+        :param eval_every_n_steps: interval of steps after which to evaluate the trained agent
+        :param max_train_time_steps: maximum number of steps (summed over all environments) to train
+        """
+        num_envs = self._vec_env.num_envs
+        total_steps, e = 0, 0
+        metrics = MetricsLog(directory)
+        start_time = time.time()
+
+        s = self._vec_env.reset()
+        replay_actions = np.zeros(num_envs, dtype=np.int64)
+        actions = np.zeros(num_envs, dtype=np.int64)
+        skips = np.zeros(num_envs, dtype=np.int64)  # skip chosen for the current action repetition
+        remaining = np.zeros(num_envs, dtype=np.int64)  # number of steps left in the current action repetition
+        es = np.zeros(num_envs, dtype=np.int64)
+        skip_states = [[] for _ in range(num_envs)]
+        while e < episodes and total_steps < max_train_time_steps:
+            deciding = np.flatnonzero(remaining == 0)
+            if len(deciding) > 0:
+                eps = epsilon(total_steps) if callable(epsilon) else epsilon
+                with torch.no_grad():
+                    replay_actions[deciding], actions[deciding], skips[deciding] = self._agent.decide(s[deciding], eps)
+                remaining[deciding] = skips[deciding] + 1
+                for i in deciding:
+                    skip_states[i] = []
+                    self._skip_returns[i].reset()
+
+            self._vec_env.step_async(actions)
+            self._learn(total_steps, num_envs)  # learn on the data so far while the envs step
+            ns, r, d, _ = self._vec_env.step_wait()
+            remaining -= 1
+            es += 1
+            total_steps += num_envs
+
+            for i in range(num_envs):
+                self._agent.add_transition(s[i], replay_actions[i], ns[i], r[i], d[i])
+                if self._learn_skips:
+                    skip_states[i].append(s[i])  # keep track of all observed skips
+                    _, skip_lengths, skip_returns = self._skip_returns[i].add(r[i])
+                    self._agent.add_skip_transitions(skip_states[i], skip_lengths, skip_returns, ns[i], d[i],
+                                                     actions[i], skips[i])
+
+            #### Begin Evaluation
+            if total_steps % eval_every_n_steps < num_envs:  # crossed a multiple of eval_every_n_steps
+                info = dict(elapsed_time=time.time() - start_time, training_steps=total_steps, training_eps=e)
+                self._evaluate(metrics, info, eval_eps, max_env_time_steps)
+            if self._evaluator is not None and self._evaluator.pending:
+                for info, eval_results in self._evaluator.poll():
+                    self._write_eval(metrics, info, eval_results)
+            #### End Evaluation
+
+            # Start new episodes in all environments that are done
+            ended = np.flatnonzero(d | (es >= max_env_time_steps))
+            s = ns
+            if len(ended) > 0:
+                s[ended] = self._vec_env.reset(ended)
+                remaining[ended] = 0
+                es[ended] = 0
+                e += len(ended)
+                print("%s/%s" % (min(e, episodes), episodes))
+
+        # final evaluation
+        if total_steps % eval_every_n_steps >= num_envs:
+            info = dict(elapsed_time=time.time() - start_time, training_steps=total_steps, training_eps=e)
+            self._evaluate(metrics, info, eval_eps, max_env_time_steps)
+        if self._evaluator is not None:
+            for info, eval_results in self._evaluator.close():
+                self._write_eval(metrics, info, eval_results)
+        metrics.close()
+        export_txt(directory)
+
+    def _evaluate(self, metrics, info, eval_eps, max_env_time_steps):
+        for done in evaluate(self._agent, info, eval_eps, max_env_time_steps, self._evaluator):
+            self._write_eval(metrics, *done)
+
+    def _write_eval(self, metrics, info, eval_results):
+        eval_stats = report_eval(info, eval_results, metrics)
+        if self._writer is not None:
+            for each in eval_stats:
+                self._writer.add_scalar(each, eval_stats[each], eval_stats['training_steps'])